@@ -6,12 +6,15 @@ from matplotlib.ticker import FormatStrFormatter
 from torch_geometric.nn import MessagePassing
 import torch_geometric.utils as pyg_utils
 import os
+from functools import partial
 from ParticleGraph.MLP import MLP
 import imageio
 from matplotlib import rc
 import time
 from ParticleGraph.utils import *
 from ParticleGraph.fitting_models import *
+from ParticleGraph.neighbors import radius_graph
+from ParticleGraph.trajectory import load_trajectory
 from ParticleGraph.kan import *
 
 os.environ["PATH"] += os.pathsep + '/usr/local/texlive/2023/bin/x86_64-linux'
@@ -325,8 +328,8 @@ def load_training_data(dataset_name, n_runs, log_dir, device):
     print('Load data ...')
     time.sleep(0.5)
     for run in trange(n_runs):
-        x = torch.load(f'graphs_data/graphs_{dataset_name}/x_list_{run}.pt', map_location=device)
-        y = torch.load(f'graphs_data/graphs_{dataset_name}/y_list_{run}.pt', map_location=device)
+        x = load_trajectory(f'graphs_data/graphs_{dataset_name}/x_list_{run}', device)
+        y = load_trajectory(f'graphs_data/graphs_{dataset_name}/y_list_{run}', device)
         x_list.append(x)
         y_list.append(y)
     vnorm = torch.load(os.path.join(log_dir, 'vnorm.pt'), map_location=device).squeeze()
@@ -509,39 +512,14 @@ def plot_function(bVisu, index, model_name, model_MLP, model_a, dataset_number,
 
     plt.text(-0.25, 1.1, f'{index}', ha='left', va='top', transform=ax.transAxes, fontsize=12)
     plt.title(r'Interaction functions (model)', fontsize=12)
-    func_list = []
-    for n in range(n_particles):
-        embedding_ = model_a[1, n, :] * torch.ones((1000, 2), device=device)
 
-        match model_name:
-            case 'PDE_A':
-                in_features = torch.cat((pos[:, None] / max_radius, 0 * pos[:, None],
-                                         pos[:, None] / max_radius, embedding_), dim=1)
-            case 'PDE_A_bis':
-                in_features = torch.cat((pos[:, None] / max_radius, 0 * pos[:, None],
-                                         pos[:, None] / max_radius, embedding_, embedding_), dim=1)
-            case 'PDE_B' | 'PDE_B_bis':
-                in_features = torch.cat((pos[:, None] / max_radius, 0 * pos[:, None],
-                                         pos[:, None] / max_radius, 0 * pos[:, None], 0 * pos[:, None],
-                                         0 * pos[:, None], 0 * pos[:, None], embedding_), dim=1)
-            case 'PDE_G':
-                in_features = torch.cat((pos[:, None] / max_radius, 0 * pos[:, None],
-                                         pos[:, None] / max_radius, 0 * pos[:, None], 0 * pos[:, None],
-                                         0 * pos[:, None], 0 * pos[:, None], embedding_), dim=1)
-            case 'PDE_GS':
-                in_features = torch.cat((pos[:, None] / max_radius, embedding_), dim=1)
-            case 'PDE_E':
-                in_features = torch.cat((pos[:, None] / max_radius, 0 * pos[:, None],
-                                         pos[:, None] / max_radius, embedding_, embedding_), dim=-1)
+    in_features_fn = partial(edge_function_features, model_name, max_radius=max_radius)
 
-        with torch.no_grad():
-            func = model_MLP(in_features.float())
-        func = func[:, 0]
-        func_list.append(func)
-        if bVisu:
+    func_list = evaluate_edge_function(model_MLP, in_features_fn, pos, model_a[1, 0:n_particles])
+    if bVisu:
+        for n in range(n_particles):
             plt.plot(to_numpy(pos),
-                     to_numpy(func) * to_numpy(ynorm), color=cmap.color(label[n]), linewidth=1)
-    func_list = torch.stack(func_list)
+                     to_numpy(func_list[n]) * to_numpy(ynorm), color=cmap.color(label[n]), linewidth=1)
     func_list = to_numpy(func_list)
     if bVisu:
         plt.xlabel(r'$d_{ij} [a.u.]$', fontsize=12)
@@ -762,13 +740,10 @@ def data_plot_attraction_repulsion(config_file, epoch_list, log_dir, logger, dev
         p = torch.load(f'graphs_data/graphs_{dataset_name}/model_p.pt', map_location=device)
         rr = torch.tensor(np.linspace(0, max_radius, 1000)).to(device)
         rmserr_list = []
+        in_features = partial(edge_function_features, config.graph_model.particle_model_name, max_radius=max_radius)
+        edge_funcs = evaluate_edge_function(model.lin_edge, in_features, rr, model_a_first[1, 0:int(n_particles * (1 - config.training.particle_dropout))])
         for n in range(int(n_particles * (1 - config.training.particle_dropout))):
-            embedding_ = model_a_first[1, n, :] * torch.ones((1000, config.graph_model.embedding_dim), device=device)
-            in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None],
-                                     rr[:, None] / max_radius, embedding_), dim=1)
-            with torch.no_grad():
-                func = model.lin_edge(in_features.float())
-            func = func[:, 0]
+            func = edge_funcs[n]
             true_func = model.psi(rr, p[to_numpy(type_list[n]).astype(int)].squeeze(),
                                   p[to_numpy(type_list[n]).astype(int)].squeeze())
             rmserr_list.append(torch.sqrt(torch.mean((func * ynorm - true_func.squeeze()) ** 2)))
@@ -849,7 +824,9 @@ def data_plot_attraction_repulsion_tracking(config_file, epoch_list, log_dir, lo
     for k in range(n_frames):
         new_index = torch.arange(index, index + n_particles)
         index_l.append(new_index)
-        x_list[1][k][:, 0] = new_index
+        frame = x_list[1][k]
+        frame[:, 0] = new_index
+        x_list[1][k] = frame
         index += n_particles
 
     model, bc_pos, bc_dpos = choose_training_model(config, device)
@@ -875,9 +852,7 @@ def data_plot_attraction_repulsion_tracking(config_file, epoch_list, log_dir, lo
         tracking_index_list = []
         for k in trange(n_frames):
             x = x_list[1][k].clone().detach()
-            distance = torch.sum(bc_dpos(x[:, None, 1:3] - x[None, :, 1:3]) ** 2, dim=2)
-            adj_t = ((distance < max_radius ** 2) & (distance > min_radius ** 2)).float() * 1
-            edges = adj_t.nonzero().t().contiguous()
+            edges = radius_graph(x[:, 1:3], min_radius, max_radius, config.simulation.boundary, config.simulation.neighbor_method)
             dataset = data.Data(x=x[:, :], edge_index=edges)
 
             pred = model(dataset, training=True, vnorm=vnorm, phi=torch.zeros(1, device=device))
@@ -898,9 +873,11 @@ def data_plot_attraction_repulsion_tracking(config_file, epoch_list, log_dir, lo
 
             tracking_index += np.sum((to_numpy(min_index) - np.arange(len(min_index)) == 0)) / n_frames / n_particles * 100
             tracking_index_list.append(np.sum((to_numpy(min_index) - np.arange(len(min_index)) == 0)))
-            x_list[1][k + 1][min_index, 0:1] = x_list[1][k][:, 0:1].clone().detach()
+            frame = x_list[1][k + 1]
+            frame[min_index, 0:1] = x_list[1][k][:, 0:1].clone().detach()
+            x_list[1][k + 1] = frame
 
-        x_ = torch.stack(x_list[1])
+        x_ = torch.stack(list(x_list[1]))
         x_ = torch.reshape(x_, (x_.shape[0] * x_.shape[1], x_.shape[2]))
         x_ = x_[0:(n_frames - 1) * n_particles]
         indexes = np.unique(to_numpy(x_[:, 0]))
@@ -949,13 +926,10 @@ def data_plot_attraction_repulsion_tracking(config_file, epoch_list, log_dir, lo
             p = torch.load(f'graphs_data/graphs_{dataset_name}/model_p.pt', map_location=device)
             rr = torch.tensor(np.linspace(0, max_radius, 1000)).to(device)
             rmserr_list = []
-            for n in indexes:
-                embedding_ = model_a_first[int(n), :] * torch.ones((1000, config.graph_model.embedding_dim), device=device)
-                in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None],
-                                         rr[:, None] / max_radius, embedding_), dim=1)
-                with torch.no_grad():
-                    func = model.lin_edge(in_features.float())
-                func = func[:, 0]
+            in_features = partial(edge_function_features, config.graph_model.particle_model_name, max_radius=max_radius)
+            edge_funcs = evaluate_edge_function(model.lin_edge, in_features, rr, model_a_first[[int(n) for n in indexes]])
+            for k, n in enumerate(indexes):
+                func = edge_funcs[k]
                 true_func = model.psi(rr, p[int(type_list[n])].squeeze(),
                                       p[int(type_list[n])].squeeze())
                 rmserr_list.append(torch.sqrt(torch.mean((func - true_func.squeeze()) ** 2)))
@@ -978,13 +952,10 @@ def data_plot_attraction_repulsion_tracking(config_file, epoch_list, log_dir, lo
             p = torch.load(f'graphs_data/graphs_{dataset_name}/model_p.pt', map_location=device)
             rr = torch.tensor(np.linspace(0, max_radius, 1000)).to(device)
             rmserr_list = []
+            in_features = partial(edge_function_features, config.graph_model.particle_model_name, max_radius=max_radius)
+            edge_funcs = evaluate_edge_function(model.lin_edge, in_features, rr, model_a_first[0:int(n_particles * (1 - config.training.particle_dropout))])
             for n in range(int(n_particles * (1 - config.training.particle_dropout))):
-                embedding_ = model_a_first[n, :] * torch.ones((1000, config.graph_model.embedding_dim), device=device)
-                in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None],
-                                         rr[:, None] / max_radius, embedding_), dim=1)
-                with torch.no_grad():
-                    func = model.lin_edge(in_features.float())
-                func = func[:, 0]
+                func = edge_funcs[n]
                 true_func = model.psi(rr, p[int(type_list[n])].squeeze(),
                                       p[int(type_list[n])].squeeze())
                 rmserr_list.append(torch.sqrt(torch.mean((func - true_func.squeeze()) ** 2)))
@@ -1058,26 +1029,20 @@ def data_plot_attraction_repulsion_asym(config_file, epoch_list, log_dir, logger
         x = x_list[0][100].clone().detach()
         index_particles = get_index_particles(x, n_particle_types, dimension)
         type_list = to_numpy(get_type_list(x, dimension))
-        distance = torch.sum(bc_dpos(x[:, None, 1:dimension + 1] - x[None, :, 1:dimension + 1]) ** 2, dim=2)
-        adj_t = ((distance < max_radius ** 2) & (distance > min_radius ** 2)).float() * 1
-        edges = adj_t.nonzero().t().contiguous()
+        edges = radius_graph(x[:, 1:dimension + 1], min_radius, max_radius, config.simulation.boundary, config.simulation.neighbor_method)
         indexes = np.random.randint(0, edges.shape[1], 5000)
         edges = edges[:, indexes]
 
         fig, ax = fig_init()
         rr = torch.tensor(np.linspace(0, max_radius, 1000)).to(device)
         func_list = []
+        # embeddings of both ends of each edge side by side
+        in_features = partial(edge_pair_function_features, config.graph_model.particle_model_name, max_radius=max_radius)
+        edge_funcs = evaluate_edge_function(model.lin_edge, in_features, rr,
+                                            torch.cat((model.a[1, edges[0]], model.a[1, edges[1]]), dim=1))
         for n in trange(edges.shape[1]):
-            embedding_1 = model.a[1, edges[0, n], :] * torch.ones((1000, config.graph_model.embedding_dim),
-                                                                  device=device)
-            embedding_2 = model.a[1, edges[1, n], :] * torch.ones((1000, config.graph_model.embedding_dim),
-                                                                  device=device)
             type = type_list[to_numpy(edges[0, n])].astype(int)
-            in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None],
-                                     rr[:, None] / max_radius, embedding_1, embedding_2), dim=1)
-            with torch.no_grad():
-                func = model.lin_edge(in_features.float())
-            func = func[:, 0]
+            func = edge_funcs[n]
             func_list.append(func)
             plt.plot(to_numpy(rr),
                      to_numpy(func) * to_numpy(ynorm),
@@ -1173,13 +1138,10 @@ def data_plot_attraction_repulsion_continuous(config_file, epoch_list, log_dir,
         func_list = []
         csv_ = []
         csv_.append(to_numpy(rr))
+        in_features = partial(edge_function_features, config.graph_model.particle_model_name, max_radius=max_radius)
+        edge_funcs = evaluate_edge_function(model.lin_edge, in_features, rr, model.a[1, 0:n_particles])
         for n in range(n_particles):
-            embedding = model.a[1, n, :] * torch.ones((1000, config.graph_model.embedding_dim), device=device)
-            in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None],
-                                     rr[:, None] / max_radius, embedding), dim=1)
-            with torch.no_grad():
-                func = model.lin_edge(in_features.float())
-            func = func[:, 0]
+            func = edge_funcs[n]
             func_list.append(func)
             csv = to_numpy(func)
             plt.plot(to_numpy(rr),
@@ -1272,14 +1234,10 @@ def data_plot_gravity(config_file, epoch_list, log_dir, logger, device):
         p = torch.load(f'graphs_data/graphs_{dataset_name}/model_p.pt', map_location=device)
         rr = torch.tensor(np.linspace(min_radius, max_radius, 1000)).to(device)
         rmserr_list = []
+        in_features = partial(edge_function_features, config.graph_model.particle_model_name, max_radius=max_radius)
+        edge_funcs = evaluate_edge_function(model.lin_edge, in_features, rr, model_a_first[1, 0:int(n_particles * (1 - config.training.particle_dropout))])
         for n in range(int(n_particles * (1 - config.training.particle_dropout))):
-            embedding_ = model_a_first[1, n, :] * torch.ones((1000, config.graph_model.embedding_dim), device=device)
-            in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None],
-                                     rr[:, None] / max_radius, 0 * rr[:, None], 0 * rr[:, None],
-                                     0 * rr[:, None], 0 * rr[:, None], embedding_), dim=1)
-            with torch.no_grad():
-                func = model.lin_edge(in_features.float())
-            func = func[:, 0]
+            func = edge_funcs[n]
             true_func = model.psi(rr, p[to_numpy(type_list[n]).astype(int)].squeeze(),
                                   p[to_numpy(type_list[n]).astype(int)].squeeze())
             rmserr_list.append(torch.sqrt(torch.mean((func * ynorm - true_func.squeeze()) ** 2)))
@@ -1316,14 +1274,10 @@ def data_plot_gravity(config_file, epoch_list, log_dir, logger, device):
 
         rr = torch.tensor(np.linspace(min_radius, max_radius, 1000)).to(device)
         plot_list = []
+        in_features = partial(edge_function_features, config.graph_model.particle_model_name, max_radius=max_radius)
+        edge_funcs = evaluate_edge_function(model.lin_edge, in_features, rr, model_a_first[1, 0:int(n_particles * (1 - config.training.particle_dropout))])
         for n in range(int(n_particles * (1 - config.training.particle_dropout))):
-            embedding_ = model_a_first[1, n, :] * torch.ones((1000, config.graph_model.embedding_dim), device=device)
-            in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None],
-                                     rr[:, None] / max_radius, 0 * rr[:, None], 0 * rr[:, None],
-                                     0 * rr[:, None], 0 * rr[:, None], embedding_), dim=1)
-            with torch.no_grad():
-                pred = model.lin_edge(in_features.float())
-            pred = pred[:, 0]
+            pred = edge_funcs[n]
             plot_list.append(pred * ynorm)
         p = np.linspace(0.5, 5, n_particle_types)
         p_list = p[to_numpy(type_list).astype(int)]
@@ -1507,14 +1461,10 @@ def data_plot_gravity_continuous(config_file, epoch_list, log_dir, logger, devic
         rmserr_list = []
         csv_ = []
         csv_.append(to_numpy(rr))
+        in_features = partial(edge_function_features, config.graph_model.particle_model_name, max_radius=max_radius)
+        edge_funcs = evaluate_edge_function(model.lin_edge, in_features, rr, model.a[1, 0:int(n_particles * (1 - config.training.particle_dropout))])
         for n in range(int(n_particles * (1 - config.training.particle_dropout))):
-            embedding_ = model.a[1, n, :] * torch.ones((1000, config.graph_model.embedding_dim), device=device)
-            in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None],
-                                     rr[:, None] / max_radius, 0 * rr[:, None], 0 * rr[:, None],
-                                     0 * rr[:, None], 0 * rr[:, None], embedding_), dim=1)
-            with torch.no_grad():
-                func = model.lin_edge(in_features.float())
-            func = func[:, 0]
+            func = edge_funcs[n]
             csv_.append(to_numpy(func))
             true_func = model.psi(rr, p[to_numpy(type_list[n]).astype(int)].squeeze(),
                                   p[to_numpy(type_list[n]).astype(int)].squeeze())
@@ -1560,14 +1510,10 @@ def data_plot_gravity_continuous(config_file, epoch_list, log_dir, logger, devic
 
         rr = torch.tensor(np.linspace(min_radius, max_radius, 1000)).to(device)
         plot_list = []
+        in_features = partial(edge_function_features, config.graph_model.particle_model_name, max_radius=max_radius)
+        edge_funcs = evaluate_edge_function(model.lin_edge, in_features, rr, model.a[1, 0:int(n_particles * (1 - config.training.particle_dropout))])
         for n in range(int(n_particles * (1 - config.training.particle_dropout))):
-            embedding_ = model.a[1, n, :] * torch.ones((1000, config.graph_model.embedding_dim), device=device)
-            in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None],
-                                     rr[:, None] / max_radius, 0 * rr[:, None], 0 * rr[:, None],
-                                     0 * rr[:, None], 0 * rr[:, None], embedding_), dim=1)
-            with torch.no_grad():
-                pred = model.lin_edge(in_features.float())
-            pred = pred[:, 0]
+            pred = edge_funcs[n]
             plot_list.append(pred * ynorm)
         p = np.linspace(0.5, 5, n_particle_types)
         p_list = p[to_numpy(type_list).astype(int)]
@@ -1755,10 +1701,7 @@ def data_plot_gravity_solar_system(config_file, epoch_list, log_dir, logger, dev
     x0 = x_list[0][it].clone().detach()
     y0 = y_list[0][it].clone().detach()
     x = x_list[0][it].clone().detach()
-    distance = torch.sum(bc_dpos(x[:, None, 1:3] - x[None, :, 1:3]) ** 2, dim=2)
-    t = torch.Tensor([max_radius ** 2])  # threshold
-    adj_t = ((distance < max_radius ** 2) & (distance > min_radius ** 2)) * 1.0
-    edge_index = adj_t.nonzero().t().contiguous()
+    edge_index = radius_graph(x[:, 1:3], min_radius, max_radius, config.simulation.boundary, config.simulation.neighbor_method)
     dataset = data.Data(x=x, edge_index=edge_index)
 
     with torch.no_grad():
@@ -1805,9 +1748,7 @@ def data_plot_gravity_solar_system(config_file, epoch_list, log_dir, logger, dev
     for n in range(n_particle_types):
         pos = np.argwhere(new_labels == n).squeeze().astype(int)
         embedding = model.a[0, pos[0], :] * torch.ones((1000, config.graph_model.embedding_dim), device=device)
-        in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None],
-                                 rr[:, None] / max_radius, 0 * rr[:, None], 0 * rr[:, None],
-                                 0 * rr[:, None], 0 * rr[:, None], embedding), dim=1)
+        in_features = edge_function_features('PDE_G', rr, embedding, max_radius)
         with torch.no_grad():
             func = model.lin_edge(in_features.float())
         func = func[:, 0]
@@ -1843,12 +1784,9 @@ def data_plot_gravity_solar_system(config_file, epoch_list, log_dir, logger, dev
         pos = np.argwhere(new_labels == n).squeeze().astype(int)
         embedding = model.a[0, pos[0], :] * torch.ones((1000, config.graph_model.embedding_dim), device=device)
         if config.graph_model.prediction == '2nd_derivative':
-            in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None],
-                                     rr[:, None] / max_radius, 0 * rr[:, None], 0 * rr[:, None],
-                                     0 * rr[:, None], 0 * rr[:, None], embedding), dim=1)
+            in_features = edge_function_features('PDE_G', rr, embedding, max_radius)
         else:
-            in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None],
-                                     rr[:, None] / max_radius, embedding), dim=1)
+            in_features = edge_function_features('PDE_A', rr, embedding, max_radius)
         with torch.no_grad():
             pred = model.lin_edge(in_features.float())
         pred = pred[:, 0]
@@ -1961,9 +1899,7 @@ def data_plot_Coulomb(config_file, epoch_list, log_dir, logger, device):
         x = x_list[0][100].clone().detach()
         index_particles = get_index_particles(x, n_particle_types, dimension)
         type_list = to_numpy(get_type_list(x, dimension))
-        distance = torch.sum(bc_dpos(x[:, None, 1:dimension + 1] - x[None, :, 1:dimension + 1]) ** 2, dim=2)
-        adj_t = ((distance < max_radius ** 2) & (distance > min_radius ** 2)).float() * 1
-        edges = adj_t.nonzero().t().contiguous()
+        edges = radius_graph(x[:, 1:dimension + 1], min_radius, max_radius, config.simulation.boundary, config.simulation.neighbor_method)
         indexes = np.random.randint(0, edges.shape[1], 5000)
         edges = edges[:, indexes]
 
@@ -1976,17 +1912,15 @@ def data_plot_Coulomb(config_file, epoch_list, log_dir, logger, device):
         tmp = np.array([-2, -1, 1, 2, 4])
         table_qiqj[tmp.astype(int)+2]=np.arange(5)[:,None]
         qiqj_list=[]
+        # embeddings of both ends of each edge side by side
+        in_features = partial(edge_pair_function_features, config.graph_model.particle_model_name, max_radius=max_radius)
+        edge_funcs = evaluate_edge_function(model.lin_edge, in_features, rr,
+                                            torch.cat((model.a[1, edges[0]], model.a[1, edges[1]]), dim=1))
         for n in trange(edges.shape[1]):
-            embedding_1 = model.a[1, edges[0, n], :] * torch.ones((1000, config.graph_model.embedding_dim), device=device)
-            embedding_2 = model.a[1, edges[1, n], :] * torch.ones((1000, config.graph_model.embedding_dim), device=device)
             qiqj = p[type_list[to_numpy(edges[0, n])].astype(int).squeeze()] * p[type_list[to_numpy(edges[1, n])].astype(int).squeeze()]
             qiqj_list.append(qiqj)
             type = table_qiqj[qiqj+2].astype(int).squeeze()
-            in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None],
-                                     rr[:, None] / max_radius, embedding_1, embedding_2), dim=1)
-            with torch.no_grad():
-                func = model.lin_edge(in_features.float())
-            func = func[:, 0]
+            func = edge_funcs[n]
             func_list.append(func * ynorm)
             plt.plot(to_numpy(rr),
                      to_numpy(func) * to_numpy(ynorm),
@@ -2145,9 +2079,7 @@ def data_plot_boids(config_file, epoch_list, log_dir, logger, device):
             pos = torch.argwhere(x[:, 5:6] < n_particle_types).squeeze()
             pos = to_numpy(pos[:, 0]).astype(int)  # filter out cluster not associated with ground truth
             x = x[pos, :]
-            distance = torch.sum(bc_dpos(x[:, None, 1:3] - x[None, :, 1:3]) ** 2, dim=2)  # threshold
-            adj_t = ((distance < max_radius ** 2) & (distance > min_radius ** 2)) * 1.0
-            edge_index = adj_t.nonzero().t().contiguous()
+            edge_index = radius_graph(x[:, 1:3], min_radius, max_radius, config.simulation.boundary, config.simulation.neighbor_method)
             dataset = data.Data(x=x, edge_index=edge_index)
             with torch.no_grad():
                 y, in_features, lin_edge_out = model(dataset, data_id=1, training=False, vnorm=vnorm,
@@ -2297,14 +2229,10 @@ def data_plot_boids(config_file, epoch_list, log_dir, logger, device):
         func_list = []
         true_func_list = []
         x = x_list[0][-1].clone().detach()
+        in_features = partial(edge_function_features, config.graph_model.particle_model_name, max_radius=max_radius)
+        edge_funcs = evaluate_edge_function(model.lin_edge, in_features, rr, model.a[1, 0:len(x)])
         for n in np.arange(len(x)):
-            embedding_ = model.a[1, n, :] * torch.ones((1000, config.graph_model.embedding_dim), device=device)
-            in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None],
-                                     torch.abs(rr[:, None]) / max_radius, 0 * rr[:, None], 0 * rr[:, None],
-                                     0 * rr[:, None], 0 * rr[:, None], embedding_), dim=1)
-            with torch.no_grad():
-                func = model.lin_edge(in_features.float())
-            func = func[:, 0]
+            func = edge_funcs[n]
             type = to_numpy(x[n, 5]).astype(int)
             if type < n_particle_types:
                 func_list.append(func)
@@ -2379,9 +2307,9 @@ def data_plot_wave(config_file, epoch_list, log_dir, logger, cc, device):
     y_mesh_list = []
     time.sleep(0.5)
     for run in trange(n_runs):
-        x_mesh = torch.load(f'graphs_data/graphs_{dataset_name}/x_mesh_list_{run}.pt', map_location=device)
+        x_mesh = load_trajectory(f'graphs_data/graphs_{dataset_name}/x_mesh_list_{run}', device)
         x_mesh_list.append(x_mesh)
-        h = torch.load(f'graphs_data/graphs_{dataset_name}/y_mesh_list_{run}.pt', map_location=device)
+        h = load_trajectory(f'graphs_data/graphs_{dataset_name}/y_mesh_list_{run}', device)
         y_mesh_list.append(h)
     h = y_mesh_list[0][0].clone().detach()
 
@@ -3037,9 +2965,9 @@ def data_plot_RD(config_file, epoch_list, log_dir, logger, cc, device):
     y_mesh_list = []
     time.sleep(0.5)
     for run in trange(n_runs):
-        x_mesh = torch.load(f'graphs_data/graphs_{dataset_name}/x_mesh_list_{run}.pt', map_location=device)
+        x_mesh = load_trajectory(f'graphs_data/graphs_{dataset_name}/x_mesh_list_{run}', device)
         x_mesh_list.append(x_mesh)
-        h = torch.load(f'graphs_data/graphs_{dataset_name}/y_mesh_list_{run}.pt', map_location=device)
+        h = load_trajectory(f'graphs_data/graphs_{dataset_name}/y_mesh_list_{run}', device)
         y_mesh_list.append(h)
     h = y_mesh_list[0][0].clone().detach()
 
@@ -3464,8 +3392,8 @@ def data_plot_signal(config_file, epoch_list, log_dir, logger, cc, device):
     x_list = []
     y_list = []
     for run in trange(n_runs):
-        x = torch.load(f'graphs_data/graphs_{dataset_name}/x_list_{run}.pt', map_location=device)
-        y = torch.load(f'graphs_data/graphs_{dataset_name}/y_list_{run}.pt', map_location=device)
+        x = load_trajectory(f'graphs_data/graphs_{dataset_name}/x_list_{run}', device)
+        y = load_trajectory(f'graphs_data/graphs_{dataset_name}/y_list_{run}', device)
         x_list.append(x)
         y_list.append(y)
     vnorm = torch.load(os.path.join(log_dir, 'vnorm.pt'))
@@ -3547,7 +3475,7 @@ def data_plot_signal(config_file, epoch_list, log_dir, logger, cc, device):
 
         fig, ax = fig_init()
         gt_weight = to_numpy(adjacency[adj_t])
-        pred_weight = to_numpy(model.weight_ij[adj_t])
+        pred_weight = to_numpy(model.edge_weights(edge_index))
         plt.scatter(gt_weight, pred_weight, s=200, c='k')
         x_data = gt_weight
         y_data = pred_weight.squeeze()
@@ -3721,7 +3649,7 @@ def data_plot_signal(config_file, epoch_list, log_dir, logger, cc, device):
 
             fig, ax = fig_init()
             gt_weight = to_numpy(adjacency[adj_t])
-            pred_weight = to_numpy(model.weight_ij[adj_t]) * -1.878
+            pred_weight = to_numpy(model.edge_weights(edge_index)) * -1.878
             plt.scatter(gt_weight, pred_weight, s=200, c='k')
             x_data = gt_weight
             y_data = pred_weight.squeeze()
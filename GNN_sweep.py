@@ -0,0 +1,210 @@
+"""
+Runs data_generate -> data_train -> data_test for a list of configs in a pool of processes.
+
+Configs are names or glob patterns of files in config/:
+
+    python GNN_sweep.py 'Coulomb_3_dropout_*' 'arbitrary_64_0*' --workers 4 --threads 2
+
+Configs whose data generation depends on the same parameters (simulation, graph_model, training.n_runs and
+training.particle_dropout) share one dataset: it is generated once, in the graphs_data folder of the first config
+of the group, and the graphs_data folders of the other configs are symbolic links to it. Datasets are generated
+first, then the configs are trained and tested. Each worker limits torch to --threads intra-op threads.
+The wall time of each stage, the final training loss and the rollout RMSE are written to a summary table.
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+from prettytable import PrettyTable
+
+from ParticleGraph.config import ParticleGraphConfig
+from ParticleGraph.utils import set_device
+
+STAGES = ['generate', 'train', 'test']
+
+
+def expand_configs(patterns, config_dir='./config'):
+    config_list = []
+    for pattern in patterns:
+        files = sorted(glob.glob(f'{config_dir}/{pattern}.yaml'))
+        if len(files) == 0:
+            raise ValueError(f'No config matches {pattern}')
+        for f in files:
+            config_file = os.path.basename(f)[:-len('.yaml')]
+            if config_file not in config_list:
+                config_list.append(config_file)
+    return config_list
+
+
+def dataset_key(config):
+    # parameters read by data_generate, configs with the same key produce the same dataset
+    return json.dumps({'simulation': config.simulation.model_dump(), 'graph_model': config.graph_model.model_dump(),
+                       'data_folder_name': config.data_folder_name, 'n_runs': config.training.n_runs,
+                       'particle_dropout': config.training.particle_dropout, 'clamp': config.training.clamp,
+                       'pred_limit': config.training.pred_limit},
+                      sort_keys=True, default=str)
+
+
+def group_datasets(config_list, config_dir='./config'):
+    """
+    Returns:
+        dict: config generating the dataset: list of the configs using it.
+    """
+    groups = {}
+    leaders = {}
+    datasets = {}
+    for config_file in config_list:
+        config = ParticleGraphConfig.from_yaml(f'{config_dir}/{config_file}.yaml')
+        key = dataset_key(config)
+        folder = f'./graphs_data/graphs_{config.dataset}'
+        datasets[config_file] = config.dataset
+        if key not in leaders:
+            leaders[key] = config_file
+            groups[config_file] = [config_file]
+        elif (config.dataset == datasets[leaders[key]]) | (not os.path.exists(folder)) | os.path.islink(folder):
+            groups[leaders[key]].append(config_file)
+        else:
+            # an existing dataset folder of another config is regenerated, not replaced by a link
+            groups[config_file] = [config_file]
+    return groups
+
+
+def link_dataset(source_config, config):
+    source = os.path.abspath(f'./graphs_data/graphs_{source_config.dataset}')
+    folder = f'./graphs_data/graphs_{config.dataset}'
+    if os.path.abspath(folder) == source:
+        return
+    if os.path.islink(folder):
+        os.remove(folder)
+    os.symlink(source, folder, target_is_directory=True)
+
+
+def init_worker(n_threads):
+    if n_threads > 0:
+        torch.set_num_threads(n_threads)
+
+
+def run_generate(config_file, config_dir, visualize):
+    from GNN_particles_Ntype import data_generate
+
+    result = {'config': config_file}
+    try:
+        config = ParticleGraphConfig.from_yaml(f'{config_dir}/{config_file}.yaml')
+        device = set_device(config.training.device)
+        t0 = time.time()
+        data_generate(config, device=device, visualize=visualize, run_vizualized=0, style='color', alpha=1, erase=True,
+                      bSave=True, step=max(config.simulation.n_frames // 25, 1))
+        result['generate'] = time.time() - t0
+    except Exception:
+        result['error'] = traceback.format_exc()
+    return result
+
+
+def run_train_test(config_file, config_dir, stages, best_model, visualize):
+    from GNN_particles_Ntype import data_train, data_test
+
+    result = {'config': config_file}
+    try:
+        config = ParticleGraphConfig.from_yaml(f'{config_dir}/{config_file}.yaml')
+        device = set_device(config.training.device)
+        if 'train' in stages:
+            t0 = time.time()
+            data_train(config, config_file, device)
+            result['train'] = time.time() - t0
+            list_loss = torch.load(os.path.join('log', f'try_{config_file}', 'loss.pt'))
+            result['final_loss'] = float(list_loss[-1])
+            result['best_loss'] = float(np.min(list_loss))
+        if 'test' in stages:
+            t0 = time.time()
+            rmserr_list = data_test(config=config, config_file=config_file, visualize=visualize, style='color',
+                                    verbose=False, best_model=config.training.n_epochs if best_model is None else best_model,
+                                    run=0, step=max(config.simulation.n_frames // 25, 1), test_simulation=False,
+                                    device=device)
+            result['test'] = time.time() - t0
+            result['rmse'] = float(np.mean(rmserr_list))
+    except Exception:
+        result['error'] = traceback.format_exc()
+    return result
+
+
+def write_summary(results, output):
+    table = PrettyTable(['config', 'dataset from', 'generate (s)', 'train (s)', 'test (s)', 'final loss', 'best loss',
+                         'rollout RMSE', 'status'])
+    fmt = lambda value, f: '' if value is None else f.format(value)
+    for r in results:
+        table.add_row([r['config'], r.get('dataset_from', ''), fmt(r.get('generate'), '{:.1f}'),
+                       fmt(r.get('train'), '{:.1f}'), fmt(r.get('test'), '{:.1f}'), fmt(r.get('final_loss'), '{:.3e}'),
+                       fmt(r.get('best_loss'), '{:.3e}'), fmt(r.get('rmse'), '{:.3e}'),
+                       'failed' if 'error' in r else 'ok'])
+    print(table)
+    with open(f'{output}.txt', 'w') as f:
+        f.write(table.get_string() + '\n')
+        for r in results:
+            if 'error' in r:
+                f.write(f"\n{r['config']}\n{r['error']}")
+    with open(f'{output}.json', 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def sweep(config_list, config_dir='./config', stages=STAGES, n_workers=1, n_threads=1, best_model=None, visualize=False):
+    results = {config_file: {'config': config_file} for config_file in config_list}
+    groups = group_datasets(config_list, config_dir)
+    context = multiprocessing.get_context('spawn')
+
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=context, initializer=init_worker,
+                             initargs=(n_threads,)) as executor:
+
+        failed = set()
+        if 'generate' in stages:
+            futures = [executor.submit(run_generate, leader, config_dir, visualize) for leader in groups]
+            for future in futures:
+                result = future.result()
+                leader = result.pop('config')
+                results[leader].update(result)
+                if 'error' in result:
+                    print(f'{leader} generation failed')
+                    failed.update(groups[leader][1:])
+                    for config_file in groups[leader][1:]:
+                        results[config_file]['error'] = f'dataset generation of {leader} failed'
+                    continue
+                source_config = ParticleGraphConfig.from_yaml(f'{config_dir}/{leader}.yaml')
+                for config_file in groups[leader][1:]:
+                    link_dataset(source_config, ParticleGraphConfig.from_yaml(f'{config_dir}/{config_file}.yaml'))
+                    results[config_file]['dataset_from'] = leader
+            failed.update(config_file for config_file in groups if 'error' in results[config_file])
+
+        if ('train' in stages) | ('test' in stages):
+            futures = [executor.submit(run_train_test, config_file, config_dir, stages, best_model, visualize)
+                       for config_file in config_list if config_file not in failed]
+            for future in futures:
+                result = future.result()
+                results[result.pop('config')].update(result)
+
+    return [results[config_file] for config_file in config_list]
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='ParticleGraph config sweep')
+    parser.add_argument('configs', nargs='+', help='config names or glob patterns in config_dir')
+    parser.add_argument('--config-dir', default='./config')
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES)
+    parser.add_argument('--workers', type=int, default=1, help='number of processes')
+    parser.add_argument('--threads', type=int, default=1, help='torch intra-op threads per process, 0 keeps the default')
+    parser.add_argument('--best-model', type=int, default=None, help='checkpoint tested by data_test, default the last epoch')
+    parser.add_argument('--visualize', action='store_true')
+    parser.add_argument('--output', default='sweep_summary')
+    args = parser.parse_args()
+
+    config_list = expand_configs(args.configs, args.config_dir)
+    print(f'{len(config_list)} configs: {config_list}')
+    results = sweep(config_list, args.config_dir, args.stages, args.workers, args.threads, args.best_model,
+                    args.visualize)
+    write_summary(results, args.output)
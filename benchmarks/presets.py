@@ -0,0 +1,57 @@
+"""
+Small benchmark presets derived from the configs in config/.
+
+A preset loads its yaml file and overrides the number of particles (or mesh nodes), the device and the number of
+frames, so that a benchmark case only depends on the preset name and N.
+"""
+import numpy as np
+
+from ParticleGraph.config import ParticleGraphConfig
+
+# preset name: (config file, kind)
+PRESETS = {
+    'arbitrary_3': ('arbitrary_3', 'particle'),
+    'boids_16': ('boids_16_256', 'particle'),
+    'Coulomb_3': ('Coulomb_3', 'particle'),
+    'gravity': ('gravity_16', 'particle'),
+    'wave': ('wave', 'mesh'),
+    'RD': ('RD_RPS_1', 'mesh'),
+    'signal': ('signal_N', 'signal'),
+}
+
+DEFAULT_SIZES = [1000, 4000]
+
+
+def load_preset(name, n, config_dir='./config'):
+    """
+    Load the config of a preset with about n particles, n is rounded down to a multiple of the number of particle
+    types for particle presets and to a square for mesh presets.
+
+    Returns:
+        tuple: (config, kind, n) with the actual number of particles or nodes.
+    """
+    if name not in PRESETS:
+        raise ValueError(f'Unknown benchmark preset {name}')
+    config_file, kind = PRESETS[name]
+    config = ParticleGraphConfig.from_yaml(f'{config_dir}/{config_file}.yaml')
+
+    match kind:
+        case 'particle' | 'signal':
+            n_particle_types = config.simulation.n_particle_types
+            n = max(n // n_particle_types, 1) * n_particle_types
+        case 'mesh':
+            n = int(np.sqrt(n)) ** 2
+            config.simulation.n_nodes = n
+
+    config.simulation.n_particles = n
+    config.simulation.n_frames = 1
+    config.simulation.start_frame = 0
+    config.simulation.connectivity_file = ''
+    config.training.device = 'cpu'
+    # embeddings of run 1 are used for training and rollouts
+    config.training.n_runs = max(config.training.n_runs, 2)
+    # data_train_signal has no training step for recursive_loop = 0, the default of signal_N.yaml
+    if (kind == 'signal') & (config.training.recursive_loop == 0):
+        config.training.recursive_loop = 1
+
+    return config, kind, n
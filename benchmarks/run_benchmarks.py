@@ -0,0 +1,281 @@
+"""
+Benchmark suite for graph construction, generation, training and rollouts.
+
+For each preset (see presets.py) and number of particles N, the following stages are timed on CPU:
+    graph_<method>   radius graph of the particles for each neighbor search method (mesh: init_mesh,
+                     signal: edge list of the connectivity matrix)
+    generator_step   one frame of data_generate
+    train_iteration  one iteration of data_train, without the plots and checkpoints
+    rollout_step     one frame of data_test, without the plots
+
+The last three run the actual loops on a small dataset benchmark_<preset>_<N> with training.profile enabled and
+training.max_iterations = warmup + repeat, and read the iteration times from the traces of their StageTimer. The
+dataset and its log folder are removed afterwards.
+
+Results are written as JSON with the hardware metadata, and compared with a baseline when given. benchmarks/baseline.json
+is a reference CPU baseline of the presets that run without data files (see README.md for the machine and how to
+regenerate it), timings depend on the machine: compare with it on a similar machine, or record a new one first.
+Run from the repository root, mesh presets read their node maps in graphs_data/ like data_generate:
+
+    python benchmarks/run_benchmarks.py --presets arbitrary_3 wave --sizes 1000 4000 --output results.json
+    python benchmarks/run_benchmarks.py --presets arbitrary_3 signal --sizes 1000 --threads 1 --baseline benchmarks/baseline.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from datetime import datetime
+
+import numpy as np
+import scipy.io
+import torch
+import torch_geometric
+from prettytable import PrettyTable
+
+from ParticleGraph.generators.graph_data_generator import data_generate
+from ParticleGraph.generators.utils import choose_mesh_model, init_particles, init_mesh
+from ParticleGraph.models.graph_trainer import data_train, data_test
+from ParticleGraph.neighbors import radius_graph
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from presets import PRESETS, DEFAULT_SIZES, load_preset
+
+NEIGHBOR_METHODS = ['dense', 'cell_list', 'kd_tree']
+
+
+def hardware_metadata():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        commit = ''
+    return {'date': datetime.now().isoformat(timespec='seconds'), 'commit': commit,
+            'platform': platform.platform(), 'machine': platform.machine(), 'processor': platform.processor(),
+            'cpu_count': os.cpu_count(), 'torch_threads': torch.get_num_threads(),
+            'python': platform.python_version(), 'torch': torch.__version__,
+            'torch_geometric': torch_geometric.__version__, 'numpy': np.__version__}
+
+
+def time_function(fn, repeat, warmup):
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def graph_cases(config, kind, device, max_dense):
+    simulation_config = config.simulation
+    min_radius = simulation_config.min_radius
+    max_radius = simulation_config.max_radius
+
+    match kind:
+        case 'particle':
+            X1, V1, T1, H1, A1, N1 = init_particles(config, device=device)
+            cases = {}
+            for method in NEIGHBOR_METHODS:
+                if (method == 'dense') & (len(X1) > max_dense):
+                    continue
+                cases[f'graph_{method}'] = lambda method=method: radius_graph(X1, min_radius, max_radius,
+                                                                               simulation_config.boundary, method)
+            return cases
+        case 'mesh':
+            mesh_model = choose_mesh_model(config, device=device)
+            return {'graph_mesh': lambda: init_mesh(config, model_mesh=mesh_model, device=device)}
+        case 'signal':
+            adjacency = torch.tensor(scipy.io.loadmat(simulation_config.connectivity_file)['A'], device=device)
+
+            def graph():
+                adj_t = adjacency > 0
+                return adj_t.nonzero().t().contiguous(), adjacency[adj_t]
+
+            return {'graph_adjacency': graph}
+
+
+def write_connectivity(file_name, n_particles, mean_degree=20, seed=0):
+    """
+    Random symmetric connectivity matrix without self connections in place of the connectivity file of the signal config, which has a fixed size.
+    """
+    rng = np.random.default_rng(seed)
+    adjacency = rng.random((n_particles, n_particles)) * (rng.random((n_particles, n_particles)) < mean_degree / n_particles)
+    adjacency = np.maximum(adjacency, adjacency.T)
+    np.fill_diagonal(adjacency, 0)
+    scipy.io.savemat(file_name, {'A': adjacency})
+
+
+def read_trace(file_name, warmup, repeat, exclude=()):
+    """
+    Times of the iterations warmup to warmup + repeat - 1 of a StageTimer trace, without the excluded stages.
+    """
+    with open(file_name, 'r') as f:
+        trace = json.load(f)
+    rows = [row for row in trace['rows'] if row['iteration'] != 'epoch'][warmup:warmup + repeat]
+    if len(rows) < repeat:
+        raise RuntimeError(f'{file_name} has {len(rows)} iterations after warmup, {repeat} expected')
+    return [row['total'] - sum(row.get(stage, 0) for stage in exclude) for row in rows]
+
+
+def loop_cases(config, config_file, repeat, warmup, device):
+    """
+    Run data_generate, data_train and data_test on a dataset of warmup + repeat frames with training.profile
+    enabled and read the times of their iterations in the traces written by their StageTimer.
+    """
+    n_iterations = warmup + repeat
+    config.dataset = config_file
+    # data_train_signal samples the frames below n_frames - 6
+    config.simulation.n_frames = max(n_iterations, 8)
+    config.training.profile = True
+    config.training.n_epochs = 0
+    config.training.max_iterations = n_iterations
+    config.training.data_augmentation_loop = max(config.training.data_augmentation_loop, n_iterations)
+    log_dir = f'./log/try_{config_file}'
+
+    results = {}
+    stages = [('generator_step', lambda: data_generate(config, visualize=False, erase=True, bSave=True, device=device),
+               f'./graphs_data/graphs_{config_file}/generation_trace.json', ()),
+              ('train_iteration', lambda: data_train(config, config_file, device),
+               f'{log_dir}/training_trace.json', ('plot', 'checkpoint')),
+              ('rollout_step', lambda: data_test(config, config_file, visualize=False, best_model=0, run=1, device=device),
+               f'{log_dir}/rollout_trace.json', ('plot',))]
+    for stage, fn, trace, exclude in stages:
+        try:
+            fn()
+            results[stage] = read_trace(trace, warmup, repeat, exclude)
+        except Exception:
+            results[stage] = traceback.format_exc(limit=1)
+            # the next loops read the outputs of this one
+            break
+    return results
+
+
+def run_benchmarks(presets, sizes, repeat=5, warmup=1, seed=0, max_dense=20000, device='cpu'):
+    results = []
+
+    def add(name, kind, stage, n, times):
+        if isinstance(times, str):
+            results.append({'preset': name, 'kind': kind, 'stage': stage, 'n': n, 'error': times})
+        else:
+            results.append({'preset': name, 'kind': kind, 'stage': stage, 'n': n, 'times': times,
+                            'median': float(np.median(times)), 'min': float(np.min(times)),
+                            'mean': float(np.mean(times))})
+
+    for name in presets:
+        for size in sizes:
+            torch.manual_seed(seed)
+            np.random.seed(seed)
+            config, kind, n = load_preset(name, size)
+            config_file = f'benchmark_{name}_{n}'
+            print(f'{name} N={n}')
+            work_dir = tempfile.mkdtemp()
+            try:
+                if kind == 'signal':
+                    config.simulation.connectivity_file = os.path.join(work_dir, 'connectivity.mat')
+                    write_connectivity(config.simulation.connectivity_file, n, seed=seed)
+                try:
+                    cases = graph_cases(config, kind, device, max_dense)
+                except Exception:
+                    add(name, kind, 'setup', n, traceback.format_exc(limit=1))
+                    continue
+                for stage, fn in cases.items():
+                    try:
+                        times = time_function(fn, repeat, warmup)
+                    except Exception:
+                        times = traceback.format_exc(limit=1)
+                    add(name, kind, stage, n, times)
+                for stage, times in loop_cases(config, config_file, repeat, warmup, device).items():
+                    add(name, kind, stage, n, times)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+                shutil.rmtree(f'./graphs_data/graphs_{config_file}', ignore_errors=True)
+                shutil.rmtree(f'./log/try_{config_file}', ignore_errors=True)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare the median times with the baseline, a ratio above 1 + tolerance is a regression.
+    A stage that failed in this run but has a baseline time is reported as an error.
+    """
+    reference = {(r['preset'], r['stage'], r['n']): r['median'] for r in baseline['results'] if 'median' in r}
+    comparison = []
+    for r in results:
+        key = (r['preset'], r['stage'], r['n'])
+        if key not in reference:
+            continue
+        if 'median' not in r:
+            comparison.append({'preset': r['preset'], 'stage': r['stage'], 'n': r['n'], 'baseline': reference[key],
+                               'median': None, 'ratio': None, 'status': 'error'})
+            continue
+        ratio = r['median'] / reference[key]
+        if ratio > 1 + tolerance:
+            status = 'regression'
+        elif ratio < 1 / (1 + tolerance):
+            status = 'improvement'
+        else:
+            status = 'ok'
+        comparison.append({'preset': r['preset'], 'stage': r['stage'], 'n': r['n'], 'baseline': reference[key],
+                           'median': r['median'], 'ratio': ratio, 'status': status})
+    return comparison
+
+
+def print_table(results, comparison):
+    ratios = {(c['preset'], c['stage'], c['n']): c for c in comparison}
+    table = PrettyTable(['preset', 'stage', 'N', 'median (ms)', 'min (ms)', 'vs baseline'])
+    for r in results:
+        if 'median' not in r:
+            table.add_row([r['preset'], r['stage'], r['n'], 'error', '', r['error'].strip().split('\n')[-1]])
+            continue
+        c = ratios.get((r['preset'], r['stage'], r['n']))
+        table.add_row([r['preset'], r['stage'], r['n'], f"{r['median'] * 1000:.2f}", f"{r['min'] * 1000:.2f}",
+                       '' if c is None else f"{c['ratio']:.2f}x {c['status']}"])
+    print(table)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='ParticleGraph benchmarks')
+    parser.add_argument('--presets', nargs='+', default=list(PRESETS), choices=list(PRESETS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=DEFAULT_SIZES)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--threads', type=int, default=0, help='torch threads, 0 keeps the default')
+    parser.add_argument('--max-dense', type=int, default=20000, help='largest N for the dense radius graph')
+    parser.add_argument('--output', default='benchmarks/results.json')
+    parser.add_argument('--baseline', default='', help='results file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    parser.add_argument('--fail-on-regression', action='store_true', help='exit with 1 on a regression or an errored stage')
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    results = run_benchmarks(args.presets, args.sizes, repeat=args.repeat, warmup=args.warmup, seed=args.seed,
+                             max_dense=args.max_dense)
+    output = {'metadata': hardware_metadata(), 'settings': vars(args), 'results': results}
+
+    comparison = []
+    if args.baseline != '':
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        comparison = compare(results, baseline, args.tolerance)
+        output['baseline'] = {'file': args.baseline, 'metadata': baseline['metadata'], 'comparison': comparison}
+
+    print_table(results, comparison)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2)
+    print(f'results saved in {args.output}')
+
+    # a stage that errored is a failure, with or without a baseline time to compare with
+    if args.fail_on_regression & (any(c['status'] == 'regression' for c in comparison) |
+                                  any('error' in r for r in results)):
+        sys.exit(1)
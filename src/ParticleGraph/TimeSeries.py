@@ -2,18 +2,124 @@ import os
 from collections.abc import Sequence
 from typing import Dict, List, Tuple, Self
 
+import numpy as np
 import torch
 from torch_geometric.data import Data
 
 from ParticleGraph.field_descriptors import FieldDescriptor
 
 
+class PackedSteps(Sequence):
+    """
+    Time steps stored as concatenated field arrays, the backend of time series saved with `packed=True`.
+    Node fields (one row per node) are concatenated along the first dimension and step i spans the rows
+    offsets[i] to offsets[i + 1]. Step fields (e.g. a scalar time) are stacked, one entry per step.
+    The arrays are usually memory-mapped: indexing materializes a :py:class:`torch_geometric.data.Data` object that
+    shares memory with the arrays, and slicing only selects steps, without copying any data.
+    """
+    def __init__(
+            self,
+            node_fields: Dict[str, np.ndarray],
+            step_fields: Dict[str, np.ndarray],
+            offsets: np.ndarray,
+            steps: np.ndarray = None,
+    ):
+        self.node_fields = node_fields
+        self.step_fields = step_fields
+        self.offsets = offsets
+        self.steps = np.arange(len(offsets) - 1) if steps is None else steps
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+    def __getitem__(self, idx: int | slice) -> Data | Self:
+        if isinstance(idx, slice):
+            return PackedSteps(self.node_fields, self.step_fields, self.offsets, self.steps[idx])
+        i = self.steps[idx]
+        start, end = self.offsets[i], self.offsets[i + 1]
+        fields = {name: torch.from_numpy(array[start:end]) for name, array in self.node_fields.items()}
+        fields.update({name: torch.as_tensor(array[i]) for name, array in self.step_fields.items()})
+        return Data(**fields)
+
+    def flat_field(self, name: str) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Get a node field of all the selected time steps concatenated, without copy if the steps are contiguous.
+        :param name: The name of the node field.
+        :return: The concatenated field and the number of nodes at each time step.
+        """
+        starts = self.offsets[self.steps]
+        lengths = self.offsets[self.steps + 1] - starts
+        if (len(self.steps) > 0) and np.all(np.diff(self.steps) == 1):
+            array = self.node_fields[name][starts[0]:starts[0] + lengths.sum()]
+        else:
+            rows = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            array = self.node_fields[name][rows]
+        return torch.from_numpy(array), torch.from_numpy(lengths)
+
+    @staticmethod
+    def load(path: str) -> 'PackedSteps':
+        """
+        Memory-map the arrays written by :py:meth:`PackedSteps.save`. The maps are copy-on-write, changes to the
+        materialized data are not written back to the files.
+        :param path: The directory to load the arrays from.
+        :return: A :py:class:`PackedSteps` object.
+        """
+        layout = torch.load(os.path.join(path, 'layout.pt'))
+        node_fields = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='c') for name in layout['node']}
+        step_fields = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='c') for name in layout['step']}
+        offsets = np.load(os.path.join(path, 'offsets.npy'))
+        return PackedSteps(node_fields, step_fields, offsets)
+
+    @staticmethod
+    def save(data: Sequence[Data], path: str):
+        """
+        Write a sequence of data objects as 'layout.pt', 'offsets.npy' and one '<field>.npy' file per field.
+        All data objects must have the same fields, a field is a node field if its first dimension is the number of
+        nodes at every step.
+        :param data: The data objects of the time steps.
+        :param path: The directory to write the arrays to.
+        :raises ValueError: If the fields differ between time steps or a field cannot be stacked.
+        """
+        names = [name for name, _ in data[0]]
+        n_nodes = np.array([d.num_nodes for d in data])
+        offsets = np.concatenate(([0], np.cumsum(n_nodes)))
+        layout = {'node': [], 'step': []}
+        for name in names:
+            values = [getattr(d, name, None) for d in data]
+            if any(not torch.is_tensor(value) for value in values):
+                raise ValueError(f"Field '{name}' is not a tensor at every time step.")
+            is_node_field = all((value.dim() > 0) and (value.shape[0] == n) for value, n in zip(values, n_nodes))
+            shapes = {tuple(value.shape[1:]) if is_node_field else tuple(value.shape) for value in values}
+            if len(shapes) > 1:
+                raise ValueError(f"Field '{name}' has different shapes at different time steps.")
+            if is_node_field:
+                layout['node'].append(name)
+                shape = (offsets[-1], *shapes.pop())
+            else:
+                layout['step'].append(name)
+                shape = (len(values), *shapes.pop())
+            # written row by row so that the field is never held twice in memory
+            array = np.lib.format.open_memmap(os.path.join(path, f'{name}.npy'), mode='w+',
+                                              dtype=values[0].cpu().numpy().dtype, shape=shape)
+            for i, value in enumerate(values):
+                if is_node_field:
+                    array[offsets[i]:offsets[i + 1]] = value.cpu().numpy()
+                else:
+                    array[i] = value.cpu().numpy()
+            array.flush()
+            del array
+        np.save(os.path.join(path, 'offsets.npy'), offsets)
+        torch.save(layout, os.path.join(path, 'layout.pt'))
+
+
 class TimeSeries(Sequence):
     """
     Class to represent a time series of :py:class:`torch_geometric.data.Data` objects.
     The time series can be indexed like a list to access individual time steps or slices of time steps. It also holds
     an array of time points at which the data was recorded in the attribute `time`. The fields of the data objects are
     described by a dictionary of :py:class:`FieldDescriptor` objects in the attribute `fields`.
+    The data is either held in memory as a list of data objects or read lazily from a packed file
+    (see :py:class:`PackedSteps`).
     """
     def __init__(
             self,
@@ -52,7 +158,8 @@ class TimeSeries(Sequence):
     def load(path: str) -> 'TimeSeries':
         """
         Load a time series from a directory. The time series is expected to be stored in the format written by
-        :py:meth:`TimeSeries.save`.
+        :py:meth:`TimeSeries.save`. A packed time series is memory-mapped and its time steps are read on access,
+        otherwise all time steps are loaded into memory.
         :param path: The directory to load the time series from.
         :return: A :py:class:`TimeSeries` object containing the loaded data.
         :raises ValueError: If the data could not be loaded from the given path.
@@ -61,24 +168,29 @@ class TimeSeries(Sequence):
             fields = torch.load(os.path.join(path, 'fields.pt'))
             time = torch.load(os.path.join(path, 'time.pt'))
 
-            n_time_steps = len(time)
-            n_digits = len(str(n_time_steps - 1))
+            if os.path.exists(os.path.join(path, 'layout.pt')):
+                data = PackedSteps.load(path)
+            else:
+                n_time_steps = len(time)
+                n_digits = len(str(n_time_steps - 1))
 
-            data = []
-            for i in range(n_time_steps):
-                data.append(torch.load(os.path.join(path, f'data_{str(i).zfill(n_digits)}.pt')))
+                data = []
+                for i in range(n_time_steps):
+                    data.append(torch.load(os.path.join(path, f'data_{str(i).zfill(n_digits)}.pt')))
         except Exception as e:
             raise ValueError(f"Could not load data from {path}.") from e
 
         return TimeSeries(time, data, fields)
 
     @staticmethod
-    def save(time_series: 'TimeSeries', path: str):
+    def save(time_series: 'TimeSeries', path: str, packed: bool = False):
         """
         Save a time series to a directory. The time series is stored as 'fields.pt', 'time.pt', and 'data_*.pt' files,
-        where * is a zero-padded index of the time step.
+        where * is a zero-padded index of the time step. With `packed=True`, the time steps are stored as one
+        array per field instead of the 'data_*.pt' files (see :py:meth:`PackedSteps.save`).
         :param time_series: The time series to save.
         :param path: The directory to save the time series to.
+        :param packed: Whether to store the time steps as concatenated field arrays.
         :raises ValueError: If the data could not be saved to the given path.
         """
         try:
@@ -86,14 +198,28 @@ class TimeSeries(Sequence):
             torch.save(time_series.fields, os.path.join(path, 'fields.pt'))
             torch.save(time_series.time, os.path.join(path, 'time.pt'))
 
-            n_time_steps = len(time_series)
-            n_digits = len(str(n_time_steps - 1))
+            if packed:
+                PackedSteps.save(time_series, path)
+            else:
+                n_time_steps = len(time_series)
+                n_digits = len(str(n_time_steps - 1))
 
-            for i, d in enumerate(time_series):
-                torch.save(d, os.path.join(path, f'data_{str(i).zfill(n_digits)}.pt'))
+                for i, d in enumerate(time_series):
+                    torch.save(d, os.path.join(path, f'data_{str(i).zfill(n_digits)}.pt'))
         except Exception as e:
             raise ValueError(f"Could not save data to {path}.") from e
 
+    def _flat_field(self, field_name: str) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Get a field of all time steps concatenated along the first dimension.
+        :param field_name: The field to concatenate.
+        :return: The concatenated field and the number of entries at each time step.
+        """
+        if isinstance(self._data, PackedSteps) and (field_name in self._data.node_fields):
+            return self._data.flat_field(field_name)
+        values = [getattr(d, field_name) for d in self]
+        return torch.cat(values), torch.tensor([len(value) for value in values])
+
     def compute_derivative(
             self,
             field_name: str,
@@ -102,45 +228,47 @@ class TimeSeries(Sequence):
     ) -> List[torch.Tensor] | Tuple[List[torch.Tensor], List[torch.Tensor]]:
         """
         Compute the backward difference quotient of a field in a time series.
+        All time steps are processed at once on the concatenated field, the returned tensors are views of one tensor.
         :param field_name: The field for which to compute the difference quotient.
         :param id_name: If given, this field is used to match data points between time steps. Ids are assumed to be
             unique.
         :return: A list of tensors containing the difference quotient at each time step. Where the difference quotient
             could not be computed, the corresponding entry is Nan. If id_name is given, a list of masks is also
             returned, indicating which entries could not be computed.
+        :raises ValueError: If id_name is not given and the number of data points changes between time steps.
         """
-        difference_quotients = [torch.full_like(getattr(self[0], field_name), torch.nan)]
-        for i in range(1, len(self)):
-            x_current = getattr(self[i], field_name)
-            x_previous = getattr(self[i - 1], field_name)
-            delta_t = self.time[i] - self.time[i - 1]
+        x, lengths = self._flat_field(field_name)
+        lengths = lengths.to(x.device)
+        step = torch.repeat_interleave(torch.arange(len(lengths), device=x.device), lengths)
+        delta_t = torch.diff(self.time).to(x.device)
 
-            if id_name is None:
-                difference_quotients.append((x_current - x_previous) / delta_t)
-            else:
-                id_current = getattr(self[i], id_name)
-                id_previous = getattr(self[i - 1], id_name)
-
-                # Compute a set of global unique ids
-                all_ids = torch.cat((id_current, id_previous))
-                _, indices, counts = torch.unique(all_ids, return_inverse=True, return_counts=True)
-
-                # Compute the difference quotient in the global id space
-                indices_current = indices[:len(id_current)]
-                indices_previous = indices[len(id_current):]
-                all_differences = torch.zeros((len(counts), x_current.shape[1]), device=x_current.device)
-                for j in range(x_current.shape[1]):
-                    all_differences[:, j] = (torch.bincount(indices_current, x_current[:, j], minlength=len(counts))
-                                             - torch.bincount(indices_previous, x_previous[:, j], minlength=len(counts)))
-
-                # Only consider ids that are present in both time steps and map to current ids
-                all_differences[counts.ne(2)] = torch.nan
-                difference_quotient = all_differences[indices_current] / delta_t
-                difference_quotients.append(difference_quotient)
+        if id_name is None:
+            if torch.any(lengths.ne(lengths[0])):
+                raise ValueError("The number of data points changes between time steps, use id_name to match them.")
+            current = torch.arange(lengths[0], len(x), device=x.device)
+            previous = current - lengths[0]
+        else:
+            ids, _ = self._flat_field(id_name)
+            unique_ids, ids = torch.unique(ids.to(x.device), return_inverse=True)
+            n_ids = len(unique_ids)
+
+            # every data point has the key (step, id), its predecessor has the key (step - 1, id)
+            key = step * n_ids + ids
+            sorted_key, order = torch.sort(key)
+            previous_key = key - n_ids
+            position = torch.searchsorted(sorted_key, previous_key).clamp(max=len(key) - 1)
+            found = sorted_key[position].eq(previous_key) & step.gt(0)
+            current = torch.where(found)[0]
+            previous = order[position[current]]
+
+        difference_quotient = torch.full_like(x, torch.nan)
+        dt = delta_t[step[current] - 1].view(-1, *([1] * (x.dim() - 1)))
+        difference_quotient[current] = (x[current] - x[previous]) / dt
+        difference_quotients = list(torch.split(difference_quotient, lengths.tolist()))
 
         if id_name is None:
             return difference_quotients
         else:
             # Compute a mask which entries could not be computed
-            mask = [torch.any(torch.isnan(dq), dim=1) for dq in difference_quotients]
-            return difference_quotients, mask
+            mask = torch.any(torch.isnan(difference_quotient), dim=1)
+            return difference_quotients, list(torch.split(mask, lengths.tolist()))
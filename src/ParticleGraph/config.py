@@ -38,8 +38,15 @@ class SimulationConfig(BaseModel):
     delta_t: float = 1
     dpos_init: float = 0
     boundary: Literal['periodic', 'no', 'periodic_special'] = 'periodic'
+    neighbor_method: Literal['dense', 'cell_list', 'kd_tree'] = 'dense'
+    neighbor_skin: Annotated[float, Field(ge=0)] = 0
+    save_edges: bool = False
+    trajectory_format: Literal['pt', 'memmap'] = 'pt'
+    batch_runs: bool = False
+    sparse_laplacian: bool = False
     node_type_map: Optional[str] = None
     node_value_map: Optional[str] = None
+    mesh_seed: Optional[int] = None
     node_diffusion_map: Optional[str] = None
     node_proliferation_map: Optional[str] = None
     beta: Optional[float] = None
@@ -66,6 +73,7 @@ class GraphModelConfig(BaseModel):
     n_layers_update: int = 3
     hidden_dim_update: int = 64
     output_size_update: int = 1
+    signal_connectivity: Literal['dense', 'sparse'] = 'dense'
 
     input_size_nnr: int = 3
     n_layers_nnr: int = 5
@@ -94,6 +102,7 @@ class PlottingConfig(BaseModel):
     arrow_length: int = 10
     marker_size: int = 100
     ylim: list[float] = [-0.1, 0.1]
+    n_render_workers: int = 0
 
 
 class TrainingConfig(BaseModel):
@@ -107,6 +116,14 @@ class TrainingConfig(BaseModel):
 
     n_runs: int = 2
     seed : int = 40
+    n_prefetch: int = 0
+    checkpoint_keep_last: int = 0
+    checkpoint_keep_every: int = 0
+    checkpoint_keep_best: int = 0
+    profile: bool = False
+    profiler_iterations: int = 0
+    profiler_start: int = 10
+    max_iterations: int = 0
     clamp: float = 0
     pred_limit: float = 1.E+10
     sparsity: Literal['none', 'replace_embedding', 'replace_embedding_function'] = 'none'
@@ -115,6 +132,8 @@ class TrainingConfig(BaseModel):
     n_ghosts: int = 0
     ghost_method: Literal['none', 'tensor', 'MLP'] = 'none'
     ghost_logvar: float = -12
+    ghost_update: Literal['dense', 'sparse'] = 'dense'
+    ghost_keyframe_step: int = 1
 
     fix_cluster_embedding: bool = False
     loss_weight: bool = False
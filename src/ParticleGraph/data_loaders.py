@@ -1,6 +1,9 @@
 """
 A collection of functions for loading data from various sources.
 """
+import hashlib
+import json
+import shutil
 from typing import Dict, Tuple
 
 import astropy.units as u
@@ -10,6 +13,7 @@ from tqdm import trange
 
 from ParticleGraph.TimeSeries import TimeSeries
 from ParticleGraph.field_descriptors import CsvDescriptor, DerivedFieldDescriptor
+from ParticleGraph.trajectory import save_trajectory
 from ParticleGraph.utils import *
 
 
@@ -25,41 +29,58 @@ def skip_to(file, start_line):
 
 
 def convert_data(data, device, config, n_particle_types, n_frames):
-    x_list = []
-    y_list = []
-
-    for it in trange(n_frames - 1):
-        for n in range(n_particle_types):
-            # if (n==9):
-            #     p=1
-            x = data[n][it, 1].clone().detach()
-            y = data[n][it, 2].clone().detach()
-            z = data[n][it, 3].clone().detach()
-            vx = data[n][it, 4].clone().detach()
-            vy = data[n][it, 5].clone().detach()
-            vz = data[n][it, 6].clone().detach()
-
-            tmp = torch.stack(
-                [torch.tensor(n), x, y, vx, vy, torch.tensor(n), torch.tensor(0), torch.tensor(0), torch.tensor(0)])
-            if n == 0:
-                object_data = tmp[None, :]
-            else:
-                object_data = torch.cat((object_data, tmp[None, :]), 0)
+    # frames (id, x, y, vx, vy, id, 0, 0, 0) and accelerations of all bodies, built as one tensor
+    data = torch.stack(data[:n_particle_types], 1)
+    n = torch.arange(n_particle_types, dtype=data.dtype)
 
-            ax = data[n][it + 1, 4] - data[n][it, 4]
-            ay = data[n][it + 1, 5] - data[n][it, 5]
-            tmp = torch.stack([ax, ay]) / config.simulation.delta_t
-            if n == 0:
-                acc_data = tmp[None, :]
-            else:
-                acc_data = torch.cat((acc_data, tmp[None, :]), 0)
+    x = torch.zeros((n_frames - 1, n_particle_types, 9), dtype=data.dtype)
+    x[:, :, 0] = n
+    x[:, :, 1:3] = data[:n_frames - 1, :, 1:3]
+    x[:, :, 3:5] = data[:n_frames - 1, :, 4:6]
+    x[:, :, 5] = n
+    y = (data[1:n_frames, :, 4:6] - data[:n_frames - 1, :, 4:6]) / config.simulation.delta_t
 
-        x_list.append(object_data.to(device))
-        y_list.append(acc_data.to(device))
+    x_list = list(x.to(device).unbind(0))
+    y_list = list(y.to(device).unbind(0))
 
     return x_list, y_list
 
 
+def parse_horizons(filename, n_rows):
+    """
+    Read the positions and velocities of a Horizons ephemeris text file.
+
+    Returns:
+        np.ndarray: (n_rows, 6) x, y, z, vx, vy, vz of the first n_rows entries after $$SOE.
+    """
+    df = skip_to(filename, "$$SOE\n")
+    data = pd.read_csv(filename, header=None, skiprows=df, sep=r'\s+', nrows=n_rows)
+    # the values are followed by a comma
+    columns = data.iloc[:n_rows, 4:10].astype(str).apply(lambda column: column.str.rstrip(','))
+    return columns.values.astype(np.float64)
+
+
+def load_horizons(folder, object_list, n_rows):
+    """
+    Parse the ephemeris of the objects, the parsed arrays are cached in {folder}/ephemeris_{n_rows}.npz and
+    reused as long as the text files are not modified.
+
+    Returns:
+        np.ndarray: (n_objects, n_rows, 6) x, y, z, vx, vy, vz.
+    """
+    filenames = [os.path.join(folder, f'{object}.txt') for object in object_list]
+    cache = os.path.join(folder, f'ephemeris_{n_rows}.npz')
+    if os.path.exists(cache):
+        cached = np.load(cache)
+        if (list(cached['object_list']) == list(object_list)) & (
+                os.path.getmtime(cache) >= max(os.path.getmtime(f) for f in filenames)):
+            return cached['ephemeris']
+
+    ephemeris = np.stack([parse_horizons(filename, n_rows) for filename in filenames])
+    np.savez(cache, ephemeris=ephemeris, object_list=np.array(object_list))
+    return ephemeris
+
+
 def load_solar_system(config, device=None, visualize=False, folder=None, step=1000):
     # create output folder, empty it if bErase=True, copy files into it
     dataset_name = config.data_folder_name
@@ -80,51 +101,17 @@ def load_solar_system(config, device=None, visualize=False, folder=None, step=10
     # matplotlib.use("Qt5Agg")
     fig = plt.figure(figsize=(12, 12))
 
-    all_data = []
+    ephemeris = torch.tensor(load_horizons(dataset_name, object_list, n_step - 1), dtype=torch.float32)
 
-    for id, object in enumerate(object_list):
+    # (id, x, y, z, vx, vy, vz, id, 0, 0, 0) of each object
+    n_objects, n_rows = ephemeris.shape[0:2]
+    ids = torch.arange(n_objects, dtype=torch.float32)[:, None, None].expand(n_objects, n_rows, 1)
+    all_data = torch.cat((ids, ephemeris, ids, torch.zeros((n_objects, n_rows, 3))), 2)
+    all_data = list(all_data.unbind(0))
 
-        print(f'object: {object}')
-        filename = os.path.join(dataset_name, f'{object}.txt')
-
-        df = skip_to(filename, "$$SOE\n")
-        data = pd.read_csv(filename, header=None, skiprows=df, sep='', nrows=n_step)
-        tmp_x = data.iloc[:, 4:5].values
-        tmp_y = data.iloc[:, 5:6].values
-        tmp_z = data.iloc[:, 6:7].values
-        tmp_vx = data.iloc[:, 7:8].values
-        tmp_vy = data.iloc[:, 8:9].values
-        tmp_vz = data.iloc[:, 9:10].values
-        tmp_x = tmp_x[:, 0][:-1]
-        tmp_y = tmp_y[:, 0][:-1]
-        tmp_z = tmp_z[:, 0][:-1]
-        tmp_vx = tmp_vx[:, 0][:-1]
-        tmp_vy = tmp_vy[:, 0][:-1]
-        tmp_vz = tmp_vz[:, 0][:-1]
-        # convert string to float
-        x = torch.ones((n_step - 1))
-        y = torch.ones((n_step - 1))
-        z = torch.ones((n_step - 1))
-        vx = torch.ones((n_step - 1))
-        vy = torch.ones((n_step - 1))
-        vz = torch.ones((n_step - 1))
-        for it in range(n_step - 1):
-            x[it] = torch.tensor(float(tmp_x[it][0:-1]))
-            y[it] = torch.tensor(float(tmp_y[it][0:-1]))
-            z[it] = torch.tensor(float(tmp_z[it][0:-1]))
-            vx[it] = torch.tensor(float(tmp_vx[it][0:-1]))
-            vy[it] = torch.tensor(float(tmp_vy[it][0:-1]))
-            vz[it] = torch.tensor(float(tmp_vz[it][0:-1]))
-
-        object_data = torch.cat((torch.ones_like(x[:, None]) * id, x[:, None], y[:, None], z[:, None], vx[:, None],
-                                 vy[:, None], vz[:, None], torch.ones_like(x[:, None]) * id,
-                                 torch.zeros_like(x[:, None]), torch.zeros_like(x[:, None]),
-                                 torch.zeros_like(x[:, None])), 1)
-
-        all_data.append(object_data)
-
-        plt.plot(to_numpy(y), to_numpy(x))
-        plt.text(to_numpy(y[-1]), to_numpy(x[-1]), object, fontsize=6)
+    for id, object in enumerate(object_list):
+        plt.plot(to_numpy(ephemeris[id, :, 1]), to_numpy(ephemeris[id, :, 0]))
+        plt.text(to_numpy(ephemeris[id, -1, 1]), to_numpy(ephemeris[id, -1, 0]), object, fontsize=6)
 
     x_list, y_list = convert_data(all_data, device, config, n_particle_types, n_frames + 1)
 
@@ -149,15 +136,16 @@ def load_solar_system(config, device=None, visualize=False, folder=None, step=10
                 plt.close()
 
     for run in range(2):
-        torch.save(x_list, f'graphs_data/graphs_{dataset_name}/x_list_{run}.pt')
-        torch.save(y_list, f'graphs_data/graphs_{dataset_name}/y_list_{run}.pt')
+        save_trajectory(x_list, f'graphs_data/graphs_{dataset_name}/x_list_{run}', config.simulation.trajectory_format)
+        save_trajectory(y_list, f'graphs_data/graphs_{dataset_name}/y_list_{run}', config.simulation.trajectory_format)
 
 
 def load_shrofflab_celegans(
         file_path,
         *,
         replace_missing_cpm=None,
-        device='cuda:0'
+        device='cuda:0',
+        cache=True
 ):
     """
     Load the Shrofflab C. elegans data from a CSV file and convert it to a PyTorch tensor.
@@ -166,6 +154,7 @@ def load_shrofflab_celegans(
         file_path (str): The path to the CSV file.
         replace_missing_cpm (float): If not None, replace missing cpm values with this value.
         device (str): The PyTorch device to use for the tensor.
+        cache (bool): Whether to cache the parsed columns (see read_csv_columns).
 
     Returns:
         tensor_list (List[torch.Tensor]): A list of PyTorch tensors containing the loaded data for each time point.
@@ -182,7 +171,7 @@ def load_shrofflab_celegans(
     print(f"Loading data from {file_path}...")
     dtypes = {"time": np.float32, "x": np.float32, "y": np.float32,
               "z": np.float32, "cell": str, "log10 mean cpm": str}
-    data = pd.read_csv(file_path, dtype=dtypes)
+    data = pd.DataFrame(read_csv_columns(file_path, dtypes, cache=cache), copy=False)
     print(f"Loaded {data.shape[0]} rows of data, dropping rows with missing time values...")
     data.dropna(subset=["time"], inplace=True)
     print(f"Remaining: {data.shape[0]} rows")
@@ -257,14 +246,91 @@ def ensure_local_path_exists(path):
     return os.path.join(os.getcwd(), path)
 
 
+def read_csv_columns(
+        file_path: str,
+        dtypes: Dict[str, type],
+        *,
+        chunksize: int = 1_000_000,
+        cache: bool = True,
+        **kwargs
+) -> Dict[str, np.ndarray]:
+    """
+    Read the columns of a CSV file into numpy arrays, in chunks of rows and parsing only the requested columns with
+    their final type. The arrays are cached as .npy files in a '.csv_cache' folder next to the CSV file, keyed on
+    the path, size and modification time of the file, the requested columns and types, and the read_csv arguments.
+    Repeated reads memory-map the cached arrays (copy-on-write), except string columns which are loaded in memory.
+
+    Args:
+        file_path (str): The path to the CSV file.
+        dtypes (Dict[str, type]): The columns to read and their types.
+        chunksize (int): The number of rows parsed at once.
+        cache (bool): Whether to read and write the cache, a cache that cannot be written is skipped.
+        **kwargs: Additional arguments passed to pandas.read_csv.
+
+    Returns:
+        columns (Dict[str, np.ndarray]): The values of each column.
+    """
+    file_path = os.path.abspath(file_path)
+    stat = os.stat(file_path)
+    key = json.dumps({'file': file_path, 'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                      'dtypes': {name: np.dtype(type).str for name, type in dtypes.items()},
+                      'kwargs': {name: repr(value) for name, value in kwargs.items()}}, sort_keys=True)
+    cache_folder = os.path.join(os.path.dirname(file_path), '.csv_cache',
+                                f'{os.path.basename(file_path)}_{hashlib.sha1(key.encode()).hexdigest()[:16]}')
+
+    if cache and os.path.exists(os.path.join(cache_folder, 'columns.json')):
+        with open(os.path.join(cache_folder, 'columns.json')) as f:
+            layout = json.load(f)
+        columns = {}
+        for k, name in enumerate(layout['names']):
+            if name in layout['objects']:
+                columns[name] = np.load(os.path.join(cache_folder, f'{k}.npy'), allow_pickle=True)
+            else:
+                columns[name] = np.load(os.path.join(cache_folder, f'{k}.npy'), mmap_mode='c')
+        return columns
+
+    chunks = {name: [] for name in dtypes}
+    for chunk in pd.read_csv(file_path, dtype=dtypes, usecols=list(dtypes.keys()), chunksize=chunksize, **kwargs):
+        for name in dtypes:
+            chunks[name].append(chunk[name].values)
+        del chunk
+
+    columns = {}
+    for name in dtypes:
+        columns[name] = np.concatenate(chunks.pop(name))
+
+    if cache:
+        # written to a temporary folder first so that an interrupted write is never read as a cache
+        tmp_folder = f'{cache_folder}.tmp'
+        try:
+            shutil.rmtree(tmp_folder, ignore_errors=True)
+            os.makedirs(tmp_folder)
+            objects = []
+            for k, (name, values) in enumerate(columns.items()):
+                if values.dtype == object:
+                    objects.append(name)
+                np.save(os.path.join(tmp_folder, f'{k}.npy'), values, allow_pickle=values.dtype == object)
+            with open(os.path.join(tmp_folder, 'columns.json'), 'w') as f:
+                json.dump({'names': list(columns), 'objects': objects, 'key': json.loads(key)}, f)
+            shutil.rmtree(cache_folder, ignore_errors=True)
+            os.replace(tmp_folder, cache_folder)
+        except OSError as e:
+            # e.g. a read-only data folder, the columns are returned without a cache
+            print(f"Warning: could not cache the columns of {file_path}: {e}")
+            shutil.rmtree(tmp_folder, ignore_errors=True)
+
+    return columns
+
+
 def load_csv_from_descriptors(
         column_descriptors: Dict[str, CsvDescriptor],
         *,
         device: str = 'cuda:0',
+        cache: bool = True,
         **kwargs
 ) -> Dict[str, torch.Tensor]:
     different_files = set(descriptor.filename for descriptor in column_descriptors.values())
-    columns = []
+    columns = {}
 
     for file in different_files:
         dtypes = {descriptor.column_name: descriptor.type for descriptor in column_descriptors.values()
@@ -272,13 +338,11 @@ def load_csv_from_descriptors(
         print(f"Loading data from '{file}':")
         for column_name, type in dtypes.items():
             print(f"  - column {column_name} as {type}")
-        columns.append(pd.read_csv(file, dtype=dtypes, usecols=list(dtypes.keys()), **kwargs))
-
-    entire_data = pd.concat(columns, axis='columns')
+        columns[file] = read_csv_columns(file, dtypes, cache=cache, **kwargs)
 
     tensors = {}
     for name, descriptor in column_descriptors.items():
-        tensors[name] = torch.tensor(entire_data[descriptor.column_name].values, device=device)
+        tensors[name] = torch.from_numpy(columns[descriptor.filename][descriptor.column_name]).to(device)
 
     return tensors
 
@@ -41,7 +41,7 @@ class PDE_A(pyg.nn.MessagePassing):
             field = torch.ones_like(x[:,0:1])
 
         edge_index, _ = pyg_utils.remove_self_loops(edge_index)
-        particle_type = to_numpy(x[:, 1 + 2*self.dimension])
+        particle_type = x[:, 1 + 2*self.dimension].long()
         parameters = self.p[particle_type,:]
         d_pos = self.propagate(edge_index, pos=x[:, 1:self.dimension+1], parameters=parameters, field=field)
         return d_pos
@@ -37,7 +37,7 @@ class PDE_B_bis(pyg.nn.MessagePassing):
     def forward(self, data):
         x, edge_index = data.x, data.edge_index
         edge_index, _ = pyg_utils.remove_self_loops(edge_index)
-        particle_type = to_numpy(x[:, 5])
+        particle_type = x[:, 5].long()
         parameters = self.p[particle_type, :]
         d_pos = x[:, 3:5].clone().detach()
         dd_pos = self.propagate(edge_index, pos=x[:,1:3], parameters=parameters, d_pos=d_pos)
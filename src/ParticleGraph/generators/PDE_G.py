@@ -32,7 +32,7 @@ class PDE_G(pyg.nn.MessagePassing):
     def forward(self, data):
         x, edge_index = data.x, data.edge_index
         edge_index, _ = pyg_utils.remove_self_loops(edge_index)
-        particle_type = to_numpy(x[:, 5])
+        particle_type = x[:, 5].long()
 
         mass = self.p[particle_type]
         dd_pos = self.propagate(edge_index, pos=x[:,1:3], mass=mass[:,None])
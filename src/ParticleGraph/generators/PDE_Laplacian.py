@@ -14,7 +14,7 @@ class PDE_Laplacian(pyg.nn.MessagePassing):
     Inputs
     ----------
     data : a torch_geometric.data object
-    note the Laplacian coeeficients are in data.edge_attr
+    note the Laplacian coeeficients are in data.edge_attr, or in the sparse matrix data.laplacian
 
     Returns
     -------
@@ -34,7 +34,7 @@ class PDE_Laplacian(pyg.nn.MessagePassing):
         x, edge_index, edge_attr = data.x, data.edge_index, data.edge_attr
 
         if self.coeff == []:
-            particle_type = to_numpy(x[:, 5])
+            particle_type = x[:, 5].long()
             c = self.c[particle_type]
             c = c[:, None]
         else:
@@ -42,7 +42,10 @@ class PDE_Laplacian(pyg.nn.MessagePassing):
 
         u = x[:, 6:7]
 
-        laplacian_u = self.propagate(edge_index, u=u, edge_attr=edge_attr)
+        if 'laplacian' in data:
+            laplacian_u = data.laplacian @ u
+        else:
+            laplacian_u = self.propagate(edge_index, u=u, edge_attr=edge_attr)
         dd_u = self.beta * c * laplacian_u
 
         return dd_u
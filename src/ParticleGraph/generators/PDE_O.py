@@ -36,7 +36,7 @@ class PDE_O(pyg.nn.MessagePassing):
         x, edge_index = data.x, data.edge_index
         edge_index, _ = pyg_utils.remove_self_loops(edge_index)
 
-        particle_type = to_numpy(x[:, 5])
+        particle_type = x[:, 5].long()
         p = self.p[particle_type]
         p = p[:, None]
 
@@ -13,7 +13,7 @@ class RD_FitzHugh_Nagumo(pyg.nn.MessagePassing):
     Inputs
     ----------
     data : a torch_geometric.data object
-    Note the Laplacian coeeficients are in data.edge_attr
+    Note the Laplacian coeeficients are in data.edge_attr, or in the sparse matrix data.laplacian
 
     Returns
     -------
@@ -35,13 +35,16 @@ class RD_FitzHugh_Nagumo(pyg.nn.MessagePassing):
         self.a5 = 0.125
 
     def forward(self, data, device):
-        particle_type = to_numpy(x[:, 5])
+        particle_type = x[:, 5].long()
         c = self.c[particle_type]
         c = c[:, None]
 
         u = data.x[:, 6]
         v = data.x[:, 7]
-        laplace_u = c * self.beta * self.propagate(data.edge_index, u=u, discrete_laplacian=data.edge_attr)
+        if 'laplacian' in data:
+            laplace_u = c * self.beta * (data.laplacian @ u)
+        else:
+            laplace_u = c * self.beta * self.propagate(data.edge_index, u=u, discrete_laplacian=data.edge_attr)
 
         # This is equivalent to the nonlinear reaction diffusion equation:
         #   du = a3 * laplace_u + a4 * (v - v^3 - u * v + noise)
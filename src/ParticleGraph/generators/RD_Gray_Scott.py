@@ -13,7 +13,7 @@ class RD_Gray_Scott(pyg.nn.MessagePassing):
     Inputs
     ----------
     data : a torch_geometric.data object
-    Note the Laplacian coeeficients are in data.edge_attr
+    Note the Laplacian coeeficients are in data.edge_attr, or in the sparse matrix data.laplacian
 
     Returns
     -------
@@ -36,12 +36,15 @@ class RD_Gray_Scott(pyg.nn.MessagePassing):
         F = torch.tensor(0.0283, device=device)
         k = torch.tensor(0.0475, device=device)
 
-        particle_type = to_numpy(x[:, 5])
+        particle_type = x[:, 5].long()
         c = self.c[particle_type]
         c = c[:, None]
 
         uv = data.x[:, 6:8]
-        laplace_uv = c * self.beta * self.propagate(data.edge_index, uv=uv, discrete_laplacian=data.edge_attr)
+        if 'laplacian' in data:
+            laplace_uv = c * self.beta * (data.laplacian @ uv)
+        else:
+            laplace_uv = c * self.beta * self.propagate(data.edge_index, uv=uv, discrete_laplacian=data.edge_attr)
         uxv2 = torch.prod(uv, axis=1) ** 2
 
         # This is equivalent to the nonlinear reaction diffusion equation:
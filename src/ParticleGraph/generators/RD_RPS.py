@@ -13,7 +13,7 @@ class RD_RPS(pyg.nn.MessagePassing):
     Inputs
     ----------
     data : a torch_geometric.data object
-    Note the Laplacian coeeficients are in data.edge_attr
+    Note the Laplacian coeeficients are in data.edge_attr, or in the sparse matrix data.laplacian
 
     Returns
     -------
@@ -35,14 +35,17 @@ class RD_RPS(pyg.nn.MessagePassing):
         x, edge_index, edge_attr = data.x, data.edge_index, data.edge_attr
 
         if self.coeff == []:
-            particle_type = to_numpy(x[:, 5])
+            particle_type = x[:, 5].long()
             c = self.c[particle_type]
             c = c[:, None]
         else:
             c = self.coeff
 
         uvw = data.x[:, 6:9]
-        laplace_uvw = c * self.propagate(data.edge_index, uvw=uvw, discrete_laplacian=data.edge_attr)
+        if 'laplacian' in data:
+            laplace_uvw = c * (data.laplacian @ uvw)
+        else:
+            laplace_uvw = c * self.propagate(data.edge_index, uvw=uvw, discrete_laplacian=data.edge_attr)
         p = torch.sum(uvw, axis=1)
 
         # This is equivalent to the nonlinear reaction diffusion equation:
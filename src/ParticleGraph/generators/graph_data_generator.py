@@ -4,6 +4,11 @@ import networkx as nx
 from torch_geometric.utils.convert import to_networkx
 
 from GNN_particles_Ntype import *
+from ParticleGraph.neighbors import radius_graph, VerletList
+from ParticleGraph.trajectory import save_trajectory, load_trajectory
+from ParticleGraph.normalization import NormStats
+from ParticleGraph.profiling import StageTimer
+from ParticleGraph.renderer import AsyncRenderer, plot_generated_particles, plot_generated_mesh
 from simple_pid import PID
 from scipy import stats
 
@@ -26,12 +31,62 @@ def data_generate(config, visualize=True, run_vizualized=0, style='color', erase
          data_generate_cell(config, visualize=visualize, run_vizualized=run_vizualized, style=style, erase=erase, step=step,
                                         alpha=0.2, ratio=1,
                                         scenario=scenario, device=device, bSave=bSave)
+    elif config.simulation.batch_runs & (config.data_folder_name == 'none'):
+        data_generate_particle_batch(config, visualize=visualize, run_vizualized=run_vizualized, style=style, erase=erase,
+                                     step=step, alpha=0.2, ratio=1, scenario=scenario, device=device, bSave=bSave)
     else:
         data_generate_particle(config, visualize=visualize, run_vizualized=run_vizualized, style=style, erase=erase, step=step,
                                         alpha=0.2, ratio=1,
                                         scenario=scenario, device=device, bSave=bSave)
 
 
+def init_generation_folder(dataset_name, erase):
+    """
+    Create the dataset folder, optionally erase previous results, and clear the generated frames.
+    """
+    folder = f'./graphs_data/graphs_{dataset_name}/'
+    if erase:
+        files = glob.glob(f"{folder}/*")
+        for f in files:
+            if (f[-14:] != 'generated_data') & (f != 'p.pt') & (f != 'cycle_length.pt') & (f != 'model_config.json') & (
+                    f != 'generation_code.py'):
+                os.remove(f)
+    os.makedirs(folder, exist_ok=True)
+    os.makedirs(f'./graphs_data/graphs_{dataset_name}/generated_data/', exist_ok=True)
+    files = glob.glob(f'./graphs_data/graphs_{dataset_name}/generated_data/*')
+    for f in files:
+        os.remove(f)
+    return folder
+
+
+def rotate_velocities(y, angular_sigma, device):
+    """
+    Rotate the predicted velocities by a random angle drawn with a standard deviation of angular_sigma degrees.
+    """
+    phi = torch.randn(y.shape[0], device=device) * angular_sigma / 360 * np.pi * 2
+    cos_phi = torch.cos(phi)
+    sin_phi = torch.sin(phi)
+    new_vx = cos_phi * y[:, 0] - sin_phi * y[:, 1]
+    new_vy = sin_phi * y[:, 0] + cos_phi * y[:, 1]
+    return torch.cat((new_vx[:, None], new_vy[:, None]), 1).clone().detach()
+
+
+def save_particle_run(config, run, x_list, y_list, norm_stats, edge_p_p_list=None):
+    """
+    Save the frames, normalization statistics and, if given, the edge lists of one generated run.
+    """
+    simulation_config = config.simulation
+    dataset_name = config.dataset
+    save_trajectory(x_list, f'graphs_data/graphs_{dataset_name}/x_list_{run}', simulation_config.trajectory_format)
+    save_trajectory(y_list, f'graphs_data/graphs_{dataset_name}/y_list_{run}', simulation_config.trajectory_format)
+    norm_stats.save(f'graphs_data/graphs_{dataset_name}/norm_stats_{run}.npz')
+    edge_file = f'graphs_data/graphs_{dataset_name}/edge_p_p_list_{run}.npz'
+    if simulation_config.save_edges & (edge_p_p_list is not None):
+        np.savez_compressed(edge_file, *edge_p_p_list)
+    elif os.path.exists(edge_file):
+        os.remove(edge_file)
+
+
 def data_generate_particle(config, visualize=True, run_vizualized=0, style='color', erase=False, step=5, alpha=0.2,
                            ratio=1, scenario='none', device=None, bSave=True):
     print('')
@@ -57,23 +112,14 @@ def data_generate_particle(config, visualize=True, run_vizualized=0, style='colo
 
     if config.data_folder_name != 'none':
         print(f'Generating from data ...')
-        generate_from_data(config=config, device=device, visualize=visualize, folder=folder, step=step)
+        generate_from_data(config=config, device=device, visualize=visualize,
+                           folder=f'./graphs_data/graphs_{dataset_name}/', step=step)
         return
 
-    folder = f'./graphs_data/graphs_{dataset_name}/'
-    if erase:
-        files = glob.glob(f"{folder}/*")
-        for f in files:
-            if (f[-14:] != 'generated_data') & (f != 'p.pt') & (f != 'cycle_length.pt') & (f != 'model_config.json') & (
-                    f != 'generation_code.py'):
-                os.remove(f)
-    os.makedirs(folder, exist_ok=True)
-    os.makedirs(f'./graphs_data/graphs_{dataset_name}/generated_data/', exist_ok=True)
-    files = glob.glob(f'./graphs_data/graphs_{dataset_name}/generated_data/*')
-    for f in files:
-        os.remove(f)
+    folder = init_generation_folder(dataset_name, erase)
 
     model, bc_pos, bc_dpos = choose_model(config, device=device)
+    renderer = AsyncRenderer(config.plotting.n_render_workers)
     particle_dropout_mask = np.arange(n_particles)
     if has_particle_dropout:
         draw = np.random.permutation(np.arange(n_particles))
@@ -92,12 +138,16 @@ def data_generate_particle(config, visualize=True, run_vizualized=0, style='colo
         b = simulation_config.angular_Bernouilli
         generative_m = np.array([stats.norm(b[0], b[2]), stats.norm(b[1], b[2])])
 
+    timer = StageTimer(folder, 'generation', training_config.profile, training_config.profiler_iterations,
+                       training_config.profiler_start, device, None)
     for run in range(config.training.n_runs):
 
         n_particles = simulation_config.n_particles
 
         x_list = []
         y_list = []
+        edge_p_p_list = []
+        norm_stats = NormStats(dimension)
 
         # initialize particle and graph states
         X1, V1, T1, H1, A1, N1 = init_particles(config, device=device)
@@ -106,6 +156,8 @@ def data_generate_particle(config, visualize=True, run_vizualized=0, style='colo
             pos = torch.argwhere(T1 == n)
             pos = to_numpy(pos[:, 0].squeeze()).astype(int)
             index_particles.append(pos)
+        if simulation_config.neighbor_skin > 0:
+            verlet_list = VerletList(min_radius, max_radius, simulation_config.neighbor_skin, simulation_config.boundary, simulation_config.neighbor_method)
         if has_adjacency_matrix:
             x = torch.concatenate((N1.clone().detach(), X1.clone().detach(), V1.clone().detach(), T1.clone().detach(),
                  H1.clone().detach(), A1.clone().detach()), 1)
@@ -130,22 +182,19 @@ def data_generate_particle(config, visualize=True, run_vizualized=0, style='colo
                 edge_index = adj_t.nonzero().t().contiguous()
                 dataset = data.Data(x=x, pos=x[:, 1:3], edge_index=edge_index, edge_attr=edge_attr_adjacency)
             else:
-                distance = torch.sum(bc_dpos(x[:, None, 1:dimension + 1] - x[None, :, 1:dimension + 1]) ** 2, dim=2)
-                adj_t = ((distance < max_radius ** 2) & (distance > min_radius ** 2)).float() * 1
-                edge_index = adj_t.nonzero().t().contiguous()
+                if simulation_config.neighbor_skin > 0:
+                    edge_index = verlet_list(x[:, 1:dimension + 1])
+                else:
+                    edge_index = radius_graph(x[:, 1:dimension + 1], min_radius, max_radius, simulation_config.boundary, simulation_config.neighbor_method)
                 dataset = data.Data(x=x, pos=x[:, 1:3], edge_index=edge_index, field=[])
 
+            timer.lap('graph')
             # model prediction
             with torch.no_grad():
                 y = model(dataset)
 
             if simulation_config.angular_sigma > 0:
-                phi = torch.randn(n_particles, device=device) * simulation_config.angular_sigma / 360 * np.pi * 2
-                cos_phi = torch.cos(phi)
-                sin_phi = torch.sin(phi)
-                new_vx = cos_phi * y[:, 0] - sin_phi * y[:, 1]
-                new_vy = sin_phi * y[:, 0] + cos_phi * y[:, 1]
-                y = torch.cat((new_vx[:, None], new_vy[:, None]), 1).clone().detach()
+                y = rotate_velocities(y, simulation_config.angular_sigma, device)
             if simulation_config.angular_Bernouilli != [-1]:
                 z_i = stats.bernoulli(b[3]).rvs(n_particles)
                 phi = np.array([g.rvs() for g in generative_m[z_i]]) / 360 * np.pi * 2
@@ -156,6 +205,7 @@ def data_generate_particle(config, visualize=True, run_vizualized=0, style='colo
                 new_vy = sin_phi * y[:, 0] + cos_phi * y[:, 1]
                 y = torch.cat((new_vx[:, None], new_vy[:, None]), 1).clone().detach()
 
+            timer.lap('model')
 
             # append list
             if (it >= 0) & bSave:
@@ -170,6 +220,9 @@ def data_generate_particle(config, visualize=True, run_vizualized=0, style='colo
                 else:
                     x_list.append(x.clone().detach())
                     y_list.append(y.clone().detach())
+                    if simulation_config.save_edges:
+                        edge_p_p_list.append(to_numpy(edge_index))
+                norm_stats.update(x_list[-1], y_list[-1])
 
             # Particle update
             if has_signal:
@@ -182,173 +235,155 @@ def data_generate_particle(config, visualize=True, run_vizualized=0, style='colo
                     V1 = y
                 X1 = bc_pos(X1 + V1 * delta_t)
             A1 = A1 + delta_t
+            timer.lap('update')
 
             # output plots
             if visualize & (run == run_vizualized) & (it % step == 0) & (it >= 0):
+                if training_config.particle_dropout > 0:
+                    x_dropout = to_numpy(x[inv_particle_dropout_mask])
+                else:
+                    x_dropout = None
+                renderer.submit(plot_generated_particles, dataset_name, run, it, style,
+                                model_config.particle_model_name, model_config.signal_model_name, dimension,
+                                to_numpy(x), to_numpy(X1), to_numpy(H1), index_particles,
+                                [cmap.color(n) for n in range(n_particle_types)], x_dropout)
+            timer.lap('plot')
+            timer.step(x.shape[0], edge_index.shape[1])
 
-                # plt.style.use('dark_background')
-                # matplotlib.use("Qt5Agg")
+        if bSave:
+            # edges are not stored with particle dropout, the saved frames are a renumbered subset of the graph
+            save_particle_run(config, run, x_list, y_list, norm_stats,
+                              None if has_particle_dropout | has_adjacency_matrix else edge_p_p_list)
+            if has_particle_dropout:
+                torch.save(x_removed_list, f'graphs_data/graphs_{dataset_name}/x_removed_list_{run}.pt')
+                np.save(f'graphs_data/graphs_{dataset_name}/particle_dropout_mask.npy', particle_dropout_mask)
+                np.save(f'graphs_data/graphs_{dataset_name}/inv_particle_dropout_mask.npy', inv_particle_dropout_mask)
+            torch.save(model.p, f'graphs_data/graphs_{dataset_name}/model_p.pt')
+        timer.lap('save')
+        timer.epoch_end(run)
 
-                if 'latex' in style:
-                    plt.rcParams['text.usetex'] = True
-                    rc('font', **{'family': 'serif', 'serif': ['Palatino']})
+    timer.close()
+    renderer.close()
 
-                if 'bw' in style:
 
-                    matplotlib.rcParams['savefig.pad_inches'] = 0
-                    fig = plt.figure(figsize=(12, 12))
-                    ax = fig.add_subplot(1, 1, 1)
-                    s_p = 100
-                    for n in range(n_particle_types):
-                            plt.scatter(to_numpy(x[index_particles[n], 1]), to_numpy(x[index_particles[n], 2]),
-                                        s=s_p, color='k')
-                    if training_config.particle_dropout > 0:
-                        plt.scatter(x[inv_particle_dropout_mask, 1].detach().cpu().numpy(),
-                                    x[inv_particle_dropout_mask, 2].detach().cpu().numpy(), s=25, color='k',
-                                    alpha=0.75)
-                        plt.plot(x[inv_particle_dropout_mask, 1].detach().cpu().numpy(),
-                                 x[inv_particle_dropout_mask, 2].detach().cpu().numpy(), '+', color='w')
-                    plt.xlim([0, 1])
-                    plt.ylim([0, 1])
-                    if 'PDE_G' in model_config.particle_model_name:
-                        plt.xlim([-2, 2])
-                        plt.ylim([-2, 2])
-                    if 'latex' in style:
-                        plt.xlabel(r'$x$', fontsize=64)
-                        plt.ylabel(r'$y$', fontsize=64)
-                        plt.xticks(fontsize=32.0)
-                    elif 'frame' in style:
-                        plt.xlabel(r'$x$', fontsize=64)
-                        plt.ylabel(r'$y$', fontsize=64)
-                        plt.xticks(fontsize=32.0)
-                        plt.yticks(fontsize=32.0)
-                    else:
-                        plt.xticks([])
-                        plt.yticks([])
-                    plt.tight_layout()
-                    plt.savefig(f"graphs_data/graphs_{dataset_name}/generated_data/Fig_{run}_{it}.jpg", dpi=170.7)
-                    plt.close()
+def data_generate_particle_batch(config, visualize=True, run_vizualized=0, style='color', erase=False, step=5,
+                                 alpha=0.2, ratio=1, scenario='none', device=None, bSave=True):
+    # all runs are simulated together as disjoint subgraphs of one graph, one model call per frame
+    print('')
 
-                if 'color' in style:
+    simulation_config = config.simulation
+    training_config = config.training
+    model_config = config.graph_model
 
-                    if model_config.particle_model_name == 'PDE_O':
-                        fig = plt.figure(figsize=(12, 12))
-                        plt.scatter(H1[:, 0].detach().cpu().numpy(), H1[:, 1].detach().cpu().numpy(), s=100,
-                                    c=np.sin(to_numpy(H1[:, 2])), vmin=-1, vmax=1, cmap='viridis')
-                        plt.xlim([0, 1])
-                        plt.ylim([0, 1])
-                        plt.xticks([])
-                        plt.yticks([])
-                        plt.tight_layout()
-                        plt.savefig(f"graphs_data/graphs_{dataset_name}/generated_data/Lut_Fig_{run}_{it}.jpg",
-                                    dpi=170.7)
-                        plt.close()
-
-                        fig = plt.figure(figsize=(12, 12))
-                        # plt.scatter(H1[:, 0].detach().cpu().numpy(), H1[:, 1].detach().cpu().numpy(), s=5, c='b')
-                        plt.scatter(to_numpy(X1[:, 0]), to_numpy(X1[:, 1]), s=10, c='lawngreen',
-                                    alpha=0.75)
-                        plt.xlim([0, 1])
-                        plt.ylim([0, 1])
-                        plt.xticks([])
-                        plt.yticks([])
-                        plt.tight_layout()
-                        plt.savefig(f"graphs_data/graphs_{dataset_name}/generated_data/Rot_{run}_Fig{it}.jpg",
-                                    dpi=170.7)
-                        plt.close()
-
-                    elif model_config.signal_model_name == 'PDE_N':
-
-                        matplotlib.rcParams['savefig.pad_inches'] = 0
-                        fig = plt.figure(figsize=(12, 12))
-                        ax = fig.add_subplot(1, 1, 1)
-                        ax.xaxis.set_major_locator(plt.MaxNLocator(3))
-                        ax.yaxis.set_major_locator(plt.MaxNLocator(3))
-                        ax.xaxis.set_major_formatter(FormatStrFormatter('%.1f'))
-                        ax.yaxis.set_major_formatter(FormatStrFormatter('%.1f'))
-                        plt.scatter(to_numpy(X1[:, 0]), to_numpy(X1[:, 1]), s=200, c=to_numpy(H1[:, 0]), cmap='cool',
-                                    vmin=0, vmax=3)
-                        plt.xlim([-1.5, 1.5])
-                        plt.ylim([-1.5, 1.5])
-                        plt.text(0, 1.1, f'frame {it}', ha='left', va='top', transform=ax.transAxes, fontsize=24)
-                        # cbar = plt.colorbar(shrink=0.5)
-                        # cbar.ax.tick_params(labelsize=32)
-                        plt.xticks([])
-                        plt.yticks([])
-                        plt.tight_layout()
-                        plt.savefig(f"graphs_data/graphs_{dataset_name}/generated_data/Fig_{run}_{10000 + it}.tif",
-                                    dpi=42.675)
-                        plt.close()
+    print(f'Generating data (batched runs) ... {model_config.particle_model_name}')
 
-                    elif (model_config.particle_model_name == 'PDE_A') & (dimension == 3):
+    if config.data_folder_name != 'none':
+        raise ValueError('Batched generation does not support generation from data, use data_generate_particle')
+    if model_config.particle_model_name not in ['PDE_A', 'PDE_B', 'PDE_E', 'PDE_G']:
+        raise ValueError(f'Batched generation is not available for {model_config.particle_model_name}')
+    if (simulation_config.connectivity_file != '') | (model_config.signal_model_name != '') | (
+            training_config.particle_dropout > 0) | (simulation_config.angular_Bernouilli != [-1]):
+        raise ValueError('Batched generation does not support connectivity files, signals, particle dropout '
+                         'or angular_Bernouilli')
 
-                        fig = plt.figure(figsize=(12, 12))
-                        ax = fig.add_subplot(111, projection='3d')
-                        for n in range(n_particle_types):
-                            ax.scatter(to_numpy(x[index_particles[n], 1]), to_numpy(x[index_particles[n], 2]),
-                                       to_numpy(x[index_particles[n], 3]), s=50, color=cmap.color(n))
-                        ax.set_xlim([0, 1])
-                        ax.set_ylim([0, 1])
-                        ax.set_zlim([0, 1])
-                        pl.savefig(f"graphs_data/graphs_{dataset_name}/generated_data/Fig_{run}_{it}.jpg", dpi=170.7)
-                        plt.close()
+    dimension = simulation_config.dimension
+    max_radius = simulation_config.max_radius
+    min_radius = simulation_config.min_radius
+    n_particle_types = simulation_config.n_particle_types
+    n_particles = simulation_config.n_particles
+    delta_t = simulation_config.delta_t
+    n_frames = simulation_config.n_frames
+    n_runs = training_config.n_runs
+    cmap = CustomColorMap(config=config)
+    dataset_name = config.dataset
 
-                    else:
-                        # matplotlib.use("Qt5Agg")
-
-                        matplotlib.rcParams['savefig.pad_inches'] = 0
-                        fig = plt.figure(figsize=(12, 12))
-                        ax = fig.add_subplot(1, 1, 1)
-                        ax.xaxis.get_major_formatter()._usetex = False
-                        ax.yaxis.get_major_formatter()._usetex = False
-                        ax.xaxis.set_major_locator(plt.MaxNLocator(3))
-                        ax.yaxis.set_major_locator(plt.MaxNLocator(3))
-                        ax.xaxis.set_major_formatter(FormatStrFormatter('%.1f'))
-                        ax.yaxis.set_major_formatter(FormatStrFormatter('%.1f'))
-                        s_p = 100
-                        for n in range(n_particle_types):
-                                plt.scatter(to_numpy(x[index_particles[n], 1]), to_numpy(x[index_particles[n], 2]),
-                                            s=s_p, color=cmap.color(n))
-                        if training_config.particle_dropout > 0:
-                            plt.scatter(x[inv_particle_dropout_mask, 1].detach().cpu().numpy(),
-                                        x[inv_particle_dropout_mask, 2].detach().cpu().numpy(), s=25, color='k',
-                                        alpha=0.75)
-                            plt.plot(x[inv_particle_dropout_mask, 1].detach().cpu().numpy(),
-                                     x[inv_particle_dropout_mask, 2].detach().cpu().numpy(), '+', color='w')
-                        plt.xlim([0, 1])
-                        plt.ylim([0, 1])
-                        if 'PDE_G' in model_config.particle_model_name:
-                            plt.xlim([-2, 2])
-                            plt.ylim([-2, 2])
-                        if 'latex' in style:
-                            plt.xlabel(r'$x$', fontsize=64)
-                            plt.ylabel(r'$y$', fontsize=64)
-                            plt.xticks(fontsize=32.0)
-                            plt.yticks(fontsize=32.0)
-                        elif 'frame' in style:
-                            plt.xlabel('x', fontsize=32)
-                            plt.ylabel('y', fontsize=32)
-                            plt.xticks(fontsize=32.0)
-                            plt.yticks(fontsize=32.0)
-                            ax.tick_params(axis='both', which='major', pad=15)
-                            plt.text(0, 1.1, f'frame {it}', ha='left', va='top', transform=ax.transAxes, fontsize=32)
-                        else:
-                            plt.xticks([])
-                            plt.yticks([])
-                        plt.tight_layout()
-                        plt.savefig(f"graphs_data/graphs_{dataset_name}/generated_data/Fig_{run}_{it}.tif", dpi=170.7)
-                        # plt.savefig(f"graphs_data/graphs_{dataset_name}/generated_data/Fig_{run}_{10000+it}.tif", dpi=42.675)
-                        plt.close()
+    folder = init_generation_folder(dataset_name, erase)
 
-        if bSave:
-            torch.save(x_list, f'graphs_data/graphs_{dataset_name}/x_list_{run}.pt')
-            if has_particle_dropout:
-                torch.save(x_removed_list, f'graphs_data/graphs_{dataset_name}/x_removed_list_{run}.pt')
-                np.save(f'graphs_data/graphs_{dataset_name}/particle_dropout_mask.npy', particle_dropout_mask)
-                np.save(f'graphs_data/graphs_{dataset_name}/inv_particle_dropout_mask.npy', inv_particle_dropout_mask)
-            torch.save(y_list, f'graphs_data/graphs_{dataset_name}/y_list_{run}.pt')
-            torch.save(model.p, f'graphs_data/graphs_{dataset_name}/model_p.pt')
+    model, bc_pos, bc_dpos = choose_model(config, device=device)
+    renderer = AsyncRenderer(config.plotting.n_render_workers)
+
+    # initialize particle states of every run, run k occupies rows k * n_particles to (k + 1) * n_particles
+    states = [init_particles(config, device=device) for run in range(n_runs)]
+    X1, V1, T1, H1, A1, N1 = [torch.cat([state[k] for state in states], 0) for k in range(6)]
+    run_slices = [slice(run * n_particles, (run + 1) * n_particles) for run in range(n_runs)]
 
+    index_particles = []
+    for n in range(n_particle_types):
+        pos = torch.argwhere(states[run_vizualized][2] == n)
+        pos = to_numpy(pos[:, 0].squeeze()).astype(int)
+        index_particles.append(pos)
+
+    if simulation_config.neighbor_skin > 0:
+        verlet_lists = [VerletList(min_radius, max_radius, simulation_config.neighbor_skin, simulation_config.boundary,
+                                   simulation_config.neighbor_method) for run in range(n_runs)]
+
+    x_list = [[] for run in range(n_runs)]
+    y_list = [[] for run in range(n_runs)]
+    edge_p_p_list = [[] for run in range(n_runs)]
+    norm_stats = [NormStats(dimension) for run in range(n_runs)]
+
+    timer = StageTimer(folder, 'generation', training_config.profile, training_config.profiler_iterations,
+                       training_config.profiler_start, device, None)
+    time.sleep(0.5)
+    for it in trange(simulation_config.start_frame, n_frames + 1):
+
+        x = torch.concatenate(
+            (N1.clone().detach(), X1.clone().detach(), V1.clone().detach(), T1.clone().detach(),
+             H1.clone().detach(), A1.clone().detach()), 1)
+
+        # the runs do not interact, each run has its own radius graph
+        edge_index = []
+        for run in range(n_runs):
+            if simulation_config.neighbor_skin > 0:
+                edges = verlet_lists[run](x[run_slices[run], 1:dimension + 1])
+            else:
+                edges = radius_graph(x[run_slices[run], 1:dimension + 1], min_radius, max_radius, simulation_config.boundary, simulation_config.neighbor_method)
+            if (it >= 0) & bSave & simulation_config.save_edges:
+                edge_p_p_list[run].append(to_numpy(edges))
+            edge_index.append(edges + run * n_particles)
+        edge_index = torch.cat(edge_index, 1)
+        dataset = data.Data(x=x, pos=x[:, 1:3], edge_index=edge_index, field=[])
+        timer.lap('graph')
+
+        with torch.no_grad():
+            y = model(dataset)
+
+        if simulation_config.angular_sigma > 0:
+            y = rotate_velocities(y, simulation_config.angular_sigma, device)
+        timer.lap('model')
+
+        if (it >= 0) & bSave:
+            for run in range(n_runs):
+                x_list[run].append(x[run_slices[run]].clone().detach())
+                y_list[run].append(y[run_slices[run]].clone().detach())
+                norm_stats[run].update(x_list[run][-1], y_list[run][-1])
+
+        if model_config.prediction == '2nd_derivative':
+            V1 += y * delta_t
+        else:
+            V1 = y
+        X1 = bc_pos(X1 + V1 * delta_t)
+        A1 = A1 + delta_t
+        timer.lap('update')
+
+        if visualize & (it % step == 0) & (it >= 0):
+            s = run_slices[run_vizualized]
+            renderer.submit(plot_generated_particles, dataset_name, run_vizualized, it, style,
+                            model_config.particle_model_name, model_config.signal_model_name, dimension,
+                            to_numpy(x[s]), to_numpy(X1[s]), to_numpy(H1[s]), index_particles,
+                            [cmap.color(n) for n in range(n_particle_types)], None)
+        timer.lap('plot')
+        timer.step(x.shape[0], edge_index.shape[1])
+
+    if bSave:
+        for run in range(n_runs):
+            save_particle_run(config, run, x_list[run], y_list[run], norm_stats[run], edge_p_p_list[run])
+        torch.save(model.p, f'graphs_data/graphs_{dataset_name}/model_p.pt')
+    timer.lap('save')
+    timer.epoch_end(0)
+
+    timer.close()
+    renderer.close()
 
 def data_generate_cell(config, visualize=True, run_vizualized=0, style='color', erase=False, step=5, alpha=0.2,
                            ratio=1, scenario='none', device=None, bSave=True):
@@ -394,6 +429,8 @@ def data_generate_cell(config, visualize=True, run_vizualized=0, style='color',
     logger.setLevel(logging.INFO)
     logger.info(config)
 
+    timer = StageTimer(folder, 'generation', training_config.profile, training_config.profiler_iterations,
+                       training_config.profiler_start, device, logger)
     for run in range(config.training.n_runs):
 
         torch.cuda.empty_cache()
@@ -404,6 +441,7 @@ def data_generate_cell(config, visualize=True, run_vizualized=0, style='color',
 
         x_list = []
         y_list = []
+        norm_stats = NormStats(dimension)
         edge_p_p_list = []
 
         # initialize cell states
@@ -437,6 +475,9 @@ def data_generate_cell(config, visualize=True, run_vizualized=0, style='color',
         logger.info('interaction parameters')
         logger.info(to_numpy(model.p))
 
+        cells = CellPopulation(X1, V1, T1, H1, A1, cycle_length_distrib, cell_death_rate_distrib, n_particles_max)
+        X1, V1, T1, H1, A1, N1, cycle_length_distrib, cell_death_rate_distrib = cells.views()
+
         index_particles = []
         for n in range(n_particle_types):
             pos = torch.argwhere(T1 == n)
@@ -458,40 +499,24 @@ def data_generate_cell(config, visualize=True, run_vizualized=0, style='color',
                 n_particles_dead = n_particles - n_particles_alive
                 pos = torch.argwhere((A1.squeeze() > cycle_length_distrib) & (H1[:,0].squeeze() == 1))
                 if (len(pos) > 1):
-                    n_add_nodes = len(pos)
                     pos = to_numpy(pos[:, 0].squeeze()).astype(int)
-                    H1[:,1] = 0
-                    H1[pos,1]= A1[pos, 0].clone().detach()    # cell division, copy cell age
-                    H1 = torch.concatenate((H1, torch.ones((n_add_nodes,2), device=device)), 0)
-                    H1[-n_add_nodes:,1] = 0
-                    n_particles = n_particles + n_add_nodes
-                    N1 = torch.arange(n_particles, device=device)
-                    N1 = N1[:, None]
-                    separation = 1E-3 * torch.randn((n_add_nodes, dimension), device=device)
-                    X1 = torch.cat((X1, X1[pos, :] + separation), dim=0)
-                    X1[pos, :] = X1[pos, :] - separation
-                    V1 = torch.cat((V1, -V1[pos, :]), dim=0)    # the new cell is moving away from it's mother
-                    T1 = torch.cat((T1, T1[pos, :]), dim=0)     # the new cell inherits it's mother's type
-                    A1[pos, :] = 0  # age set to zero
-                    A1 = torch.cat((A1, A1[pos, :]), dim=0)
-                    nd = torch.ones(len(pos), device=device) + 0.05 * torch.randn(len(pos), device=device)
-                    cycle_length_distrib = torch.cat((cycle_length_distrib, cycle_length[to_numpy(T1[pos, 0])].squeeze() * nd), dim=0)
-                    cell_death_rate_distrib = torch.cat((cell_death_rate_distrib, cell_death_rate[to_numpy(T1[pos, 0])].squeeze() * nd), dim=0)
+                    cells.divide(pos, cycle_length, cell_death_rate)
+                    n_particles = cells.n
+                    X1, V1, T1, H1, A1, N1, cycle_length_distrib, cell_death_rate_distrib = cells.views()
                     index_particles = []
-                    for n in range(n_particles):
+                    for n in range(n_particle_types):
                         pos = torch.argwhere(T1 == n)
                         pos = to_numpy(pos[:, 0].squeeze()).astype(int)
                         index_particles.append(pos)
 
-            A1 = A1 + delta_t   # update age
+            A1 += delta_t   # update age
+            timer.lap('update')
 
             x = torch.concatenate((N1.clone().detach(), X1.clone().detach(), V1.clone().detach(), T1.clone().detach(), H1.clone().detach(), A1.clone().detach()), 1)
 
             # calculate connectivity
             with torch.no_grad():
-                edge_index = torch.sum(bc_dpos(x[:, None, 1:dimension + 1] - x[None, :, 1:dimension + 1]) ** 2, dim=2)
-                edge_index = ((edge_index < max_radius ** 2) & (edge_index > min_radius ** 2)).float() * 1
-                edge_index = edge_index.nonzero().t().contiguous()
+                edge_index = radius_graph(x[:, 1:dimension + 1], min_radius, max_radius, simulation_config.boundary, simulation_config.neighbor_method)
                 edge_p_p_list.append(to_numpy(edge_index))
                 alive = (H1[:,0] == 1).float()*1.
                 dataset = data.Data(x=x, pos=x[:, 1:3], edge_index=edge_index)
@@ -503,10 +528,12 @@ def data_generate_cell(config, visualize=True, run_vizualized=0, style='color',
                 max_radius_list.append(max_radius)
                 edges_len_list.append(edge_index.shape[1])
                 x_len_list.append(x.shape[0])
+            timer.lap('graph')
             # model prediction
             with torch.no_grad():
                 y = model(dataset, has_field=True)
                 y = y * alive[:,None].repeat(1,2)
+            timer.lap('model')
 
             if (it) % 25 == 0:
                 t, r, a = get_gpu_memory_map(device)
@@ -518,15 +545,17 @@ def data_generate_cell(config, visualize=True, run_vizualized=0, style='color',
             if (it >= 0):
                 x_list.append(x)
                 y_list.append(y)
+                norm_stats.update(x, y)
 
             # cell update
             if model_config.prediction == '2nd_derivative':
                 V1 += y * delta_t
             else:
-                V1 = y
+                V1[:] = y
 
-            V1 = V1 * alive[:,None].repeat(1,2)
-            X1 = bc_pos(X1 + V1 * delta_t)
+            V1 *= alive[:,None].repeat(1,2)
+            X1[:] = bc_pos(X1 + V1 * delta_t)
+            timer.lap('update')
 
 
             # output plots
@@ -630,16 +659,23 @@ def data_generate_cell(config, visualize=True, run_vizualized=0, style='color',
                 plt.savefig(f"graphs_data/graphs_{dataset_name}/max_radius_{run}.jpg", dpi=170.7)
                 plt.close()
 
+            timer.lap('plot')
+            timer.step(x.shape[0], edge_index.shape[1])
+
         if bSave:
-            torch.save(x_list, f'graphs_data/graphs_{dataset_name}/x_list_{run}.pt')
-            torch.save(y_list, f'graphs_data/graphs_{dataset_name}/y_list_{run}.pt')
-            np.savez(f'graphs_data/graphs_{dataset_name}/edge_p_p_list_{run}',*edge_p_p_list)
+            save_trajectory(x_list, f'graphs_data/graphs_{dataset_name}/x_list_{run}', simulation_config.trajectory_format)
+            save_trajectory(y_list, f'graphs_data/graphs_{dataset_name}/y_list_{run}', simulation_config.trajectory_format)
+            norm_stats.save(f'graphs_data/graphs_{dataset_name}/norm_stats_{run}.npz')
+            np.savez_compressed(f'graphs_data/graphs_{dataset_name}/edge_p_p_list_{run}', *edge_p_p_list)
             torch.save(cycle_length, f'graphs_data/graphs_{dataset_name}/cycle_length.pt')
-            torch.save(cycle_length_distrib, f'graphs_data/graphs_{dataset_name}/cycle_length_distrib.pt')
+            torch.save(cycle_length_distrib.clone(), f'graphs_data/graphs_{dataset_name}/cycle_length_distrib.pt')
             torch.save(cell_death_rate, f'graphs_data/graphs_{dataset_name}/cell_death_rate.pt')
-            torch.save(cell_death_rate_distrib, f'graphs_data/graphs_{dataset_name}/cell_death_rate_distrib.pt')
+            torch.save(cell_death_rate_distrib.clone(), f'graphs_data/graphs_{dataset_name}/cell_death_rate_distrib.pt')
             torch.save(model.p, f'graphs_data/graphs_{dataset_name}/model_p.pt')
+        timer.lap('save')
+        timer.epoch_end(run)
 
+    timer.close()
     logging.shutdown()
 
 
@@ -671,7 +707,10 @@ def data_generate_mesh(config, visualize=True, run_vizualized=0, style='color',
     for f in files:
         os.remove(f)
     mesh_model = choose_mesh_model(config, device=device)
+    renderer = AsyncRenderer(config.plotting.n_render_workers)
 
+    timer = StageTimer(folder, 'generation', training_config.profile, training_config.profiler_iterations,
+                       training_config.profiler_start, device, None)
     for run in range(config.training.n_runs):
 
         X1_mesh, V1_mesh, T1_mesh, H1_mesh, A1_mesh, N1_mesh, mesh_data = init_mesh(config, model_mesh=mesh_model, device=device)
@@ -695,7 +734,9 @@ def data_generate_mesh(config, visualize=True, run_vizualized=0, style='color',
 
             dataset_mesh = data.Data(x=x_mesh, edge_index=mesh_data['edge_index'],
                                      edge_attr=mesh_data['edge_weight'], device=device)
-
+            if simulation_config.sparse_laplacian:
+                dataset_mesh.laplacian = mesh_data['laplacian']
+            timer.lap('graph')
 
             match config.graph_model.mesh_model_name:
                 case 'DiffMesh':
@@ -722,110 +763,23 @@ def data_generate_mesh(config, visualize=True, run_vizualized=0, style='color',
                 case 'PDE_O_Mesh':
                     pred = []
 
+            timer.lap('model')
             y_mesh_list.append(pred)
 
             if visualize & (run == run_vizualized) & (it % step == 0) & (it >= 0):
-
-                # plt.style.use('dark_background')
-                # matplotlib.use("Qt5Agg")
-
-                if 'latex' in style:
-                    plt.rcParams['text.usetex'] = True
-                    rc('font', **{'family': 'serif', 'serif': ['Palatino']})
-
-                if 'graph' in style:
-
-                    fig = plt.figure(figsize=(12, 12))
-                    match model_config.mesh_model_name:
-                        case 'RD_RPS_Mesh':
-                            H1_IM = torch.reshape(x_mesh[:, 6:9], (100, 100, 3))
-                            plt.imshow(to_numpy(H1_IM), vmin=0, vmax=1)
-                        case 'Wave_Mesh' | 'DiffMesh':
-                            pts = x_mesh[:, 1:3].detach().cpu().numpy()
-                            tri = Delaunay(pts)
-                            colors = torch.sum(x_mesh[tri.simplices, 6], dim=1) / 3.0
-                            plt.tripcolor(pts[:, 0], pts[:, 1], tri.simplices.copy(),
-                                          facecolors=colors.detach().cpu().numpy(), edgecolors='k', vmin=-2500,
-                                          vmax=2500)
-                            plt.xlim([0, 1])
-                            plt.ylim([0, 1])
-                    plt.xticks([])
-                    plt.yticks([])
-                    plt.tight_layout()
-                    plt.savefig(f"graphs_data/graphs_{dataset_name}/generated_data/Fig_g_color_{it}.tif", dpi=300)
-                    plt.close()
-
-                if 'color' in style:
-
-                    # matplotlib.use("Qt5Agg")
-
-                    matplotlib.rcParams['savefig.pad_inches'] = 0
-                    fig = plt.figure(figsize=(12, 12))
-                    ax = fig.add_subplot(1, 1, 1)
-                    ax.xaxis.get_major_formatter()._usetex = False
-                    ax.yaxis.get_major_formatter()._usetex = False
-                    ax.xaxis.set_major_locator(plt.MaxNLocator(3))
-                    ax.yaxis.set_major_locator(plt.MaxNLocator(3))
-                    ax.xaxis.set_major_formatter(FormatStrFormatter('%.1f'))
-                    ax.yaxis.set_major_formatter(FormatStrFormatter('%.1f'))
-
-                    pts = x_mesh[:, 1:3].detach().cpu().numpy()
-                    tri = Delaunay(pts)
-                    colors = torch.sum(x_mesh[tri.simplices, 6], dim=1) / 3.0
-                    match model_config.mesh_model_name:
-                        case 'DiffMesh':
-                            plt.tripcolor(pts[:, 0], pts[:, 1], tri.simplices.copy(),
-                                          facecolors=colors.detach().cpu().numpy(), vmin=0, vmax=1000)
-                        case 'WaveMesh':
-                            plt.tripcolor(pts[:, 0], pts[:, 1], tri.simplices.copy(),
-                                          facecolors=colors.detach().cpu().numpy(), vmin=-1000, vmax=1000)
-                            fmt = lambda x, pos: '{:.1f}'.format((x)/100, pos)
-                            ax.yaxis.set_major_formatter(mpl.ticker.FuncFormatter(fmt))
-                            ax.xaxis.set_major_formatter(mpl.ticker.FuncFormatter(fmt))
-                            plt.xlim([0, 1])
-                            plt.ylim([0, 1])
-                        case 'RD_Gray_Scott_Mesh':
-                            fig = plt.figure(figsize=(12, 6))
-                            ax = fig.add_subplot(1, 2, 1)
-                            colors = torch.sum(x[tri.simplices, 6], dim=1) / 3.0
-                            plt.tripcolor(pts[:, 0], pts[:, 1], tri.simplices.copy(),
-                                          facecolors=colors.detach().cpu().numpy(), vmin=0, vmax=1)
-                            plt.xticks([])
-                            plt.yticks([])
-                            plt.axis('off')
-                        case 'RD_RPS_Mesh' | 'RD_RPS_Mesh_bis':
-                            H1_IM = torch.reshape(H1, (100, 100, 3))
-                            plt.imshow(H1_IM.detach().cpu().numpy(), vmin=0, vmax=1)
-                            fmt = lambda x, pos: '{:.1f}'.format((x)/100, pos)
-                            ax.yaxis.set_major_formatter(mpl.ticker.FuncFormatter(fmt))
-                            ax.xaxis.set_major_formatter(mpl.ticker.FuncFormatter(fmt))
-                            # plt.xticks([])
-                            # plt.yticks([])
-                            # plt.axis('off')`
-                    if 'latex' in style:
-                        plt.xlabel(r'$x$', fontsize=64)
-                        plt.ylabel(r'$y$', fontsize=64)
-                        plt.xticks(fontsize=32.0)
-                        plt.yticks(fontsize=32.0)
-                    elif 'frame' in style:
-                        plt.xlabel('x', fontsize=32)
-                        plt.ylabel('y', fontsize=32)
-                        plt.xticks(fontsize=32.0)
-                        plt.yticks(fontsize=32.0)
-                        ax.tick_params(axis='both', which='major', pad=15)
-                        plt.text(0, 1.1, f'frame {it}', ha='left', va='top', transform=ax.transAxes, fontsize=32)
-                    else:
-                        plt.xticks([])
-                        plt.yticks([])
-
-                    plt.tight_layout()
-                    plt.savefig(f"graphs_data/graphs_{dataset_name}/generated_data/Fig_{run}_{it}.tif", dpi=170.7)
-                    # plt.savefig(f"graphs_data/graphs_{dataset_name}/generated_data/Fig_{run}_{10000+it}.tif", dpi=42.675)
-                    plt.close()
+                renderer.submit(plot_generated_mesh, dataset_name, run, it, style, model_config.mesh_model_name,
+                                to_numpy(x_mesh), to_numpy(H1_mesh))
+            timer.lap('plot')
+            timer.step(x_mesh.shape[0], mesh_data['edge_index'].shape[1])
 
         if bSave:
-            torch.save(x_mesh_list, f'graphs_data/graphs_{dataset_name}/x_mesh_list_{run}.pt')
-            torch.save(y_mesh_list, f'graphs_data/graphs_{dataset_name}/y_mesh_list_{run}.pt')
+            save_trajectory(x_mesh_list, f'graphs_data/graphs_{dataset_name}/x_mesh_list_{run}', simulation_config.trajectory_format)
+            save_trajectory(y_mesh_list, f'graphs_data/graphs_{dataset_name}/y_mesh_list_{run}', simulation_config.trajectory_format)
+        timer.lap('save')
+        timer.epoch_end(run)
+
+    timer.close()
+    renderer.close()
 
 
 def data_generate_particle_field(config, visualize=True, run_vizualized=0, style='color', erase=False, step=5, alpha=0.2, ratio=1,
@@ -895,12 +849,15 @@ def data_generate_particle_field(config, visualize=True, run_vizualized=0, style
         edge_index = adj_t.nonzero().t().contiguous()
         edge_attr_adjacency = adjacency[adj_t]
 
+    timer = StageTimer(folder, 'generation', training_config.profile, training_config.profiler_iterations,
+                       training_config.profiler_start, device, None)
     for run in range(config.training.n_runs):
 
         n_particles = simulation_config.n_particles
 
         x_list = []
         y_list = []
+        norm_stats = NormStats(dimension)
         x_mesh_list = []
         y_mesh_list = []
         edge_p_p_list = []
@@ -956,17 +913,15 @@ def data_generate_particle_field(config, visualize=True, run_vizualized=0, style
             # compute connectivity rules
             dataset_mesh = data.Data(x=x_mesh, edge_index=mesh_data['edge_index'],
                                      edge_attr=mesh_data['edge_weight'], device=device)
+            if simulation_config.sparse_laplacian:
+                dataset_mesh.laplacian = mesh_data['laplacian']
 
-            distance = torch.sum(bc_dpos(x[:, None, 1:dimension+1] - x[None, :, 1:dimension+1]) ** 2, dim=2)
-            adj_t = ((distance < max_radius ** 2) & (distance > min_radius ** 2)).float() * 1
-            edge_index = adj_t.nonzero().t().contiguous()
+            edge_index = radius_graph(x[:, 1:dimension + 1], min_radius, max_radius, simulation_config.boundary, simulation_config.neighbor_method)
             dataset_p_p = data.Data(x=x, pos=x[:, 1:3], edge_index=edge_index)
             if not(has_particle_dropout):
                 edge_p_p_list.append(edge_index)
 
-            distance = torch.sum(bc_dpos(x_particle_field[:, None, 1:dimension+1] - x_particle_field[None, :, 1:dimension+1]) ** 2, dim=2)
-            adj_t = ((distance < (max_radius/2) ** 2) & (distance > min_radius ** 2)).float() * 1
-            edge_index = adj_t.nonzero().t().contiguous()
+            edge_index = radius_graph(x_particle_field[:, 1:dimension + 1], min_radius, max_radius/2, simulation_config.boundary, simulation_config.neighbor_method)
             pos = torch.argwhere((edge_index[1,:]>=n_nodes) & (edge_index[0,:]<n_nodes))
             pos = to_numpy(pos[:,0])
             edge_index = edge_index[:,pos]
@@ -974,12 +929,14 @@ def data_generate_particle_field(config, visualize=True, run_vizualized=0, style
             if not (has_particle_dropout):
                 edge_f_p_list.append(edge_index)
 
+            timer.lap('graph')
 
             # model prediction
             with torch.no_grad():
                 y0 = model_p_p(dataset_p_p,has_field=False)
                 y1 = model_f_p(dataset_f_p,has_field=True)[n_nodes:]
                 y = y0 + y1
+            timer.lap('model')
 
             # append list
             if (it >= 0) & bSave:
@@ -992,18 +949,14 @@ def data_generate_particle_field(config, visualize=True, run_vizualized=0, style
                     x_[:, 0] = torch.arange(len(x_), device=device)
                     x_list.append(x_)
                     y_list.append(y[particle_dropout_mask].clone().detach())
+                    norm_stats.update(x_list[-1], y_list[-1])
 
-                    distance = torch.sum(bc_dpos(x_[:, None, 1:dimension + 1] - x_[None, :, 1:dimension + 1]) ** 2, dim=2)
-                    adj_t = ((distance < max_radius ** 2) & (distance > min_radius ** 2)).float() * 1
-                    edge_index = adj_t.nonzero().t().contiguous()
+                    edge_index = radius_graph(x_[:, 1:dimension + 1], min_radius, max_radius, simulation_config.boundary, simulation_config.neighbor_method)
                     edge_p_p_list.append(edge_index)
 
                     x_particle_field = torch.concatenate((x_mesh, x_), dim=0)
 
-                    distance = torch.sum(bc_dpos(
-                        x_particle_field[:, None, 1:dimension + 1] - x_particle_field[None, :, 1:dimension + 1]) ** 2, dim=2)
-                    adj_t = ((distance < (max_radius / 2) ** 2) & (distance > min_radius ** 2)).float() * 1
-                    edge_index = adj_t.nonzero().t().contiguous()
+                    edge_index = radius_graph(x_particle_field[:, 1:dimension + 1], min_radius, max_radius / 2, simulation_config.boundary, simulation_config.neighbor_method)
                     pos = torch.argwhere((edge_index[1, :] >= n_nodes) & (edge_index[0, :] < n_nodes))
                     pos = to_numpy(pos[:, 0])
                     edge_index = edge_index[:, pos]
@@ -1012,6 +965,7 @@ def data_generate_particle_field(config, visualize=True, run_vizualized=0, style
                 else:
                     x_list.append(x.clone().detach())
                     y_list.append(y.clone().detach())
+                    norm_stats.update(x_list[-1], y_list[-1])
 
             # Particle update
             if model_config.prediction == '2nd_derivative':
@@ -1026,6 +980,7 @@ def data_generate_particle_field(config, visualize=True, run_vizualized=0, style
             x_mesh_list.append(x_mesh.clone().detach())
             pred = x_mesh[:,6:7]
             y_mesh_list.append(pred)
+            timer.lap('update')
 
             # output plots
             if visualize & (run == run_vizualized) & (it % step == 0) & (it >= 0):
@@ -1194,17 +1149,25 @@ def data_generate_particle_field(config, visualize=True, run_vizualized=0, style
                     plt.savefig(f"graphs_data/graphs_{dataset_name}/generated_data/Arrow_{run}_{it}.jpg", dpi=42.675)
                     plt.close()
 
+            timer.lap('plot')
+            timer.step(x.shape[0], dataset_p_p.num_edges + dataset_f_p.num_edges)
+
         if bSave:
-            torch.save(x_list, f'graphs_data/graphs_{dataset_name}/x_list_{run}.pt')
+            save_trajectory(x_list, f'graphs_data/graphs_{dataset_name}/x_list_{run}', simulation_config.trajectory_format)
             if has_particle_dropout:
                 torch.save(x_removed_list, f'graphs_data/graphs_{dataset_name}/x_removed_list_{run}.pt')
                 np.save(f'graphs_data/graphs_{dataset_name}/particle_dropout_mask.npy', particle_dropout_mask)
                 np.save(f'graphs_data/graphs_{dataset_name}/inv_particle_dropout_mask.npy', inv_particle_dropout_mask)
-            torch.save(y_list, f'graphs_data/graphs_{dataset_name}/y_list_{run}.pt')
-            torch.save(x_mesh_list, f'graphs_data/graphs_{dataset_name}/x_mesh_list_{run}.pt')
-            torch.save(y_mesh_list, f'graphs_data/graphs_{dataset_name}/y_mesh_list_{run}.pt')
+            save_trajectory(y_list, f'graphs_data/graphs_{dataset_name}/y_list_{run}', simulation_config.trajectory_format)
+            norm_stats.save(f'graphs_data/graphs_{dataset_name}/norm_stats_{run}.npz')
+            save_trajectory(x_mesh_list, f'graphs_data/graphs_{dataset_name}/x_mesh_list_{run}', simulation_config.trajectory_format)
+            save_trajectory(y_mesh_list, f'graphs_data/graphs_{dataset_name}/y_mesh_list_{run}', simulation_config.trajectory_format)
             torch.save(edge_p_p_list, f'graphs_data/graphs_{dataset_name}/edge_p_p_list{run}.pt')
             torch.save(edge_f_p_list, f'graphs_data/graphs_{dataset_name}/edge_f_p_list{run}.pt')
             torch.save(cycle_length, f'graphs_data/graphs_{dataset_name}/cycle_length.pt')
             torch.save(cycle_length_distrib, f'graphs_data/graphs_{dataset_name}/cycle_length_distrib.pt')
             torch.save(model_p_p.p, f'graphs_data/graphs_{dataset_name}/model_p.pt')
+        timer.lap('save')
+        timer.epoch_end(run)
+
+    timer.close()
@@ -1,3 +1,7 @@
+import hashlib
+import json
+import os
+
 import torch
 import numpy as np
 import matplotlib.pyplot as plt
@@ -6,7 +10,7 @@ import matplotlib
 from tifffile import imread
 from ParticleGraph.generators import PDE_A, PDE_B, PDE_B_bis, PDE_E, PDE_G, PDE_GS, PDE_N, PDE_Z, RD_Gray_Scott, RD_FitzHugh_Nagumo, RD_RPS, \
     PDE_Laplacian, PDE_O
-from ParticleGraph.utils import choose_boundary_values
+from ParticleGraph.utils import choose_boundary_values, mesh_laplacian
 from ParticleGraph.data_loaders import load_solar_system
 from time import sleep
 import numpy as np
@@ -302,6 +306,77 @@ def init_cells(config, device):
     return pos, dpos, type, features, cycle_duration, particle_id, cycle_length, cycle_length_distrib, cell_death_rate, cell_death_rate_distrib
 
 
+class CellPopulation:
+    """
+    Cell states of data_generate_cell in arrays preallocated to a capacity (struct of arrays).
+
+    The first n rows hold the cells of the simulation, views() returns them. Dead cells keep their row
+    (H1[:, 0] = 0), a division writes the daughters after the last row, so the rows of a cell never move and the
+    views are updated in place. The capacity is doubled when a division exceeds it.
+    """
+
+    fields = ['X1', 'V1', 'T1', 'H1', 'A1', 'cycle_length_distrib', 'cell_death_rate_distrib']
+
+    def __init__(self, X1, V1, T1, H1, A1, cycle_length_distrib, cell_death_rate_distrib, capacity):
+        self.n = len(X1)
+        self.device = X1.device
+        self.buffers = {}
+        for name, value in zip(self.fields, (X1, V1, T1, H1, A1, cycle_length_distrib, cell_death_rate_distrib)):
+            self.buffers[name] = torch.zeros((max(capacity, self.n),) + value.shape[1:], dtype=value.dtype, device=self.device)
+            self.buffers[name][:self.n] = value
+        self.N1 = torch.arange(len(self.buffers['X1']), device=self.device)[:, None]
+
+    @property
+    def capacity(self):
+        return len(self.N1)
+
+    def _reserve(self, n):
+        if n <= self.capacity:
+            return
+        capacity = max(n, 2 * self.capacity)
+        for name, value in self.buffers.items():
+            self.buffers[name] = torch.zeros((capacity,) + value.shape[1:], dtype=value.dtype, device=self.device)
+            self.buffers[name][:self.n] = value[:self.n]
+        self.N1 = torch.arange(capacity, device=self.device)[:, None]
+
+    def views(self):
+        """
+        Returns:
+            tuple: X1, V1, T1, H1, A1, N1, cycle_length_distrib, cell_death_rate_distrib of the n cells.
+        """
+        X1, V1, T1, H1, A1, cycle_length_distrib, cell_death_rate_distrib = [self.buffers[name][:self.n] for name in self.fields]
+        return X1, V1, T1, H1, A1, self.N1[:self.n], cycle_length_distrib, cell_death_rate_distrib
+
+    def divide(self, pos, cycle_length, cell_death_rate):
+        """
+        Divide the cells pos, the daughter of pos[k] is the cell n + k.
+        """
+        n_add_nodes = len(pos)
+        self._reserve(self.n + n_add_nodes)
+        new = slice(self.n, self.n + n_add_nodes)
+        X1 = self.buffers['X1']
+        V1 = self.buffers['V1']
+        T1 = self.buffers['T1']
+        H1 = self.buffers['H1']
+        A1 = self.buffers['A1']
+
+        H1[:self.n, 1] = 0
+        H1[pos, 1] = A1[pos, 0].clone().detach()    # cell division, copy cell age
+        H1[new, 0] = 1
+        H1[new, 1] = 0
+        separation = 1E-3 * torch.randn((n_add_nodes, X1.shape[1]), device=self.device)
+        X1[new] = X1[pos] + separation
+        X1[pos] = X1[pos] - separation
+        V1[new] = -V1[pos]      # the new cell is moving away from it's mother
+        T1[new] = T1[pos]       # the new cell inherits it's mother's type
+        A1[pos] = 0             # age set to zero
+        A1[new] = 0
+        nd = torch.ones(n_add_nodes, device=self.device) + 0.05 * torch.randn(n_add_nodes, device=self.device)
+        self.buffers['cycle_length_distrib'][new] = cycle_length[to_numpy(T1[pos, 0])].squeeze() * nd
+        self.buffers['cell_death_rate_distrib'][new] = cell_death_rate[to_numpy(T1[pos, 0])].squeeze() * nd
+        self.n += n_add_nodes
+
+
 def rotate_init_mesh(angle, config, device):
     simulation_config = config.simulation
     n_nodes = simulation_config.n_nodes
@@ -352,6 +427,41 @@ def get_index(n_particles, n_particle_types):
     return index_particles
 
 
+def skinny_face_filter(pos, max_ratio=5):
+    """
+    Delaunay triangulation of the nodes without the faces whose ratio between two edge lengths exceeds max_ratio.
+
+    Returns:
+        np.ndarray: faces of shape (n_faces, 3).
+    """
+    face = Delaunay(pos, qhull_options='QJ').simplices
+    x1 = pos[face[:, 0]]
+    x2 = pos[face[:, 1]]
+    x3 = pos[face[:, 2]]
+    a = np.sqrt(np.sum((x1 - x2) ** 2, axis=1))
+    b = np.sqrt(np.sum((x2 - x3) ** 2, axis=1))
+    c = np.sqrt(np.sum((x3 - x1) ** 2, axis=1))
+    A = np.maximum(a, b) / np.minimum(a, b)
+    B = np.maximum(a, c) / np.minimum(a, c)
+    C = np.maximum(c, b) / np.minimum(c, b)
+    face_longest_edge = np.maximum(np.maximum(A, B), C)
+    return face[face_longest_edge < max_ratio]
+
+
+def mesh_cache_file(config):
+    """
+    Cache file of the mesh built by init_mesh, keyed by the number of nodes, the jitter seed and the node maps.
+    """
+    simulation_config = config.simulation
+    maps = []
+    for name in (simulation_config.node_value_map, simulation_config.node_type_map):
+        file = f'graphs_data/{name}'
+        maps.append([name, os.path.getmtime(file) if os.path.exists(file) else 0])
+    # the leading number is the version of the cache content
+    key = json.dumps([2, simulation_config.n_nodes, simulation_config.mesh_seed, maps])
+    return f'graphs_data/mesh_cache/mesh_{hashlib.sha1(key.encode()).hexdigest()[:16]}.pt'
+
+
 def init_mesh(config, model_mesh, device):
     simulation_config = config.simulation
     n_nodes = simulation_config.n_nodes
@@ -370,16 +480,35 @@ def init_mesh(config, model_mesh, device):
     pos_mesh[0:n_nodes, 0:1] = x_mesh[0:n_nodes]
     pos_mesh[0:n_nodes, 1:2] = y_mesh[0:n_nodes]
 
-    i0 = imread(f'graphs_data/{node_value_map}')
-    if 'video' in simulation_config.node_value_map:
-        i0 = imread(f'graphs_data/pattern_Null.tif')
+    # PDE_O_Mesh moves the nodes with random phases before the triangulation, its mesh is not reproducible
+    cache_file = None
+    if (simulation_config.mesh_seed is not None) & (config.graph_model.mesh_model_name != 'PDE_O_Mesh'):
+        cache_file = mesh_cache_file(config)
+    cache = None
+    if (cache_file is not None) and os.path.exists(cache_file):
+        cache = torch.load(cache_file, map_location=device)
+
+    if cache is None:
+        if 'video' in simulation_config.node_value_map:
+            i0 = imread(f'graphs_data/pattern_Null.tif')
+        else:
+            i0 = imread(f'graphs_data/{node_value_map}')
+        values = i0[(to_numpy(pos_mesh[:, 1]) * 255).astype(int), (to_numpy(pos_mesh[:, 0]) * 255).astype(int)]
+        i0 = imread(f'graphs_data/{node_type_map}')
+        type_values = i0[(to_numpy(x_mesh[:, 0]) * 255).astype(int), (to_numpy(y_mesh[:, 0]) * 255).astype(int)]
+        if simulation_config.mesh_seed is None:
+            jitter = torch.randn(n_nodes, 2, device=device)
+        else:
+            generator = torch.Generator().manual_seed(simulation_config.mesh_seed)
+            jitter = torch.randn(n_nodes, 2, generator=generator).to(device)
     else:
-        i0 = imread(f'graphs_data/{node_value_map}')
-    values = i0[(to_numpy(pos_mesh[:, 1]) * 255).astype(int), (to_numpy(pos_mesh[:, 0]) * 255).astype(int)]
+        values = to_numpy(cache['values'])
+        type_values = to_numpy(cache['type_values'])
+        jitter = cache['jitter']
 
     mask_mesh = (x_mesh > torch.min(x_mesh) + 0.02) & (x_mesh < torch.max(x_mesh) - 0.02) & (y_mesh > torch.min(y_mesh) + 0.02) & (y_mesh < torch.max(y_mesh) - 0.02)
 
-    pos_mesh = pos_mesh + torch.randn(n_nodes, 2, device=device) * mesh_size / 8
+    pos_mesh = pos_mesh + jitter * mesh_size / 8
 
     match config.graph_model.mesh_model_name:
         case 'RD_Gray_Scott_Mesh':
@@ -411,11 +540,10 @@ def init_mesh(config, model_mesh, device):
     # type_mesh = torch.tensor(values, device=device)
     # type_mesh = type_mesh[:, None]
 
-    i0 = imread(f'graphs_data/{node_type_map}')
-    values = i0[(to_numpy(x_mesh[:, 0]) * 255).astype(int), (to_numpy(y_mesh[:, 0]) * 255).astype(int)]
-    if np.max(values) > 0:
-        values = np.round(values / np.max(values) * (simulation_config.n_node_types-1))
-    type_mesh = torch.tensor(values, device=device)
+    type_index = type_values
+    if np.max(type_index) > 0:
+        type_index = np.round(type_index / np.max(type_index) * (simulation_config.n_node_types-1))
+    type_mesh = torch.tensor(type_index, device=device)
     type_mesh = type_mesh[:, None]
 
     node_id_mesh = torch.arange(n_nodes, device=device)
@@ -425,37 +553,28 @@ def init_mesh(config, model_mesh, device):
     x_mesh = torch.concatenate((node_id_mesh.clone().detach(), pos_mesh.clone().detach(), dpos_mesh.clone().detach(),
                                 type_mesh.clone().detach(), features_mesh.clone().detach()), 1)
 
-    pos = to_numpy(x_mesh[:, 1:3])
-    tri = Delaunay(pos, qhull_options='QJ')
-    face = torch.from_numpy(tri.simplices)
-    face_longest_edge = np.zeros((face.shape[0], 1))
-
-    print('Removal of skinny faces ...')
-    sleep(0.5)
-    for k in trange(face.shape[0]):
-        # compute edge distances
-        x1 = pos[face[k, 0], :]
-        x2 = pos[face[k, 1], :]
-        x3 = pos[face[k, 2], :]
-        a = np.sqrt(np.sum((x1 - x2) ** 2))
-        b = np.sqrt(np.sum((x2 - x3) ** 2))
-        c = np.sqrt(np.sum((x3 - x1) ** 2))
-        A = np.max([a, b]) / np.min([a, b])
-        B = np.max([a, c]) / np.min([a, c])
-        C = np.max([c, b]) / np.min([c, b])
-        face_longest_edge[k] = np.max([A, B, C])
-
-    face_kept = np.argwhere(face_longest_edge < 5)
-    face_kept = face_kept[:, 0]
-    face = face[face_kept, :]
-    face = face.t().contiguous()
-    face = face.to(device, torch.long)
-
     pos_3d = torch.cat((x_mesh[:, 1:3], torch.ones((x_mesh.shape[0], 1), device=device)), dim=1)
-    edge_index_mesh, edge_weight_mesh = get_mesh_laplacian(pos=pos_3d, face=face, normalization="None")
-    edge_weight_mesh = edge_weight_mesh.to(dtype=torch.float32)
+    if cache is None:
+        face = skinny_face_filter(to_numpy(x_mesh[:, 1:3]))
+        face = torch.from_numpy(face).t().contiguous()
+        face = face.to(device, torch.long)
+        edge_index_mesh, edge_weight_mesh = get_mesh_laplacian(pos=pos_3d, face=face, normalization="None")
+        edge_weight_mesh = edge_weight_mesh.to(dtype=torch.float32)
+        if cache_file is not None:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            # tensors only, so that the cache loads with torch.load(weights_only=True)
+            torch.save({'values': torch.from_numpy(np.ascontiguousarray(values)),
+                        'type_values': torch.from_numpy(np.ascontiguousarray(type_values)), 'jitter': jitter, 'face': face,
+                        'edge_index': edge_index_mesh, 'edge_weight': edge_weight_mesh}, cache_file)
+    else:
+        face = cache['face']
+        edge_index_mesh = cache['edge_index']
+        edge_weight_mesh = cache['edge_weight']
+
     mesh_data = {'mesh_pos': pos_3d, 'face': face, 'edge_index': edge_index_mesh, 'edge_weight': edge_weight_mesh,
                  'mask': mask_mesh, 'size': mesh_size}
+    if simulation_config.sparse_laplacian:
+        mesh_data['laplacian'] = mesh_laplacian(edge_index_mesh, edge_weight_mesh, n_nodes)
 
     if (config.graph_model.particle_model_name == 'PDE_ParticleField_A')  | (config.graph_model.particle_model_name == 'PDE_ParticleField_B'):
 
@@ -5,6 +5,9 @@ import sympy
 from .utils import *
 
 
+def _identity(x):
+    return x
+
 
 class Symbolic_KANLayer(nn.Module):
     '''
@@ -62,7 +65,7 @@ class Symbolic_KANLayer(nn.Module):
         self.in_dim = in_dim
         self.mask = torch.nn.Parameter(torch.zeros(out_dim, in_dim)).requires_grad_(False)
         # torch
-        self.funs = [[lambda x: x for i in range(self.in_dim)] for j in range(self.out_dim)]
+        self.funs = [[_identity for i in range(self.in_dim)] for j in range(self.out_dim)]
         # name
         self.funs_name = [['' for i in range(self.in_dim)] for j in range(self.out_dim)]
         # sympy
@@ -70,6 +73,22 @@ class Symbolic_KANLayer(nn.Module):
         
         self.affine = torch.nn.Parameter(torch.zeros(out_dim, in_dim, 4))
         # c*f(a*x+b)+d
+
+        # edge indices of each function, rebuilt when self.funs changes
+        self._groups = None
+
+    def _function_groups(self):
+        device = self.affine.device
+        if (self._groups is None) or (self._groups[2] != device):
+            # edges sharing a function are evaluated together on a (batch, n_edges) tensor
+            groups = {}
+            for j in range(self.out_dim):
+                for i in range(self.in_dim):
+                    groups.setdefault(self.funs[j][i], []).append((j, i))
+            groups = [(fun, *torch.tensor(edges, device=device).T) for fun, edges in groups.items()]
+            order = torch.argsort(torch.cat([j * self.in_dim + i for _, j, i in groups]))
+            self._groups = (groups, order, device)
+        return self._groups[0], self._groups[1]
     
     def forward(self, x):
         '''
@@ -97,17 +116,15 @@ class Symbolic_KANLayer(nn.Module):
         '''
         
         batch = x.shape[0]
-        postacts = []
 
-        for i in range(self.in_dim):
-            postacts_ = []
-            for j in range(self.out_dim):
-                xij = self.affine[j,i,2]*self.funs[j][i](self.affine[j,i,0]*x[:,[i]]+self.affine[j,i,1])+self.affine[j,i,3]
-                postacts_.append(self.mask[j][i]*xij)
-            postacts.append(torch.stack(postacts_))
+        groups, order = self._function_groups()
+        postacts = []
+        for fun, j, i in groups:
+            affine = self.affine[j, i]
+            xij = affine[:, 2] * fun(affine[:, 0] * x[:, i] + affine[:, 1]) + affine[:, 3]
+            postacts.append(self.mask[j, i] * xij)
 
-        postacts = torch.stack(postacts)
-        postacts = postacts.permute(2,1,0,3)[:,:,:,0]
+        postacts = torch.cat(postacts, dim=1)[:, order].reshape(batch, self.out_dim, self.in_dim)
         y = torch.sum(postacts, dim=2)
         
         return y, postacts
@@ -140,6 +157,7 @@ class Symbolic_KANLayer(nn.Module):
         sbb.out_dim = len(out_id)
         sbb.mask.data = self.mask.data[out_id][:,in_id]
         sbb.funs = [[self.funs[j][i] for i in in_id] for j in out_id]
+        sbb._groups = None
         sbb.funs_sympy = [[self.funs_sympy[j][i] for i in in_id] for j in out_id]
         sbb.funs_name = [[self.funs_name[j][i] for i in in_id] for j in out_id]
         sbb.affine.data = self.affine.data[out_id][:,in_id]
@@ -200,6 +218,7 @@ class Symbolic_KANLayer(nn.Module):
         [['', '', ''], ['', '', 'sin']]
         tensor([2.9981, 1.9997, 5.0039, 0.6978])
         '''
+        self._groups = None
         if isinstance(fun_name,str):
             fun = SYMBOLIC_LIB[fun_name][0]
             fun_sympy = SYMBOLIC_LIB[fun_name][1]
@@ -0,0 +1,46 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class Batch_Prefetcher:
+    """
+    Iterates over the batches of one epoch, preparing the next n_prefetch batches in worker threads.
+
+    sample_batch(rng) draws and builds one batch with the numpy Generator rng. Batch N of an epoch always gets
+    the generator seeded with (seed, epoch, N), so the batches depend neither on the number of workers nor
+    on the order in which they finish. With n_prefetch=0 the batches are built inline, which is required
+    when sample_batch reads parameters updated by the optimizer (ghost particles).
+    """
+
+    def __init__(self, sample_batch, n_batches, seed=0, epoch=0, n_prefetch=0):
+        self.sample_batch = sample_batch
+        self.n_batches = n_batches
+        self.seed = seed
+        self.epoch = epoch
+        self.n_prefetch = n_prefetch
+
+    def rng(self, N):
+        return np.random.default_rng([self.seed, self.epoch, N])
+
+    def __len__(self):
+        return self.n_batches
+
+    def __iter__(self):
+        if self.n_prefetch == 0:
+            for N in range(self.n_batches):
+                yield self.sample_batch(self.rng(N))
+            return
+
+        with ThreadPoolExecutor(max_workers=self.n_prefetch) as executor:
+            futures = deque()
+            for N in range(min(self.n_prefetch, self.n_batches)):
+                futures.append(executor.submit(self.sample_batch, self.rng(N)))
+            next_N = len(futures)
+            while futures:
+                batch = futures.popleft().result()
+                if next_N < self.n_batches:
+                    futures.append(executor.submit(self.sample_batch, self.rng(next_N)))
+                    next_N += 1
+                yield batch
@@ -0,0 +1,87 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+
+def _to_cpu(state):
+    # copy so that training can update the parameters while the snapshot is written
+    if torch.is_tensor(state):
+        return state.detach().to('cpu', copy=True)
+    if isinstance(state, dict):
+        return {key: _to_cpu(value) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(_to_cpu(value) for value in state)
+    return state
+
+
+class Checkpoint_Manager:
+    """
+    Writes training checkpoints in a background thread and deletes the ones not kept by the retention policy.
+
+    save() copies the state dicts to CPU memory and returns, the files are written in order by a single thread,
+    to a temporary file renamed once complete, so that an interrupted write never leaves a truncated checkpoint.
+    Checkpoints are grouped ('epoch', 'snapshot', ...) and the policy is applied within each group:
+    a checkpoint is kept if it is among the keep_last most recent, if its step is a multiple of keep_every, or if its
+    loss is among the keep_best lowest, a rule set to 0 keeps nothing. With all three set to 0 every checkpoint is kept.
+    """
+
+    def __init__(self, keep_last=0, keep_every=0, keep_best=0, max_pending=2):
+        self.keep_last = keep_last
+        self.keep_every = keep_every
+        self.keep_best = keep_best
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = []
+        self.records = {}
+
+    def save(self, files, step, loss=None, group='epoch'):
+        """
+        Args:
+            files (dict): path: state, all the files of one checkpoint (model, ghosts, field ...).
+            step (int): position of the checkpoint in its group, the epoch for epoch checkpoints.
+            loss (float): used by keep_best, checkpoints without loss are not ranked.
+            group (str): retention group.
+        """
+        snapshot = {path: _to_cpu(state) for path, state in files.items()}
+        # bounds the memory held by snapshots waiting to be written
+        while len(self.pending) >= self.max_pending:
+            self.pending.pop(0).result()
+        self.pending.append(self.executor.submit(self._write, snapshot, step, loss, group))
+
+    def _write(self, snapshot, step, loss, group):
+        for path, state in snapshot.items():
+            tmp = f'{path}.tmp'
+            torch.save(state, tmp)
+            os.replace(tmp, path)
+        records = self.records.setdefault(group, [])
+        records.append({'step': step, 'loss': loss, 'files': list(snapshot)})
+        self._apply_retention(records)
+
+    def _apply_retention(self, records):
+        if (self.keep_last == 0) & (self.keep_every == 0) & (self.keep_best == 0):
+            return
+        kept = set()
+        if self.keep_last > 0:
+            kept.update(range(max(len(records) - self.keep_last, 0), len(records)))
+        if self.keep_every > 0:
+            kept.update(k for k, record in enumerate(records) if record['step'] % self.keep_every == 0)
+        if self.keep_best > 0:
+            ranked = sorted((record['loss'], k) for k, record in enumerate(records) if record['loss'] is not None)
+            kept.update(k for _, k in ranked[:self.keep_best])
+        for k, record in enumerate(records):
+            if k in kept:
+                continue
+            for path in record['files']:
+                if os.path.exists(path):
+                    os.remove(path)
+        records[:] = [record for k, record in enumerate(records) if k in kept]
+
+    def wait(self):
+        # raises the errors of the background writes
+        while self.pending:
+            self.pending.pop(0).result()
+
+    def close(self):
+        self.wait()
+        self.executor.shutdown()
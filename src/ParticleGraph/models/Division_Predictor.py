@@ -25,7 +25,7 @@ class Division_Predictor(nn.Module):
 
         self.data_id = data_id
         particle_id = x[:, 0:1]
-        time_embedding = self.t[self.data_id, to_numpy(particle_id), :].squeeze()
+        time_embedding = self.t[self.data_id, particle_id.long(), :].squeeze()
 
         x = torch.concatenate((x[:,1:2], time_embedding), dim=1)
         x = self.mlp(x)
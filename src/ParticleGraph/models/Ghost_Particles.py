@@ -1,6 +1,7 @@
 import numpy as np
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 class Ghost_Particles(torch.nn.Module):
 
@@ -13,7 +14,16 @@ class Ghost_Particles(torch.nn.Module):
         # self.model_siren = model_siren
         self.device = device
 
-        self.ghost_pos = nn.Parameter(torch.rand((self.n_dataset, self.n_frames, self.n_ghosts, 2), device=device, requires_grad=True))
+        self.sparse = model_config.training.ghost_update == 'sparse'
+        self.keyframe_step = model_config.training.ghost_keyframe_step
+        self.keyframes = self.sparse | (self.keyframe_step > 1)
+        if self.keyframes:
+            # one row per (dataset, keyframe), positions are interpolated between keyframes and a frame only
+            # touches its two rows, with sparse gradients for Lazy_Adam if ghost_update == 'sparse'
+            self.n_keys = -(-(self.n_frames - 1) // self.keyframe_step) + 1
+            self.ghost_pos = nn.Parameter(torch.rand((self.n_dataset * self.n_keys, self.n_ghosts * 2), device=device, requires_grad=True))
+        else:
+            self.ghost_pos = nn.Parameter(torch.rand((self.n_dataset, self.n_frames, self.n_ghosts, 2), device=device, requires_grad=True))
         if model_config.graph_model.particle_model_name == 'PDE_B':
             # self.ghost_dpos = nn.Parameter(torch.zeros((self.n_dataset, self.n_frames, self.n_ghosts, 2), device=device, requires_grad=True))
             self.boids = True
@@ -30,9 +40,26 @@ class Ghost_Particles(torch.nn.Module):
         embedding_index = np.random.permutation(embedding_index)
         self.embedding_index = embedding_index[:self.n_ghosts]
 
+    def interpolate(self, dataset_id, frame):
+
+        key, remainder = divmod(int(frame), self.keyframe_step)
+        row = int(dataset_id) * self.n_keys + key
+        if remainder == 0:
+            pos = F.embedding(torch.tensor([row], device=self.device), self.ghost_pos, sparse=self.sparse)[0]
+        else:
+            w = remainder / self.keyframe_step
+            pos = F.embedding(torch.tensor([row, row + 1], device=self.device), self.ghost_pos, sparse=self.sparse)
+            pos = (1 - w) * pos[0] + w * pos[1]
+
+        return pos.view(self.n_ghosts, 2)
+
     def get_pos (self, dataset_id, frame, bc_pos):
 
-        out = torch.concatenate((self.N1[:,None], bc_pos(self.ghost_pos[dataset_id, frame:frame+1,:,:].squeeze()),self.V1,self.T1[:,None],self.H1,self.A1[:,None]), 1)
+        if self.keyframes:
+            pos = self.interpolate(dataset_id, frame)
+        else:
+            pos = self.ghost_pos[dataset_id, frame:frame+1,:,:].squeeze()
+        out = torch.concatenate((self.N1[:,None], bc_pos(pos),self.V1,self.T1[:,None],self.H1,self.A1[:,None]), 1)
 
         return out
 
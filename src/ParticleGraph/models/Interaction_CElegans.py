@@ -58,22 +58,23 @@ class Interaction_CElegans(pyg.nn.MessagePassing):
         x, edge_index = data.x, data.edge_index
         edge_index, _ = pyg_utils.remove_self_loops(edge_index)
 
-        pred = self.propagate(edge_index, x=(x, x), time=time)
+        # embeddings are looked up once per node on the device and gathered per edge by propagate
+        embedding = self.a[self.data_id, x[:, 0].long(), :]
+
+        pred = self.propagate(edge_index, x=(x, x), embedding=embedding, time=time)
 
         if self.update_type == 'linear':
-            embedding = self.a[self.data_id, to_numpy(x[:, 0]), :]
             pred = self.lin_update(torch.cat((pred, x[:, 3:5], embedding), dim=-1))
 
         return pred
 
-    def message(self, x_i, x_j, time):
+    def message(self, x_i, x_j, embedding_i, time):
 
         r = torch.sqrt(torch.sum(self.bc_dpos(x_i[:, 1:4] - x_j[:, 1:4]) ** 2, axis=1))  # squared distance
         r = r[:, None]
 
         delta_pos = self.bc_dpos(x_i[:, 1:4] - x_j[:, 1:4])
-        embedding = self.a[self.data_id, to_numpy(x_i[:, 0]).astype(int), :]
-        in_features = torch.cat((delta_pos, r, x_i[:, 4:7], x_j[:, 4:7], embedding, time[:, None]), dim=-1)
+        in_features = torch.cat((delta_pos, r, x_i[:, 4:7], x_j[:, 4:7], embedding_i, time[:, None]), dim=-1)
 
         out = self.lin_edge(in_features)
 
@@ -122,7 +122,7 @@ class Interaction_Particle_Field(pyg.nn.MessagePassing):
         pred = self.propagate(edge_index, pos=pos, d_pos=d_pos, particle_id=particle_id, field=field)
 
         if self.update_type == 'linear':
-            embedding = self.a[self.data_id, particle_id, :]
+            embedding = self.a[self.data_id, particle_id[:, 0].long(), :]
             pred = self.lin_update(torch.cat((pred, x[:, 3:5], embedding), dim=-1))
 
         return pred
@@ -154,8 +154,8 @@ class Interaction_Particle_Field(pyg.nn.MessagePassing):
             dpos_y_j = new_dpos_y_j
 
 
-        embedding_i = self.a[self.data_id, to_numpy(particle_id_i), :].squeeze()
-        # embedding_j = self.a[self.data_id, to_numpy(particle_id_j), :].squeeze()
+        # gathered per edge on the device, the field nodes have no embedding so there is no per node table
+        embedding_i = self.a[self.data_id, particle_id_i[:, 0].long(), :]
 
         match self.model:
 
@@ -133,8 +133,8 @@ class Interaction_Particle_Tracking(pyg.nn.MessagePassing):
             dpos_x_j = new_dpos_x_j
             dpos_y_j = new_dpos_y_j
 
-        embedding_i = self.a[to_numpy(particle_id_i), :].squeeze()
-        embedding_j = self.a[to_numpy(particle_id_j), :].squeeze()
+        embedding_i = self.a[particle_id_i.long(), :].squeeze()
+        embedding_j = self.a[particle_id_j.long(), :].squeeze()
 
         match self.model:
             case 'PDE_A'|'PDE_ParticleField_A':
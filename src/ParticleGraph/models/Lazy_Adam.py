@@ -0,0 +1,74 @@
+import torch
+
+
+class Lazy_Adam(torch.optim.Optimizer):
+    """
+    Adam for parameters with sparse row gradients (e.g. F.embedding(..., sparse=True)).
+
+    Only the rows present in the gradient are updated, each with its own step count for the bias correction.
+    Unlike torch.optim.SparseAdam, the moments are allocated on the first update of a row, so that the memory of the
+    optimizer and the cost of a step scale with the rows actually touched and not with the size of the parameter.
+    """
+
+    def __init__(self, params, lr=1E-3, betas=(0.9, 0.999), eps=1E-8):
+        super().__init__(params, dict(lr=lr, betas=betas, eps=eps))
+
+    def _reserve(self, state, p, n):
+        # moments of the touched rows, the capacity doubles when full
+        capacity = len(state['step'])
+        if n <= capacity:
+            return
+        capacity = max(n, 2 * capacity)
+        for key in ['exp_avg', 'exp_avg_sq']:
+            buffer = torch.zeros((capacity, *p.shape[1:]), dtype=p.dtype, device=p.device)
+            buffer[:state['n']] = state[key][:state['n']]
+            state[key] = buffer
+        step = torch.zeros(capacity, dtype=p.dtype, device=p.device)
+        step[:state['n']] = state['step'][:state['n']]
+        state['step'] = step
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        for group in self.param_groups:
+            beta1, beta2 = group['betas']
+            for p in group['params']:
+                if p.grad is None:
+                    continue
+                if not p.grad.is_sparse:
+                    raise ValueError('Lazy_Adam requires sparse gradients')
+                grad = p.grad.coalesce()
+                rows = grad.indices()[0]
+                values = grad.values()
+
+                state = self.state[p]
+                if len(state) == 0:
+                    state['slot'] = torch.full((p.shape[0],), -1, dtype=torch.long, device=p.device)
+                    state['n'] = 0
+                    state['exp_avg'] = torch.zeros((0, *p.shape[1:]), dtype=p.dtype, device=p.device)
+                    state['exp_avg_sq'] = torch.zeros((0, *p.shape[1:]), dtype=p.dtype, device=p.device)
+                    state['step'] = torch.zeros(0, dtype=p.dtype, device=p.device)
+
+                new_rows = rows[state['slot'][rows] < 0]
+                if len(new_rows) > 0:
+                    self._reserve(state, p, state['n'] + len(new_rows))
+                    state['slot'][new_rows] = torch.arange(state['n'], state['n'] + len(new_rows), device=p.device)
+                    state['n'] += len(new_rows)
+                slots = state['slot'][rows]
+
+                step = state['step'][slots] + 1
+                exp_avg = state['exp_avg'][slots] * beta1 + values * (1 - beta1)
+                exp_avg_sq = state['exp_avg_sq'][slots] * beta2 + values * values * (1 - beta2)
+                state['step'][slots] = step
+                state['exp_avg'][slots] = exp_avg
+                state['exp_avg_sq'][slots] = exp_avg_sq
+
+                step = step.view(-1, *([1] * (p.dim() - 1)))
+                denom = (exp_avg_sq / (1 - beta2 ** step)).sqrt() + group['eps']
+                p[rows] -= group['lr'] * exp_avg / (1 - beta1 ** step) / denom
+
+        return loss
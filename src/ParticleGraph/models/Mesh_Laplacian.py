@@ -15,7 +15,7 @@ class Mesh_Laplacian(pyg.nn.MessagePassing):
     """
     Model learning the second derivative of a scalar field on a mesh.
     The node embedding is defined by a table self.a
-    Note the Laplacian coeeficients are in data.edge_attr
+    Note the Laplacian coeeficients are in data.edge_attr, or in the sparse matrix data.laplacian
 
     Inputs
     ----------
@@ -58,9 +58,13 @@ class Mesh_Laplacian(pyg.nn.MessagePassing):
 
         u = x[:, 6:7]
 
-        laplacian = self.propagate(edge_index, u=u, discrete_laplacian=edge_attr)
+        # data.laplacian @ u is the sum over the incoming edges, the same as propagate only with aggr='add'
+        if ('laplacian' in data) & (self.aggr == 'add'):
+            laplacian = data.laplacian @ u
+        else:
+            laplacian = self.propagate(edge_index, u=u, discrete_laplacian=edge_attr)
 
-        particle_id = to_numpy(x[:, 0])
+        particle_id = x[:, 0].long()
         embedding = self.a[self.data_id, particle_id, :]
         pred = self.lin_phi(torch.cat((laplacian, embedding), dim=-1))
 
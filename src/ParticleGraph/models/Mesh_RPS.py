@@ -13,7 +13,7 @@ class Mesh_RPS(pyg.nn.MessagePassing):
     """
     Model learning the first derivative of a scalar field on a mesh.
     The node embedding is defined by a table self.a
-    Note the Laplacian coeeficients are in data.edge_attr
+    Note the Laplacian coeeficients are in data.edge_attr, or in the sparse matrix data.laplacian
 
     Inputs
     ----------
@@ -54,9 +54,13 @@ class Mesh_RPS(pyg.nn.MessagePassing):
 
         uvw = data.x[:, 6:9]
 
-        laplacian_uvw = self.propagate(edge_index, uvw=uvw, discrete_laplacian=edge_attr)
+        # data.laplacian @ u is the sum over the incoming edges, the same as propagate only with aggr='add'
+        if ('laplacian' in data) & (self.aggr == 'add'):
+            laplacian_uvw = data.laplacian @ uvw
+        else:
+            laplacian_uvw = self.propagate(edge_index, uvw=uvw, discrete_laplacian=edge_attr)
 
-        particle_id = to_numpy(x[:, 0])
+        particle_id = x[:, 0].long()
         embedding = self.a[self.data_id, particle_id, :]
 
         input_phi = torch.cat((laplacian_uvw, uvw, embedding), dim=-1)
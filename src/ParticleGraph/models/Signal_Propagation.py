@@ -1,4 +1,5 @@
 import numpy as np
+import scipy.io
 import torch
 import torch.nn as nn
 import torch_geometric as pyg
@@ -52,7 +53,20 @@ class Signal_Propagation(pyg.nn.MessagePassing):
 
         self.a = nn.Parameter(torch.zeros((self.n_dataset,int(self.n_particles), self.embedding_dim), device=self.device, requires_grad=True, dtype=torch.float32))
 
-        self.vals = nn.Parameter(torch.zeros((int(self.n_particles*(self.n_particles+1)/2)), device=self.device, requires_grad=True, dtype=torch.float32))
+        self.connectivity = model_config.signal_connectivity
+        match self.connectivity:
+            case 'dense':
+                self.vals = nn.Parameter(torch.zeros((int(self.n_particles*(self.n_particles+1)/2)), device=self.device, requires_grad=True, dtype=torch.float32))
+            case 'sparse':
+                # one weight per undirected edge of the connectivity file, (i, j) and (j, i) share it
+                mat = scipy.io.loadmat(simulation_config.connectivity_file)
+                adjacency = torch.tensor(mat['A'], device=self.device)
+                edge_index = (adjacency > 0).nonzero().t()
+                pair_keys = torch.unique(self.pair_key(edge_index[0], edge_index[1]))
+                self.register_buffer('pair_keys', pair_keys, persistent=False)
+                self.vals = nn.Parameter(torch.zeros(len(pair_keys), device=self.device, requires_grad=True, dtype=torch.float32))
+            case _:
+                raise ValueError(f'Unknown signal connectivity {self.connectivity}')
 
     def forward(self, data=[], data_id=[], return_all=False, training_mode='all'):
         self.data_id = data_id
@@ -62,7 +76,7 @@ class Signal_Propagation(pyg.nn.MessagePassing):
 
         msg = self.propagate(edge_index, u=u)
 
-        particle_id = to_numpy(x[:, 0])
+        particle_id = x[:, 0].long()
         embedding = self.a[1, particle_id, :]   # common embedding for all dataset
 
         input_phi = torch.cat((u, embedding), dim=-1)
@@ -82,6 +96,13 @@ class Signal_Propagation(pyg.nn.MessagePassing):
 
     def message(self, edge_index_i, edge_index_j, u_j):
 
+        if self.connectivity == 'sparse':
+            weight_ij = self.edge_weights(torch.stack((edge_index_i, edge_index_j)))[:, None]
+            self.weight_ij_ = weight_ij
+            self.activation = self.lin_edge(u_j)
+            self.u_j = u_j
+            return weight_ij * self.activation
+
         A = torch.zeros(self.n_particles, self.n_particles, device=self.device, requires_grad=False, dtype=torch.float32)
         i, j = torch.triu_indices(self.n_particles, self.n_particles, requires_grad=False, device=self.device)
 
@@ -90,7 +111,7 @@ class Signal_Propagation(pyg.nn.MessagePassing):
 
         self.A = A
 
-        weight_ij = A[to_numpy(edge_index_i),to_numpy(edge_index_j),None]
+        weight_ij = A[edge_index_i, edge_index_j, None]
         self.weight_ij_ = weight_ij
         self.weight_ij = A.clone().detach()
 
@@ -102,5 +123,23 @@ class Signal_Propagation(pyg.nn.MessagePassing):
     def update(self, aggr_out):
         return aggr_out
 
+    def pair_key(self, i, j):
+        return torch.minimum(i, j) * self.n_particles + torch.maximum(i, j)
+
+    def edge_weights(self, edge_index):
+        """
+        Symmetric weights of the edges (edge_index[0], edge_index[1]), same values as self.weight_ij[i, j] in dense mode.
+        """
+        if self.connectivity == 'dense':
+            i, j = torch.triu_indices(self.n_particles, self.n_particles, device=self.device)
+            pair = torch.zeros(self.n_particles, self.n_particles, dtype=torch.long, device=self.device)
+            pair[i, j] = torch.arange(len(i), device=self.device)
+            pair.T[i, j] = torch.arange(len(i), device=self.device)
+            return self.vals[pair[edge_index[0], edge_index[1]]]
+        key = self.pair_key(edge_index[0], edge_index[1])
+        index = torch.clamp(torch.searchsorted(self.pair_keys, key), max=len(self.pair_keys) - 1)
+        # pairs absent from the connectivity file have no weight
+        return self.vals[index] * (self.pair_keys[index] == key)
+
     def psi(self, r, p):
         return p * r
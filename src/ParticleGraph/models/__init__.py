@@ -10,8 +10,11 @@ from .Mesh_Laplacian import Mesh_Laplacian
 from .Division_Predictor import Division_Predictor
 from .Division_Predictor import Division_Predictor
 from .Ghost_Particles import Ghost_Particles
+from .Batch_Prefetcher import Batch_Prefetcher
+from .Checkpoint_Manager import Checkpoint_Manager
+from .Lazy_Adam import Lazy_Adam
 from .graph_trainer import *
 from .utils import get_embedding, choose_training_model, constant_batch_size, increasing_batch_size, set_trainable_parameters, set_trainable_division_parameters, plot_training
 
-__all__ = [graph_trainer, Interaction_CElegans, Interaction_Particle_Tracking, Interaction_Particles, Interaction_Particle_Field, Siren_Network, Signal_Propagation, Mesh_RPS, Mesh_RPS_bis, Mesh_Laplacian, Division_Predictor, Ghost_Particles, get_embedding, choose_training_model, constant_batch_size,
+__all__ = [graph_trainer, Interaction_CElegans, Interaction_Particle_Tracking, Interaction_Particles, Interaction_Particle_Field, Siren_Network, Signal_Propagation, Mesh_RPS, Mesh_RPS_bis, Mesh_Laplacian, Division_Predictor, Ghost_Particles, Batch_Prefetcher, Checkpoint_Manager, Lazy_Adam, get_embedding, choose_training_model, constant_batch_size,
            increasing_batch_size, set_trainable_parameters, set_trainable_division_parameters, plot_training]
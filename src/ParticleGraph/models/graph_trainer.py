@@ -3,6 +3,15 @@ import torch
 from GNN_particles_Ntype import *
 from ParticleGraph.models.utils import *
 from ParticleGraph.models.Siren_Network import *
+from ParticleGraph.neighbors import radius_graph, VerletList, nearest_neighbor
+from ParticleGraph.trajectory import load_trajectory
+from ParticleGraph.normalization import load_norms
+from ParticleGraph.utils import mesh_laplacian
+from ParticleGraph.renderer import AsyncRenderer, plot_test_frame
+from ParticleGraph.models.Batch_Prefetcher import Batch_Prefetcher
+from ParticleGraph.models.Checkpoint_Manager import Checkpoint_Manager
+from ParticleGraph.models.Lazy_Adam import Lazy_Adam
+from ParticleGraph.profiling import StageTimer
 import random
 
 def data_train(config, config_file, device):
@@ -79,22 +88,35 @@ def data_train_particles(config, config_file, device):
 
     x_list = []
     y_list = []
+    edge_p_p_list = []
     for run in trange(n_runs):
-        x = torch.load(f'graphs_data/graphs_{dataset_name}/x_list_{run}.pt', map_location=device)
-        y = torch.load(f'graphs_data/graphs_{dataset_name}/y_list_{run}.pt', map_location=device)
+        x = load_trajectory(f'graphs_data/graphs_{dataset_name}/x_list_{run}', device)
+        y = load_trajectory(f'graphs_data/graphs_{dataset_name}/y_list_{run}', device)
         x_list.append(x)
         y_list.append(y)
-    x = x_list[0][0].clone().detach()
-    y = y_list[0][0].clone().detach()
-    for run in range(n_runs):
-        for k in trange(n_frames):
-            if (k % 10 == 0) | (n_frames < 1000):
-                x = torch.cat((x, x_list[run][k].clone().detach()), 0)
-                y = torch.cat((y, y_list[run][k].clone().detach()), 0)
-        print(x_list[run][k].shape)
-        time.sleep(0.5)
-    vnorm = norm_velocity(x, dimension, device)
-    ynorm = norm_acceleration(y, device)
+        edge_file = f'graphs_data/graphs_{dataset_name}/edge_p_p_list_{run}.npz'
+        if os.path.exists(edge_file):
+            edge_p_p_list.append(np.load(edge_file))
+    # stored graphs are only valid when the node set is the generated one, ghosts add nodes
+    has_stored_edges = (len(edge_p_p_list) == n_runs) & (not has_ghost)
+    print(f'stored edges: {has_stored_edges}')
+    logger.info(f'stored edges: {has_stored_edges}')
+    # statistics accumulated at generation time, older datasets are sampled every 10th frame
+    norms = load_norms(f'graphs_data/graphs_{dataset_name}', range(n_runs), device)
+    if norms is None:
+        x = x_list[0][0].clone().detach()
+        y = y_list[0][0].clone().detach()
+        for run in range(n_runs):
+            for k in trange(n_frames):
+                if (k % 10 == 0) | (n_frames < 1000):
+                    x = torch.cat((x, x_list[run][k].clone().detach()), 0)
+                    y = torch.cat((y, y_list[run][k].clone().detach()), 0)
+            print(x_list[run][k].shape)
+            time.sleep(0.5)
+        vnorm = norm_velocity(x, dimension, device)
+        ynorm = norm_acceleration(y, device)
+    else:
+        vnorm, ynorm = norms
     torch.save(vnorm, os.path.join(log_dir, 'vnorm.pt'))
     torch.save(ynorm, os.path.join(log_dir, 'ynorm.pt'))
     time.sleep(0.5)
@@ -138,7 +160,11 @@ def data_train_particles(config, config_file, device):
     if has_ghost:
 
         ghosts_particles = Ghost_Particles(config, n_particles, vnorm, device)
-        optimizer_ghost_particles = torch.optim.Adam([ghosts_particles.ghost_pos], lr=1E-4)
+        match train_config.ghost_update:
+            case 'dense':
+                optimizer_ghost_particles = torch.optim.Adam([ghosts_particles.ghost_pos], lr=1E-4)
+            case 'sparse':
+                optimizer_ghost_particles = Lazy_Adam([ghosts_particles.ghost_pos], lr=1E-4)
         mask_ghost = np.concatenate((np.ones(n_particles), np.zeros(config.training.n_ghosts)))
         mask_ghost = np.tile(mask_ghost, batch_size)
         mask_ghost = np.argwhere(mask_ghost == 1)
@@ -150,6 +176,10 @@ def data_train_particles(config, config_file, device):
 
     list_loss = []
     time.sleep(1)
+    checkpoints = Checkpoint_Manager(train_config.checkpoint_keep_last, train_config.checkpoint_keep_every,
+                                     train_config.checkpoint_keep_best)
+    timer = StageTimer(log_dir, 'training', train_config.profile, train_config.profiler_iterations,
+                       train_config.profiler_start, device, logger)
     for epoch in range(n_epochs + 1):
 
         batch_size = get_batch_size(epoch)
@@ -162,19 +192,21 @@ def data_train_particles(config, config_file, device):
 
         total_loss = 0
         Niter = n_frames * data_augmentation_loop // batch_size
+        if train_config.max_iterations > 0:
+            Niter = min(Niter, train_config.max_iterations)
 
-        for N in range(Niter):
+        def sample_batch(rng):
 
-            phi = torch.randn(1, dtype=torch.float32, requires_grad=False, device=device) * np.pi * 2
+            phi = torch.tensor(rng.standard_normal(1) * np.pi * 2, dtype=torch.float32, device=device)
             cos_phi = torch.cos(phi)
             sin_phi = torch.sin(phi)
 
-            run = 1 + np.random.randint(n_runs - 1)
+            run = 1 + rng.integers(n_runs - 1)
 
             dataset_batch = []
             for batch in range(batch_size):
 
-                k = np.random.randint(n_frames - 1)
+                k = rng.integers(n_frames - 1)
 
                 x = x_list[run][k].clone().detach()
 
@@ -190,16 +222,18 @@ def data_train_particles(config, config_file, device):
                     with torch.no_grad():
                         model.a[run,n_particles:n_particles+n_ghosts] = model.a[run,ghosts_particles.embedding_index].clone().detach()   # sample ghost embedding
 
-                distance = torch.sum(bc_dpos(x[:, None, 1:dimension + 1] - x[None, :, 1:dimension + 1]) ** 2, dim=2)
-                adj_t = ((distance < max_radius ** 2) & (distance > min_radius ** 2)).float() * 1
-                t = torch.Tensor([max_radius ** 2])
-                edges = adj_t.nonzero().t().contiguous()
+                timer.lap('sample')
+                if has_stored_edges:
+                    edges = torch.tensor(edge_p_p_list[run][f'arr_{k}'], dtype=torch.int64, device=device)
+                else:
+                    edges = radius_graph(x[:, 1:dimension + 1], min_radius, max_radius, simulation_config.boundary, simulation_config.neighbor_method)
+                timer.lap('graph')
                 dataset = data.Data(x=x[:, :], edge_index=edges)
                 dataset_batch.append(dataset)
 
                 y = y_list[run][k].clone().detach()
                 if noise_level > 0:
-                    y = y * (1 + torch.randn_like(y) * noise_level)
+                    y = y * (1 + torch.tensor(rng.standard_normal(y.shape), dtype=y.dtype, device=device) * noise_level)
 
                 y = y / ynorm
 
@@ -213,13 +247,23 @@ def data_train_particles(config, config_file, device):
                 else:
                     y_batch = torch.cat((y_batch, y[:, 0:2]), dim=0)
 
+            timer.lap('sample')
             batch_loader = DataLoader(dataset_batch, batch_size=batch_size, shuffle=False)
+            batch = next(iter(batch_loader))
+            timer.lap('collate')
+            return run, phi, batch, y_batch, x
+
+        # ghost positions are trained, their batches are built inline
+        prefetcher = Batch_Prefetcher(sample_batch, Niter, seed=train_config.seed, epoch=epoch,
+                                      n_prefetch=0 if has_ghost else train_config.n_prefetch)
+        for N, (run, phi, batch, y_batch, x) in enumerate(prefetcher):
+
+            timer.lap('sample')
             optimizer.zero_grad()
             if has_ghost:
                 optimizer_ghost_particles.zero_grad()
 
-            for batch in batch_loader:
-                pred = model(batch, data_id=run, training=True, vnorm=vnorm, phi=phi)
+            pred = model(batch, data_id=run, training=True, vnorm=vnorm, phi=phi)
 
             if has_ghost:
                 loss = ((pred[mask_ghost] - y_batch)).norm(2)
@@ -229,16 +273,21 @@ def data_train_particles(config, config_file, device):
                 else:
                     loss = ((pred - y_batch) / (y_batch)).norm(2) / 1E9
 
+            timer.lap('forward')
             visualize_embedding = True
-            if visualize_embedding & (((epoch < 3 ) & (N%(Niter//100) == 0)) | (N==0)):
+            if visualize_embedding & (((epoch < 3 ) & (N%max(Niter // 100, 1) == 0)) | (N==0)):
                 plot_training(config=config, dataset_name=dataset_name, log_dir=log_dir,
                               epoch=epoch, N=N, x=x, model=model, n_nodes=0, n_node_types=0, index_nodes=0, dataset_num=1,
                               index_particles=index_particles, n_particles=n_particles,
                               n_particle_types=n_particle_types, ynorm=ynorm, cmap=cmap, axis=True, device=device)
-                torch.save({'model_state_dict': model.state_dict(),
-                            'optimizer_state_dict': optimizer.state_dict()}, os.path.join(log_dir, 'models', f'best_model_with_{n_runs - 1}_graphs_{epoch}_{N}.pt'))
+                timer.lap('plot')
+                checkpoints.save({os.path.join(log_dir, 'models', f'best_model_with_{n_runs - 1}_graphs_{epoch}_{N}.pt'):
+                                  {'model_state_dict': model.state_dict(), 'optimizer_state_dict': optimizer.state_dict()}},
+                                 step=epoch * Niter + N, group='snapshot')
+                timer.lap('checkpoint')
 
             loss.backward()
+            timer.lap('backward')
             optimizer.step()
 
             if has_ghost:
@@ -250,18 +299,22 @@ def data_train_particles(config, config_file, device):
                 #     plt.close()
 
             total_loss += loss.item()
+            timer.lap('optimizer')
+            timer.step(batch.num_nodes, batch.num_edges)
 
         print("Epoch {}. Loss: {:.6f}".format(epoch, total_loss / (N + 1) / n_particles / batch_size))
         logger.info("Epoch {}. Loss: {:.6f}".format(epoch, total_loss / (N + 1) / n_particles / batch_size))
-        torch.save({'model_state_dict': model.state_dict(),
-                    'optimizer_state_dict': optimizer.state_dict()},
-                   os.path.join(log_dir, 'models', f'best_model_with_{n_runs - 1}_graphs_{epoch}.pt'))
         list_loss.append(total_loss / (N + 1) / n_particles / batch_size)
         torch.save(list_loss, os.path.join(log_dir, 'loss.pt'))
+        checkpoints.save({os.path.join(log_dir, 'models', f'best_model_with_{n_runs - 1}_graphs_{epoch}.pt'):
+                          {'model_state_dict': model.state_dict(), 'optimizer_state_dict': optimizer.state_dict()}},
+                         step=epoch, loss=list_loss[-1])
 
         if has_ghost:
-            torch.save({'model_state_dict': ghosts_particles.state_dict(),
-                        'optimizer_state_dict': optimizer_ghost_particles.state_dict()}, os.path.join(log_dir, 'models', f'best_ghost_particles_with_{n_runs - 1}_graphs_{epoch}.pt'))
+            checkpoints.save({os.path.join(log_dir, 'models', f'best_ghost_particles_with_{n_runs - 1}_graphs_{epoch}.pt'):
+                              {'model_state_dict': ghosts_particles.state_dict(), 'optimizer_state_dict': optimizer_ghost_particles.state_dict()}},
+                             step=epoch, loss=list_loss[-1], group='ghost')
+        timer.lap('checkpoint')
 
         # matplotlib.use("Qt5Agg")
         fig = plt.figure(figsize=(22, 4))
@@ -419,6 +472,12 @@ def data_train_particles(config, config_file, device):
         plt.savefig(f"./{log_dir}/tmp_training/Fig_{dataset_name}_{epoch}.tif")
         plt.close()
 
+        timer.lap('plot')
+        timer.epoch_end(epoch)
+
+    checkpoints.close()
+    timer.close()
+
 
 def data_train_tracking(config, config_file, device):
     print('')
@@ -454,21 +513,26 @@ def data_train_tracking(config, config_file, device):
     x_list = []
     y_list = []
     for run in trange(n_runs):
-        x = torch.load(f'graphs_data/graphs_{dataset_name}/x_list_{run}.pt', map_location=device)
-        y = torch.load(f'graphs_data/graphs_{dataset_name}/y_list_{run}.pt', map_location=device)
+        x = load_trajectory(f'graphs_data/graphs_{dataset_name}/x_list_{run}', device)
+        y = load_trajectory(f'graphs_data/graphs_{dataset_name}/y_list_{run}', device)
         x_list.append(x)
         y_list.append(y)
-    x = x_list[0][0].clone().detach()
-    y = y_list[0][0].clone().detach()
-    for run in range(n_runs):
-        for k in trange(n_frames):
-            if (k % 10 == 0) | (n_frames < 1000):
-                x = torch.cat((x, x_list[run][k].clone().detach()), 0)
-                y = torch.cat((y, y_list[run][k].clone().detach()), 0)
-        print(x_list[run][k].shape)
-        time.sleep(0.5)
-    vnorm = norm_velocity(x, dimension, device)
-    ynorm = norm_acceleration(y, device)
+    # statistics accumulated at generation time, older datasets are sampled every 10th frame
+    norms = load_norms(f'graphs_data/graphs_{dataset_name}', range(n_runs), device)
+    if norms is None:
+        x = x_list[0][0].clone().detach()
+        y = y_list[0][0].clone().detach()
+        for run in range(n_runs):
+            for k in trange(n_frames):
+                if (k % 10 == 0) | (n_frames < 1000):
+                    x = torch.cat((x, x_list[run][k].clone().detach()), 0)
+                    y = torch.cat((y, y_list[run][k].clone().detach()), 0)
+            print(x_list[run][k].shape)
+            time.sleep(0.5)
+        vnorm = norm_velocity(x, dimension, device)
+        ynorm = norm_acceleration(y, device)
+    else:
+        vnorm, ynorm = norms
     torch.save(vnorm, os.path.join(log_dir, 'vnorm.pt'))
     torch.save(ynorm, os.path.join(log_dir, 'ynorm.pt'))
     time.sleep(0.5)
@@ -514,12 +578,18 @@ def data_train_tracking(config, config_file, device):
     for k in range(n_frames):
         new_index = torch.arange(index, index + n_particles)
         index_l.append(new_index)
-        x_list[1][k][:, 0] = new_index
+        frame = x_list[1][k]
+        frame[:, 0] = new_index
+        x_list[1][k] = frame
         index += n_particles
 
     if has_ghost:
         ghosts_particles = Ghost_Particles(config, n_particles, vnorm, device)
-        optimizer_ghost_particles = torch.optim.Adam([ghosts_particles.ghost_pos], lr=1E-4)
+        match train_config.ghost_update:
+            case 'dense':
+                optimizer_ghost_particles = torch.optim.Adam([ghosts_particles.ghost_pos], lr=1E-4)
+            case 'sparse':
+                optimizer_ghost_particles = Lazy_Adam([ghosts_particles.ghost_pos], lr=1E-4)
         mask_ghost = np.concatenate((np.ones(n_particles), np.zeros(config.training.n_ghosts)))
         mask_ghost = np.tile(mask_ghost, batch_size)
         mask_ghost = np.argwhere(mask_ghost == 1)
@@ -531,6 +601,10 @@ def data_train_tracking(config, config_file, device):
 
     list_loss = []
     time.sleep(1)
+    checkpoints = Checkpoint_Manager(train_config.checkpoint_keep_last, train_config.checkpoint_keep_every,
+                                     train_config.checkpoint_keep_best)
+    timer = StageTimer(log_dir, 'training', train_config.profile, train_config.profiler_iterations,
+                       train_config.profiler_start, device, logger)
     for epoch in range(n_epochs + 1):
 
         current_sequence = config.training.sequence[epoch % sequence_length]
@@ -543,6 +617,8 @@ def data_train_tracking(config, config_file, device):
 
         total_loss = 0
         Niter = n_frames * data_augmentation_loop
+        if train_config.max_iterations > 0:
+            Niter = min(Niter, train_config.max_iterations)
 
         for N in range(Niter):
 
@@ -565,10 +641,10 @@ def data_train_tracking(config, config_file, device):
                 with torch.no_grad():
                     model.a[run,n_particles:n_particles+n_ghosts] = model.a[run,ghosts_particles.embedding_index].clone().detach()   # sample ghost embedding
 
-            distance = torch.sum(bc_dpos(x[:, None, 1:dimension + 1] - x[None, :, 1:dimension + 1]) ** 2, dim=2)
-            adj_t = ((distance < max_radius ** 2) & (distance > min_radius ** 2)).float() * 1
-            edges = adj_t.nonzero().t().contiguous()
+            timer.lap('sample')
+            edges = radius_graph(x[:, 1:dimension + 1], min_radius, max_radius, simulation_config.boundary, simulation_config.neighbor_method)
             dataset = data.Data(x=x[:, :], edge_index=edges)
+            timer.lap('graph')
 
             optimizer.zero_grad()
             if has_ghost:
@@ -593,10 +669,7 @@ def data_train_tracking(config, config_file, device):
             # loss = (pred - y).norm(2)
             # loss = (pred_ - y_).norm(2)
 
-            distance = torch.sum(bc_dpos(x_pred[:, None, :] - x_next[None, :, :]) ** 2, dim=2)
-            result = distance.min(dim=1)
-            min_value = result.values
-            min_index = result.indices
+            min_value, min_index = nearest_neighbor(x_pred, x_next, simulation_config.boundary, simulation_config.neighbor_method)
             pred__ = min_value / delta_t**2
 
             loss = torch.sum(pred__)
@@ -605,8 +678,9 @@ def data_train_tracking(config, config_file, device):
             # loss1 = (x_pred[:, None, 1:3] - y[None, :, :]).norm(2)
             # loss2 = 0 * pred.norm(2) / (vnorm**2) * config.training.coeff_loss2
 
+            timer.lap('forward')
             visualize_embedding = True
-            if visualize_embedding & (((epoch < 3 ) & (N % (Niter//100) == 0)) | (N==0)):
+            if visualize_embedding & (((epoch < 3 ) & (N % max(Niter // 100, 1) == 0)) | (N==0)):
 
                 fig = plt.figure(figsize=(8, 8))
                 plt.scatter(to_numpy(x[:, 1]), to_numpy(x[:, 2]), s=10, c='k', alpha=0.05)
@@ -627,27 +701,36 @@ def data_train_tracking(config, config_file, device):
                               epoch=epoch, N=N, model=model, index_particles=index_particles, n_particles=n_particles,
                               n_particle_types=n_particle_types, type_list=type_list, cmap=cmap, device=device)
 
-                torch.save({'model_state_dict': model.state_dict(),
-                            'optimizer_state_dict': optimizer.state_dict()}, os.path.join(log_dir, 'models', f'best_model_with_{n_runs - 1}_graphs_{epoch}_{N}.pt'))
+                timer.lap('plot')
+                checkpoints.save({os.path.join(log_dir, 'models', f'best_model_with_{n_runs - 1}_graphs_{epoch}_{N}.pt'):
+                                  {'model_state_dict': model.state_dict(), 'optimizer_state_dict': optimizer.state_dict()}},
+                                 step=epoch * Niter + N, group='snapshot')
+                timer.lap('checkpoint')
 
             loss.backward()
+            timer.lap('backward')
             optimizer.step()
 
             if has_ghost:
                 optimizer_ghost_particles.step()
 
             total_loss += loss.item()
+            timer.lap('optimizer')
+            timer.step(dataset.num_nodes, dataset.num_edges)
 
         print("Epoch {}. Loss: {:.6f}".format(epoch, total_loss / (N + 1) / n_particles))
         logger.info("Epoch {}. Loss: {:.6f}".format(epoch, total_loss / (N + 1) / n_particles))
-        torch.save({'model_state_dict': model.state_dict(),
-                    'optimizer_state_dict': optimizer.state_dict()}, os.path.join(log_dir, 'models', f'best_model_with_{n_runs - 1}_graphs_{epoch}.pt'))
         list_loss.append(total_loss / (N + 1) / n_particles)
         torch.save(list_loss, os.path.join(log_dir, 'loss.pt'))
+        checkpoints.save({os.path.join(log_dir, 'models', f'best_model_with_{n_runs - 1}_graphs_{epoch}.pt'):
+                          {'model_state_dict': model.state_dict(), 'optimizer_state_dict': optimizer.state_dict()}},
+                         step=epoch, loss=list_loss[-1])
 
         if has_ghost:
-            torch.save({'model_state_dict': ghosts_particles.state_dict(),
-                        'optimizer_state_dict': optimizer_ghost_particles.state_dict()}, os.path.join(log_dir, 'models', f'best_ghost_particles_with_{n_runs - 1}_graphs_{epoch}.pt'))
+            checkpoints.save({os.path.join(log_dir, 'models', f'best_ghost_particles_with_{n_runs - 1}_graphs_{epoch}.pt'):
+                              {'model_state_dict': ghosts_particles.state_dict(), 'optimizer_state_dict': optimizer_ghost_particles.state_dict()}},
+                             step=epoch, loss=list_loss[-1], group='ghost')
+        timer.lap('checkpoint')
 
         if epoch>18:
 
@@ -668,9 +751,7 @@ def data_train_tracking(config, config_file, device):
                     tracking_index_list=[]
                     for k in trange(n_frames):
                         x = x_list[1][k].clone().detach()
-                        distance = torch.sum(bc_dpos(x[:, None, 1:3] - x[None, :, 1:3]) ** 2, dim=2)
-                        adj_t = ((distance < max_radius ** 2) & (distance > min_radius ** 2)).float() * 1
-                        edges = adj_t.nonzero().t().contiguous()
+                        edges = radius_graph(x[:, 1:3], min_radius, max_radius, simulation_config.boundary, simulation_config.neighbor_method)
                         dataset = data.Data(x=x[:, :], edge_index=edges)
 
                         pred = model(dataset, training=True, vnorm=vnorm, phi=torch.zeros(1, device=device))
@@ -678,13 +759,12 @@ def data_train_tracking(config, config_file, device):
                         x_next = x_next[:, 1:3].clone().detach()
                         x_pred = (x[:, 1:3] + delta_t * pred)
 
-                        distance = torch.sum(bc_dpos(x_pred[:, None, :] - x_next[None, :, :]) ** 2, dim=2)
-                        result = distance.min(dim=1)
-                        min_value = result.values
-                        min_index = result.indices
+                        min_value, min_index = nearest_neighbor(x_pred, x_next, simulation_config.boundary, simulation_config.neighbor_method)
                         plt.scatter(np.arange(len(min_index)), to_numpy(min_index), s=10, c='k', alpha=0.05)
                         tracking_index += np.sum((to_numpy(min_index) - np.arange(len(min_index))==0)) / n_frames / n_particles *100
-                        x_list[1][k+1][min_index, 0:1] = x_list[1][k][:, 0:1].clone().detach()
+                        frame = x_list[1][k + 1]
+                        frame[min_index, 0:1] = x_list[1][k][:, 0:1].clone().detach()
+                        x_list[1][k + 1] = frame
                         tracking_index_list.append(len(x_pred) - np.sum((to_numpy(min_index) - np.arange(len(min_index)) == 0)))
 
                     plt.xticks([])
@@ -706,7 +786,7 @@ def data_train_tracking(config, config_file, device):
                     plt.savefig(f"./{log_dir}/tmp_training/tracking_error_{config_file}_{epoch}.tif", dpi=170.7)
                     plt.close()
 
-                    x_ = torch.stack(x_list[1])
+                    x_ = torch.stack(list(x_list[1]))
                     x_ = torch.reshape(x_, (x_.shape[0] * x_.shape[1], x_.shape[2]))
                     x_ = x_[0:(n_frames-1)*n_particles]
                     x_ = to_numpy(x_[:,0])
@@ -744,7 +824,9 @@ def data_train_tracking(config, config_file, device):
                                 model.a[pos, :] = model_a
 
                     for k in range(n_frames):
-                        x_list[1][k][:, 0] = index_l[k].clone().detach()
+                        frame = x_list[1][k]
+                        frame[:, 0] = index_l[k].clone().detach()
+                        x_list[1][k] = frame
 
                     # embedding to be optimized > fast learning rate
                     # functions are fixed > slow learning rate
@@ -801,7 +883,9 @@ def data_train_tracking(config, config_file, device):
                     index = 0
                     for k in range(n_frames):
                         new_index = x_[index, index + n_particles]
-                        x_list[1][k][:, 0] = torch.tensor(new_index, device=device)
+                        frame = x_list[1][k]
+                        frame[:, 0] = torch.tensor(new_index, device=device)
+                        x_list[1][k] = frame
                         index += n_particles
 
                     # embedding to be fixed > slow learning rate
@@ -826,6 +910,12 @@ def data_train_tracking(config, config_file, device):
         plt.savefig(f"./{log_dir}/tmp_training/all_particle_{dataset_name}_{epoch}.tif", dpi=87)
         plt.close()
 
+        timer.lap('plot')
+        timer.epoch_end(epoch)
+
+    checkpoints.close()
+    timer.close()
+
 
 def data_train_cell_tracking(config, config_file, device):
     print('')
@@ -867,12 +957,12 @@ def data_train_cell_tracking(config, config_file, device):
     n_particles_max = 0
     n_particles_max_list= []
     for run in trange(n_runs):
-        x = torch.load(f'graphs_data/graphs_{dataset_name}/x_list_{run}.pt', map_location=device)
+        x = load_trajectory(f'graphs_data/graphs_{dataset_name}/x_list_{run}', device)
         if x[len(x)-1].shape[0] > n_particles_max:
             n_particles_max = x[len(x)-1].shape[0]
         n_particles_max_list.append(x[len(x)-1].shape[0])
         if run>0:
-            y = torch.load(f'graphs_data/graphs_{dataset_name}/y_list_{run}.pt', map_location=device)
+            y = load_trajectory(f'graphs_data/graphs_{dataset_name}/y_list_{run}', device)
             edge_p_p = np.load(f'graphs_data/graphs_{dataset_name}/edge_p_p_list_{run}.npz')
             x_list.append(x)
             y_list.append(y)
@@ -884,18 +974,23 @@ def data_train_cell_tracking(config, config_file, device):
             x_list.append(small_tensor)
             y_list.append(small_tensor)
             edge_p_p_list.append(to_numpy(small_tensor))
-    x = x_list[1][0].clone().detach()
-    y = y_list[1][0].clone().detach()
     config.simulation.n_particles_max = n_particles_max
-    for run in range(1,n_runs):
-        for k in trange(n_frames):
-            if (k % 10 == 0) | (n_frames < 1000):
-                x = torch.cat((x, x_list[run][k].clone().detach()), 0)
-                y = torch.cat((y, y_list[run][k].clone().detach()), 0)
-        print(x_list[run][k].shape)
-        time.sleep(0.5)
-    vnorm = norm_velocity(x, dimension, device)
-    ynorm = norm_acceleration(y, device)
+    # statistics accumulated at generation time, older datasets are sampled every 10th frame
+    norms = load_norms(f'graphs_data/graphs_{dataset_name}', range(1,n_runs), device)
+    if norms is None:
+        x = x_list[1][0].clone().detach()
+        y = y_list[1][0].clone().detach()
+        for run in range(1,n_runs):
+            for k in trange(n_frames):
+                if (k % 10 == 0) | (n_frames < 1000):
+                    x = torch.cat((x, x_list[run][k].clone().detach()), 0)
+                    y = torch.cat((y, y_list[run][k].clone().detach()), 0)
+            print(x_list[run][k].shape)
+            time.sleep(0.5)
+        vnorm = norm_velocity(x, dimension, device)
+        ynorm = norm_acceleration(y, device)
+    else:
+        vnorm, ynorm = norms
     torch.save(vnorm, os.path.join(log_dir, 'vnorm.pt'))
     torch.save(ynorm, os.path.join(log_dir, 'ynorm.pt'))
     np.save(os.path.join(log_dir, 'n_particles_max.npy'), n_particles_max)
@@ -938,20 +1033,26 @@ def data_train_cell_tracking(config, config_file, device):
     index_l = []
     index = 0
     for k in range(n_frames):
-        pos = torch.argwhere(x_list[1][k][:, 6]==0)   # list of dead cells
+        frame = x_list[1][k]
+        pos = torch.argwhere(frame[:, 6]==0)   # list of dead cells
         if len(pos)>0:
-            x_list[1][k][pos,1] = 20
-            x_list[1][k][pos,2] = 20
+            frame[pos,1] = 20
+            frame[pos,2] = 20
 
-        new_index = torch.arange(index, index + len(x_list[1][k]))
+        new_index = torch.arange(index, index + len(frame))
         index_l.append(new_index)
-        x_list[1][k][:, 0] = new_index
-        index += len(x_list[1][k])
+        frame[:, 0] = new_index
+        x_list[1][k] = frame
+        index += len(frame)
 
     if has_ghost:
 
         ghosts_particles = Ghost_Particles(config, n_particles, vnorm, device)
-        optimizer_ghost_particles = torch.optim.Adam([ghosts_particles.ghost_pos], lr=1E-4)
+        match train_config.ghost_update:
+            case 'dense':
+                optimizer_ghost_particles = torch.optim.Adam([ghosts_particles.ghost_pos], lr=1E-4)
+            case 'sparse':
+                optimizer_ghost_particles = Lazy_Adam([ghosts_particles.ghost_pos], lr=1E-4)
         mask_ghost = np.concatenate((np.ones(n_particles), np.zeros(config.training.n_ghosts)))
         mask_ghost = np.tile(mask_ghost, batch_size)
         mask_ghost = np.argwhere(mask_ghost == 1)
@@ -963,6 +1064,10 @@ def data_train_cell_tracking(config, config_file, device):
 
     list_loss = []
     time.sleep(1)
+    checkpoints = Checkpoint_Manager(train_config.checkpoint_keep_last, train_config.checkpoint_keep_every,
+                                     train_config.checkpoint_keep_best)
+    timer = StageTimer(log_dir, 'training', train_config.profile, train_config.profiler_iterations,
+                       train_config.profiler_start, device, logger)
     for epoch in range(n_epochs + 1):
 
         if (epoch == 1) & (has_ghost):
@@ -973,6 +1078,8 @@ def data_train_cell_tracking(config, config_file, device):
 
         total_loss = 0
         Niter = n_frames * data_augmentation_loop
+        if train_config.max_iterations > 0:
+            Niter = min(Niter, train_config.max_iterations)
 
         for N in range(Niter):
 
@@ -995,9 +1102,11 @@ def data_train_cell_tracking(config, config_file, device):
                 with torch.no_grad():
                     model.a[run,n_particles:n_particles+n_ghosts] = model.a[run,ghosts_particles.embedding_index].clone().detach()   # sample ghost embedding
 
+            timer.lap('sample')
             edges = edge_p_p_list[run][f'arr_{k}']
             edges = torch.tensor(edges, dtype=torch.int64, device=device)
             dataset = data.Data(x=x[:, :], edge_index=edges)
+            timer.lap('graph')
 
             # y = y_list[run][k].clone().detach()
             # if noise_level > 0:
@@ -1027,10 +1136,7 @@ def data_train_cell_tracking(config, config_file, device):
             # loss = (pred - y).norm(2)
             # loss = (pred_ - y_).norm(2)
 
-            distance = torch.sum(bc_dpos(x_pred[:, None, :] - x_next[None, :, :]) ** 2, dim=2)
-            result = distance.min(dim=1)
-            min_value = result.values
-            min_index = result.indices
+            min_value, min_index = nearest_neighbor(x_pred, x_next, simulation_config.boundary, simulation_config.neighbor_method)
             pred__ = min_value / delta_t**2
 
             loss = torch.sum(pred__)
@@ -1039,8 +1145,9 @@ def data_train_cell_tracking(config, config_file, device):
             # loss1 = (x_pred[:, None, 1:3] - y[None, :, :]).norm(2)
             # loss2 = 0 * pred.norm(2) / (vnorm**2) * config.training.coeff_loss2
 
+            timer.lap('forward')
             visualize_embedding = True
-            if visualize_embedding & (((epoch < 3 ) & (N % (Niter//100) == 0)) | (N==0)):
+            if visualize_embedding & (((epoch < 3 ) & (N % max(Niter // 100, 1) == 0)) | (N==0)):
                 print(N)
                 fig = plt.figure(figsize=(8, 8))
                 plt.scatter(to_numpy(x[:, 1]), to_numpy(x[:, 2]), s=10, c='k', alpha=0.05)
@@ -1056,10 +1163,14 @@ def data_train_cell_tracking(config, config_file, device):
                 index_particles = get_index_particles(x_, n_particle_types, dimension)
                 plot_training_cell(config=config, dataset_name=dataset_name, log_dir=log_dir,
                               epoch=epoch, N=N, model=model, index_particles=index_particles, n_particle_types=n_particle_types, type_list=type_list, ynorm=ynorm, cmap=cmap, device=device)
-                torch.save({'model_state_dict': model.state_dict(),
-                            'optimizer_state_dict': optimizer.state_dict()}, os.path.join(log_dir, 'models', f'best_model_with_{n_runs - 1}_graphs_{epoch}_{N}.pt'))
+                timer.lap('plot')
+                checkpoints.save({os.path.join(log_dir, 'models', f'best_model_with_{n_runs - 1}_graphs_{epoch}_{N}.pt'):
+                                  {'model_state_dict': model.state_dict(), 'optimizer_state_dict': optimizer.state_dict()}},
+                                 step=epoch * Niter + N, group='snapshot')
+                timer.lap('checkpoint')
 
             loss.backward()
+            timer.lap('backward')
             optimizer.step()
 
             if has_ghost:
@@ -1071,20 +1182,25 @@ def data_train_cell_tracking(config, config_file, device):
                 #     plt.close()
 
             total_loss += loss.item()
+            timer.lap('optimizer')
+            timer.step(dataset.num_nodes, dataset.num_edges)
 
         print("Epoch {}. Loss: {:.6f}".format(epoch, total_loss / (N + 1) / n_particles))
         logger.info("Epoch {}. Loss: {:.6f}".format(epoch, total_loss / (N + 1) / n_particles))
-        torch.save({'model_state_dict': model.state_dict(),
-                    'optimizer_state_dict': optimizer.state_dict()}, os.path.join(log_dir, 'models', f'best_model_with_{n_runs - 1}_graphs_{epoch}.pt'))
         list_loss.append(total_loss / (N + 1) / n_particles)
         torch.save(list_loss, os.path.join(log_dir, 'loss.pt'))
+        checkpoints.save({os.path.join(log_dir, 'models', f'best_model_with_{n_runs - 1}_graphs_{epoch}.pt'):
+                          {'model_state_dict': model.state_dict(), 'optimizer_state_dict': optimizer.state_dict()}},
+                         step=epoch, loss=list_loss[-1])
 
         t, r, a = get_gpu_memory_map(device)
         logger.info(f"GPU memory: total {t} reserved {r} allocated {a}")
 
         if has_ghost:
-            torch.save({'model_state_dict': ghosts_particles.state_dict(),
-                        'optimizer_state_dict': optimizer_ghost_particles.state_dict()}, os.path.join(log_dir, 'models', f'best_ghost_particles_with_{n_runs - 1}_graphs_{epoch}.pt'))
+            checkpoints.save({os.path.join(log_dir, 'models', f'best_ghost_particles_with_{n_runs - 1}_graphs_{epoch}.pt'):
+                              {'model_state_dict': ghosts_particles.state_dict(), 'optimizer_state_dict': optimizer_ghost_particles.state_dict()}},
+                             step=epoch, loss=list_loss[-1], group='ghost')
+        timer.lap('checkpoint')
 
         if epoch>18:
 
@@ -1106,9 +1222,7 @@ def data_train_cell_tracking(config, config_file, device):
                 tracking_index_list = []
                 for k in trange(n_frames):
                     x = x_list[1][k].clone().detach()
-                    distance = torch.sum(bc_dpos(x[:, None, 1:3] - x[None, :, 1:3]) ** 2, dim=2)
-                    adj_t = ((distance < max_radius ** 2) & (distance > min_radius ** 2)).float() * 1
-                    edges = adj_t.nonzero().t().contiguous()
+                    edges = radius_graph(x[:, 1:3], min_radius, max_radius, simulation_config.boundary, simulation_config.neighbor_method)
                     dataset = data.Data(x=x[:, :], edge_index=edges)
 
                     pred = model(dataset, training=True, vnorm=vnorm, phi=torch.zeros(1, device=device))
@@ -1117,13 +1231,12 @@ def data_train_cell_tracking(config, config_file, device):
                     x_next = x_next[:, 1:3].clone().detach()
                     x_pred = (x[:, 1:3] + delta_t * pred)
 
-                    distance = torch.sum(bc_dpos(x_pred[:, None, :] - x_next[None, :, :]) ** 2, dim=2)
-                    result = distance.min(dim=1)
-                    min_value = result.values
-                    min_index = result.indices
+                    min_value, min_index = nearest_neighbor(x_pred, x_next, simulation_config.boundary, simulation_config.neighbor_method)
                     plt.scatter(np.arange(len(min_index)), to_numpy(min_index), s=10, c='k', alpha=0.05)
                     tracking_index += np.sum((to_numpy(min_index) - np.arange(len(min_index))==0)) / n_frames / n_particles *100
-                    x_list[1][k+1][min_index, 0:1] = x_list[1][k][:, 0:1].clone().detach()
+                    frame = x_list[1][k + 1]
+                    frame[min_index, 0:1] = x_list[1][k][:, 0:1].clone().detach()
+                    x_list[1][k + 1] = frame
 
                     tracking_index_list.append(len(x_pred) - np.sum((to_numpy(min_index) - np.arange(len(min_index)) == 0)))
 
@@ -1193,7 +1306,9 @@ def data_train_cell_tracking(config, config_file, device):
                             model.a[pos, :] = model_a
 
                 for k in range(n_frames):
-                    x_list[1][k][:, 0] = index_l[k].clone().detach()
+                    frame = x_list[1][k]
+                    frame[:, 0] = index_l[k].clone().detach()
+                    x_list[1][k] = frame
 
         # fig = plt.figure(figsize=(8, 8))
         # for k in range(0,n_frames-2,n_frames//10):
@@ -1211,8 +1326,17 @@ def data_train_cell_tracking(config, config_file, device):
         optimizer, n_total_params = set_trainable_parameters(model, lr_embedding, lr)
         logger.info(f'Learning rates: {lr}, {lr_embedding}')
 
-        torch.save({'model_state_dict': model.state_dict(),
-                    'optimizer_state_dict': optimizer.state_dict()}, os.path.join(log_dir, 'models', f'best_model_with_{n_runs - 1}_graphs_{epoch}_corrected.pt'))
+        timer.lap('plot')
+        checkpoints.save({os.path.join(log_dir, 'models', f'best_model_with_{n_runs - 1}_graphs_{epoch}_corrected.pt'):
+                          {'model_state_dict': model.state_dict(), 'optimizer_state_dict': optimizer.state_dict()}},
+                         step=epoch, group='corrected')
+        timer.lap('checkpoint')
+
+        timer.lap('plot')
+        timer.epoch_end(epoch)
+
+    checkpoints.close()
+    timer.close()
 
 
 def data_train_cell(config, config_file, device):
@@ -1261,12 +1385,12 @@ def data_train_cell(config, config_file, device):
     n_particles_max = 0
     n_particles_max_list= []
     for run in trange(n_runs):
-        x = torch.load(f'graphs_data/graphs_{dataset_name}/x_list_{run}.pt', map_location=device)
+        x = load_trajectory(f'graphs_data/graphs_{dataset_name}/x_list_{run}', device)
         if x[len(x)-1].shape[0] > n_particles_max:
             n_particles_max = x[len(x)-1].shape[0]
         n_particles_max_list.append(x[len(x)-1].shape[0])
         if run>0:
-            y = torch.load(f'graphs_data/graphs_{dataset_name}/y_list_{run}.pt', map_location=device)
+            y = load_trajectory(f'graphs_data/graphs_{dataset_name}/y_list_{run}', device)
             edge_p_p = np.load(f'graphs_data/graphs_{dataset_name}/edge_p_p_list_{run}.npz')
             x_list.append(x)
             y_list.append(y)
@@ -1278,18 +1402,23 @@ def data_train_cell(config, config_file, device):
             x_list.append(small_tensor)
             y_list.append(small_tensor)
             edge_p_p_list.append(to_numpy(small_tensor))
-    x = x_list[1][0].clone().detach()
-    y = y_list[1][0].clone().detach()
     config.simulation.n_particles_max = n_particles_max
-    for run in range(1,n_runs):
-        for k in trange(n_frames):
-            if (k % 10 == 0) | (n_frames < 1000):
-                x = torch.cat((x, x_list[run][k].clone().detach()), 0)
-                y = torch.cat((y, y_list[run][k].clone().detach()), 0)
-        print(x_list[run][k].shape)
-        time.sleep(0.5)
-    vnorm = norm_velocity(x, dimension, device)
-    ynorm = norm_acceleration(y, device)
+    # statistics accumulated at generation time, older datasets are sampled every 10th frame
+    norms = load_norms(f'graphs_data/graphs_{dataset_name}', range(1,n_runs), device)
+    if norms is None:
+        x = x_list[1][0].clone().detach()
+        y = y_list[1][0].clone().detach()
+        for run in range(1,n_runs):
+            for k in trange(n_frames):
+                if (k % 10 == 0) | (n_frames < 1000):
+                    x = torch.cat((x, x_list[run][k].clone().detach()), 0)
+                    y = torch.cat((y, y_list[run][k].clone().detach()), 0)
+            print(x_list[run][k].shape)
+            time.sleep(0.5)
+        vnorm = norm_velocity(x, dimension, device)
+        ynorm = norm_acceleration(y, device)
+    else:
+        vnorm, ynorm = norms
     torch.save(vnorm, os.path.join(log_dir, 'vnorm.pt'))
     torch.save(ynorm, os.path.join(log_dir, 'ynorm.pt'))
     np.save(os.path.join(log_dir, 'n_particles_max.npy'), n_particles_max)
@@ -1334,7 +1463,11 @@ def data_train_cell(config, config_file, device):
     if has_ghost:
 
         ghosts_particles = Ghost_Particles(config, n_particles, vnorm, device)
-        optimizer_ghost_particles = torch.optim.Adam([ghosts_particles.ghost_pos], lr=1E-4)
+        match train_config.ghost_update:
+            case 'dense':
+                optimizer_ghost_particles = torch.optim.Adam([ghosts_particles.ghost_pos], lr=1E-4)
+            case 'sparse':
+                optimizer_ghost_particles = Lazy_Adam([ghosts_particles.ghost_pos], lr=1E-4)
         mask_ghost = np.concatenate((np.ones(n_particles), np.zeros(config.training.n_ghosts)))
         mask_ghost = np.tile(mask_ghost, batch_size)
         mask_ghost = np.argwhere(mask_ghost == 1)
@@ -1346,6 +1479,10 @@ def data_train_cell(config, config_file, device):
 
     list_loss = []
     time.sleep(1)
+    checkpoints = Checkpoint_Manager(train_config.checkpoint_keep_last, train_config.checkpoint_keep_every,
+                                     train_config.checkpoint_keep_best)
+    timer = StageTimer(log_dir, 'training', train_config.profile, train_config.profiler_iterations,
+                       train_config.profiler_start, device, logger)
     for epoch in range(n_epochs + 1):
 
         batch_size = get_batch_size(epoch)
@@ -1358,20 +1495,22 @@ def data_train_cell(config, config_file, device):
 
         total_loss = 0
         Niter = n_frames * data_augmentation_loop // batch_size
+        if train_config.max_iterations > 0:
+            Niter = min(Niter, train_config.max_iterations)
 
-        for N in range(Niter):
+        def sample_batch(rng):
 
-            phi = torch.randn(1, dtype=torch.float32, requires_grad=False, device=device) * np.pi * 2
+            phi = torch.tensor(rng.standard_normal(1) * np.pi * 2, dtype=torch.float32, device=device)
             cos_phi = torch.cos(phi)
             sin_phi = torch.sin(phi)
 
-            run = 1 + np.random.randint(n_runs - 1)
+            run = 1 + rng.integers(n_runs - 1)
 
             dataset_batch = []
 
             for batch in range(batch_size):
 
-                k = np.random.randint(n_frames - 2)
+                k = rng.integers(n_frames - 2)
 
                 x = x_list[run][k].clone().detach()
 
@@ -1386,14 +1525,16 @@ def data_train_cell(config, config_file, device):
                     with torch.no_grad():
                         model.a[run,n_particles:n_particles+n_ghosts] = model.a[run,ghosts_particles.embedding_index].clone().detach()   # sample ghost embedding
 
+                timer.lap('sample')
                 edges = edge_p_p_list[run][f'arr_{k}']
                 edges = torch.tensor(edges, dtype=torch.int64, device=device)
+                timer.lap('graph')
                 dataset = data.Data(x=x[:, :], edge_index=edges)
                 dataset_batch.append(dataset)
 
                 y = y_list[run][k].clone().detach()
                 if noise_level > 0:
-                    y = y * (1 + torch.randn_like(y) * noise_level)
+                    y = y * (1 + torch.tensor(rng.standard_normal(y.shape), dtype=y.dtype, device=device) * noise_level)
 
                 y = y / ynorm
 
@@ -1407,13 +1548,23 @@ def data_train_cell(config, config_file, device):
                 else:
                     y_batch = torch.cat((y_batch, y[:, 0:2]), dim=0)
 
+            timer.lap('sample')
             batch_loader = DataLoader(dataset_batch, batch_size=batch_size, shuffle=False)
+            batch = next(iter(batch_loader))
+            timer.lap('collate')
+            return run, phi, batch, y_batch, x
+
+        # ghost positions are trained, their batches are built inline
+        prefetcher = Batch_Prefetcher(sample_batch, Niter, seed=train_config.seed, epoch=epoch,
+                                      n_prefetch=0 if has_ghost else train_config.n_prefetch)
+        for N, (run, phi, batch, y_batch, x) in enumerate(prefetcher):
+
+            timer.lap('sample')
             optimizer.zero_grad()
             if has_ghost:
                 optimizer_ghost_particles.zero_grad()
 
-            for batch in batch_loader:
-                pred = model(batch, data_id=run, training=True, vnorm=vnorm, phi=phi, has_field=True)
+            pred = model(batch, data_id=run, training=True, vnorm=vnorm, phi=phi, has_field=True)
 
             if has_ghost:
                 loss = ((pred[mask_ghost] - y_batch)).norm(2)
@@ -1422,18 +1573,23 @@ def data_train_cell(config, config_file, device):
                 mask_cell_alive = mask_cell_alive[:, 0].astype(int)
                 loss = ((pred[mask_cell_alive] - y_batch[mask_cell_alive])).norm(2)
 
+            timer.lap('forward')
             visualize_embedding = True
-            if visualize_embedding & (((epoch < 3 ) & (N%(Niter//100) == 0)) | (N==0)):
+            if visualize_embedding & (((epoch < 3 ) & (N%max(Niter // 100, 1) == 0)) | (N==0)):
                 x_ = x_list[1][n_frames - 1].clone().detach()
                 index_particles = get_index_particles(x_, n_particle_types, dimension)
                 plot_training_cell(config=config, dataset_name=dataset_name, log_dir=log_dir,
                               epoch=epoch, N=N, model=model, index_particles=index_particles, n_particle_types=n_particle_types, type_list=type_list, ynorm=ynorm, cmap=cmap, device=device)
-                torch.save({'model_state_dict': model.state_dict(),
-                            'optimizer_state_dict': optimizer.state_dict()}, os.path.join(log_dir, 'models', f'best_model_with_{n_runs - 1}_graphs_{epoch}_{N}.pt'))
+                timer.lap('plot')
+                checkpoints.save({os.path.join(log_dir, 'models', f'best_model_with_{n_runs - 1}_graphs_{epoch}_{N}.pt'):
+                                  {'model_state_dict': model.state_dict(), 'optimizer_state_dict': optimizer.state_dict()}},
+                                 step=epoch * Niter + N, group='snapshot')
                 t, r, a = get_gpu_memory_map(device)
                 logger.info(f"GPU memory: total {t} reserved {r} allocated {a}")
+                timer.lap('checkpoint')
 
             loss.backward()
+            timer.lap('backward')
             optimizer.step()
 
             if has_ghost:
@@ -1445,18 +1601,22 @@ def data_train_cell(config, config_file, device):
                 #     plt.close()
 
             total_loss += loss.item()
+            timer.lap('optimizer')
+            timer.step(batch.num_nodes, batch.num_edges)
 
         print("Epoch {}. Loss: {:.6f}".format(epoch, total_loss / (N + 1) / n_particles / batch_size))
         logger.info("Epoch {}. Loss: {:.6f}".format(epoch, total_loss / (N + 1) / n_particles / batch_size))
-        torch.save({'model_state_dict': model.state_dict(),
-                    'optimizer_state_dict': optimizer.state_dict()},
-                   os.path.join(log_dir, 'models', f'best_model_with_{n_runs - 1}_graphs_{epoch}.pt'))
         list_loss.append(total_loss / (N + 1) / n_particles / batch_size)
         torch.save(list_loss, os.path.join(log_dir, 'loss.pt'))
+        checkpoints.save({os.path.join(log_dir, 'models', f'best_model_with_{n_runs - 1}_graphs_{epoch}.pt'):
+                          {'model_state_dict': model.state_dict(), 'optimizer_state_dict': optimizer.state_dict()}},
+                         step=epoch, loss=list_loss[-1])
 
         if has_ghost:
-            torch.save({'model_state_dict': ghosts_particles.state_dict(),
-                        'optimizer_state_dict': optimizer_ghost_particles.state_dict()}, os.path.join(log_dir, 'models', f'best_ghost_particles_with_{n_runs - 1}_graphs_{epoch}.pt'))
+            checkpoints.save({os.path.join(log_dir, 'models', f'best_ghost_particles_with_{n_runs - 1}_graphs_{epoch}.pt'):
+                              {'model_state_dict': ghosts_particles.state_dict(), 'optimizer_state_dict': optimizer_ghost_particles.state_dict()}},
+                             step=epoch, loss=list_loss[-1], group='ghost')
+        timer.lap('checkpoint')
 
         # matplotlib.use("Qt5Agg")
         fig = plt.figure(figsize=(22, 4))
@@ -1483,6 +1643,12 @@ def data_train_cell(config, config_file, device):
         plt.savefig(f"./{log_dir}/tmp_training/Fig_{dataset_name}_{epoch}.tif")
         plt.close()
 
+        timer.lap('plot')
+        timer.epoch_end(epoch)
+
+    checkpoints.close()
+    timer.close()
+
 
 def data_train_mesh(config, config_file, device):
 
@@ -1529,9 +1695,9 @@ def data_train_mesh(config, config_file, device):
     y_mesh_list = []
     time.sleep(0.5)
     for run in trange(n_runs):
-        x_mesh = torch.load(f'graphs_data/graphs_{dataset_name}/x_mesh_list_{run}.pt', map_location=device)
+        x_mesh = load_trajectory(f'graphs_data/graphs_{dataset_name}/x_mesh_list_{run}', device)
         x_mesh_list.append(x_mesh)
-        h = torch.load(f'graphs_data/graphs_{dataset_name}/y_mesh_list_{run}.pt', map_location=device)
+        h = load_trajectory(f'graphs_data/graphs_{dataset_name}/y_mesh_list_{run}', device)
         y_mesh_list.append(h)
     h = y_mesh_list[0][0].clone().detach()
     for run in range(n_runs):
@@ -1591,6 +1757,10 @@ def data_train_mesh(config, config_file, device):
 
     list_loss = []
     time.sleep(1)
+    checkpoints = Checkpoint_Manager(train_config.checkpoint_keep_last, train_config.checkpoint_keep_every,
+                                     train_config.checkpoint_keep_best)
+    timer = StageTimer(log_dir, 'training', train_config.profile, train_config.profiler_iterations,
+                       train_config.profiler_start, device, logger)
     for epoch in range(n_epochs + 1):
 
         old_batch_size = batch_size
@@ -1604,17 +1774,21 @@ def data_train_mesh(config, config_file, device):
         Niter = n_frames * data_augmentation_loop // batch_size
         if (batch_size == 1):
             Niter = Niter // 4
+        if train_config.max_iterations > 0:
+            Niter = min(Niter, train_config.max_iterations)
+        if simulation_config.sparse_laplacian:
+            laplacian_batch = mesh_laplacian(edge_index_mesh, edge_weight_mesh, n_nodes, batch_size)
 
-        for N in range(Niter):
+        def sample_batch(rng):
 
-            run = 1 + np.random.randint(n_runs - 1)
+            run = 1 + rng.integers(n_runs - 1)
 
             dataset_batch = []
             for batch in range(batch_size):
-                k = np.random.randint(n_frames - 1)
+                k = rng.integers(n_frames - 1)
                 x_mesh = x_mesh_list[run][k].clone().detach()
                 if train_config.noise_level > 0:
-                    x_mesh[:, 6:7] = x_mesh[:, 6:7] + train_config.noise_level * torch.randn_like(x_mesh[:, 6:7])
+                    x_mesh[:, 6:7] = x_mesh[:, 6:7] + train_config.noise_level * torch.tensor(rng.standard_normal((len(x_mesh), 1)), dtype=x_mesh.dtype, device=device)
                 dataset = data.Data(x=x_mesh, edge_index=edge_index_mesh, edge_attr=edge_weight_mesh, device=device)
                 dataset_batch.append(dataset)
                 y = y_mesh_list[run][k].clone().detach() / hnorm
@@ -1624,36 +1798,55 @@ def data_train_mesh(config, config_file, device):
                     y_batch = torch.cat((y_batch, y), dim=0)
 
             batch_loader = DataLoader(dataset_batch, batch_size=batch_size, shuffle=False)
+            timer.lap('sample')
+            batch = next(iter(batch_loader))
+            timer.lap('collate')
+            if simulation_config.sparse_laplacian:
+                batch.laplacian = laplacian_batch
+            return run, batch, y_batch, x_mesh
+
+        prefetcher = Batch_Prefetcher(sample_batch, Niter, seed=train_config.seed, epoch=epoch,
+                                      n_prefetch=train_config.n_prefetch)
+        for N, (run, batch, y_batch, x_mesh) in enumerate(prefetcher):
+
+            timer.lap('sample')
             optimizer.zero_grad()
 
-            for batch in batch_loader:
-                pred = model(batch, data_id=run)
+            pred = model(batch, data_id=run)
 
             loss = ((pred - y_batch) * mask_mesh).norm(2)
+            timer.lap('forward')
             loss.backward()
+            timer.lap('backward')
             optimizer.step()
 
             total_loss += loss.item()
+            timer.lap('optimizer')
 
             visualize_embedding = True
             if visualize_embedding & (((epoch == 0) & (N < 10000) & (N % 200 == 0)) | (N==0)):
-                torch.save({'model_state_dict': model.state_dict(),
-                            'optimizer_state_dict': optimizer.state_dict()},
-                           os.path.join(log_dir, 'models', f'best_model_with_{n_runs - 1}_graphs_{epoch}_{N}.pt'))
+                checkpoints.save({os.path.join(log_dir, 'models', f'best_model_with_{n_runs - 1}_graphs_{epoch}_{N}.pt'):
+                                  {'model_state_dict': model.state_dict(), 'optimizer_state_dict': optimizer.state_dict()}},
+                                 step=epoch * Niter + N, group='snapshot')
+                timer.lap('checkpoint')
 
                 plot_training(config=config, dataset_name=dataset_name,
                               log_dir=log_dir,
                               epoch=epoch, N=N, x=x_mesh, model=model, n_nodes=n_nodes, n_node_types=n_node_types, index_nodes=index_nodes, dataset_num=1,
                               index_particles=[], n_particles=[],
                               n_particle_types=[], ynorm=ynorm, cmap=cmap, axis=True, device=device)
+                timer.lap('plot')
+
+            timer.step(batch.num_nodes, batch.num_edges)
 
         print("Epoch {}. Loss: {:.6f}".format(epoch, total_loss / (N + 1) / n_nodes / batch_size))
         logger.info("Epoch {}. Loss: {:.6f}".format(epoch, total_loss / (N + 1) / n_nodes / batch_size))
-        torch.save({'model_state_dict': model.state_dict(),
-                    'optimizer_state_dict': optimizer.state_dict()},
-                   os.path.join(log_dir, 'models', f'best_model_with_{n_runs - 1}_graphs_{epoch}.pt'))
         list_loss.append(total_loss / (N + 1) / n_nodes / batch_size)
         torch.save(list_loss, os.path.join(log_dir, 'loss.pt'))
+        checkpoints.save({os.path.join(log_dir, 'models', f'best_model_with_{n_runs - 1}_graphs_{epoch}.pt'):
+                          {'model_state_dict': model.state_dict(), 'optimizer_state_dict': optimizer.state_dict()}},
+                         step=epoch, loss=list_loss[-1])
+        timer.lap('checkpoint')
 
         # matplotlib.use("Qt5Agg")
         fig = plt.figure(figsize=(22, 4))
@@ -1840,6 +2033,12 @@ def data_train_mesh(config, config_file, device):
         plt.savefig(f"./{log_dir}/tmp_training/Fig_{dataset_name}_{epoch}.tif")
         plt.close()
 
+        timer.lap('plot')
+        timer.epoch_end(epoch)
+
+    checkpoints.close()
+    timer.close()
+
 
 def data_train_particle_field(config, config_file, device):
     print('')
@@ -1892,25 +2091,30 @@ def data_train_particle_field(config, config_file, device):
     edge_f_f_list = []
     edge_f_p_list = []
     for run in trange(n_runs):
-        x = torch.load(f'graphs_data/graphs_{dataset_name}/x_list_{run}.pt', map_location=device)
-        y = torch.load(f'graphs_data/graphs_{dataset_name}/y_list_{run}.pt', map_location=device)
+        x = load_trajectory(f'graphs_data/graphs_{dataset_name}/x_list_{run}', device)
+        y = load_trajectory(f'graphs_data/graphs_{dataset_name}/y_list_{run}', device)
         edge_p_p = torch.load(f'graphs_data/graphs_{dataset_name}/edge_p_p_list{run}.pt', map_location=device)
         edge_f_p = torch.load(f'graphs_data/graphs_{dataset_name}/edge_f_p_list{run}.pt', map_location=device)
         x_list.append(x)
         y_list.append(y)
         edge_p_p_list.append(edge_p_p)
         edge_f_p_list.append(edge_f_p)
-    x = x_list[0][0].clone().detach()
-    y = y_list[0][0].clone().detach()
-    for run in range(n_runs):
-        for k in trange(n_frames):
-            if (k % 10 == 0) | (n_frames < 1000):
-                x = torch.cat((x, x_list[run][k].clone().detach()), 0)
-                y = torch.cat((y, y_list[run][k].clone().detach()), 0)
-        print(x_list[run][k].shape)
-        time.sleep(0.5)
-    vnorm = norm_velocity(x, dimension, device)
-    ynorm = norm_acceleration(y, device)
+    # statistics accumulated at generation time, older datasets are sampled every 10th frame
+    norms = load_norms(f'graphs_data/graphs_{dataset_name}', range(n_runs), device)
+    if norms is None:
+        x = x_list[0][0].clone().detach()
+        y = y_list[0][0].clone().detach()
+        for run in range(n_runs):
+            for k in trange(n_frames):
+                if (k % 10 == 0) | (n_frames < 1000):
+                    x = torch.cat((x, x_list[run][k].clone().detach()), 0)
+                    y = torch.cat((y, y_list[run][k].clone().detach()), 0)
+            print(x_list[run][k].shape)
+            time.sleep(0.5)
+        vnorm = norm_velocity(x, dimension, device)
+        ynorm = norm_acceleration(y, device)
+    else:
+        vnorm, ynorm = norms
     torch.save(vnorm, os.path.join(log_dir, 'vnorm.pt'))
     torch.save(ynorm, os.path.join(log_dir, 'ynorm.pt'))
     time.sleep(0.5)
@@ -1921,9 +2125,9 @@ def data_train_particle_field(config, config_file, device):
     y_mesh_list = []
     time.sleep(0.5)
     for run in trange(n_runs):
-        x_mesh = torch.load(f'graphs_data/graphs_{dataset_name}/x_mesh_list_{run}.pt', map_location=device)
+        x_mesh = load_trajectory(f'graphs_data/graphs_{dataset_name}/x_mesh_list_{run}', device)
         x_mesh_list.append(x_mesh)
-        h = torch.load(f'graphs_data/graphs_{dataset_name}/y_mesh_list_{run}.pt', map_location=device)
+        h = load_trajectory(f'graphs_data/graphs_{dataset_name}/y_mesh_list_{run}', device)
         y_mesh_list.append(h)
     h = y_mesh_list[0][0].clone().detach()
     for run in range(n_runs):
@@ -2015,6 +2219,10 @@ def data_train_particle_field(config, config_file, device):
     list_loss = []
     time.sleep(1)
 
+    checkpoints = Checkpoint_Manager(train_config.checkpoint_keep_last, train_config.checkpoint_keep_every,
+                                     train_config.checkpoint_keep_best)
+    timer = StageTimer(log_dir, 'training', train_config.profile, train_config.profiler_iterations,
+                       train_config.profiler_start, device, logger)
     for epoch in range(n_epochs + 1):
 
         old_batch_size = batch_size
@@ -2041,6 +2249,8 @@ def data_train_particle_field(config, config_file, device):
         total_loss = 0
         total_loss_division = 0
         Niter = n_frames * data_augmentation_loop // batch_size
+        if train_config.max_iterations > 0:
+            Niter = min(Niter, train_config.max_iterations)
 
         for N in range(Niter):
 
@@ -2115,6 +2325,7 @@ def data_train_particle_field(config, config_file, device):
 
             batch_loader_p_p = DataLoader(dataset_batch_p_p, batch_size=batch_size, shuffle=False)
             batch_loader_f_p = DataLoader(dataset_batch_f_p, batch_size=batch_size, shuffle=False)
+            timer.lap('sample')
 
             optimizer.zero_grad()
 
@@ -2135,7 +2346,9 @@ def data_train_particle_field(config, config_file, device):
             else:
                 loss = (pred_p_p + pred_f_p - y_batch).norm(2) # + model.field.norm(2)
 
+            timer.lap('forward')
             loss.backward()
+            timer.lap('backward')
             optimizer.step()
             if has_siren:
                 optimizer_f.step()
@@ -2143,6 +2356,7 @@ def data_train_particle_field(config, config_file, device):
                 optimizer_ghost_particles.step()
 
             total_loss += loss.item()
+            timer.lap('optimizer')
 
             visualize_embedding = True
             if visualize_embedding & (((epoch < 3 ) & (N % 500 == 0)) | (N==0)):
@@ -2150,29 +2364,35 @@ def data_train_particle_field(config, config_file, device):
                               epoch=epoch, N=N, x=x, x_mesh=x_mesh, model_field=model.field, model=model, n_nodes=0, n_node_types=0, index_nodes=0, dataset_num=1,
                               index_particles=index_particles, n_particles=n_particles,
                               n_particle_types=n_particle_types, ynorm=ynorm, cmap=cmap, axis=True, device=device)
-                torch.save({'model_state_dict': model.state_dict(),
-                            'optimizer_state_dict': optimizer.state_dict()},
-                           os.path.join(log_dir, 'models', f'best_model_with_{n_runs - 1}_graphs_{epoch}_{N}.pt'))
+                timer.lap('plot')
+                checkpoints.save({os.path.join(log_dir, 'models', f'best_model_with_{n_runs - 1}_graphs_{epoch}_{N}.pt'):
+                                  {'model_state_dict': model.state_dict(), 'optimizer_state_dict': optimizer.state_dict()}},
+                                 step=epoch * Niter + N, group='snapshot')
                 if (has_siren):
-                    torch.save({'model_state_dict': model_f.state_dict(),
-                                'optimizer_state_dict': optimizer_f.state_dict()},
-                               os.path.join(log_dir, 'models', f'best_model_f_with_{n_runs - 1}_graphs_{epoch}_{N}.pt'))
+                    checkpoints.save({os.path.join(log_dir, 'models', f'best_model_f_with_{n_runs - 1}_graphs_{epoch}_{N}.pt'):
+                                      {'model_state_dict': model_f.state_dict(), 'optimizer_state_dict': optimizer_f.state_dict()}},
+                                     step=epoch * Niter + N, group='field_snapshot')
+                timer.lap('checkpoint')
+
+            timer.step(sum(d.num_nodes for d in dataset_batch_p_p), sum(d.num_edges for d in dataset_batch_p_p + dataset_batch_f_p))
 
         print("Epoch {}. Loss: {:.6f}".format(epoch, total_loss / (N + 1) / n_particles / batch_size))
         logger.info("Epoch {}. Loss: {:.6f}".format(epoch, total_loss / (N + 1) / n_particles / batch_size))
-        torch.save({'model_state_dict': model.state_dict(),
-                    'optimizer_state_dict': optimizer.state_dict()},
-                   os.path.join(log_dir, 'models', f'best_model_with_{n_runs - 1}_graphs_{epoch}.pt'))
-        if has_siren:
-            torch.save({'model_state_dict': model_f.state_dict(),
-                        'optimizer_state_dict': optimizer_f.state_dict()},
-                       os.path.join(log_dir, 'models', f'best_model_f_with_{n_runs - 1}_graphs_{epoch}.pt'))
         list_loss.append(total_loss / (N + 1) / n_particles / batch_size)
         torch.save(list_loss, os.path.join(log_dir, 'loss.pt'))
+        checkpoints.save({os.path.join(log_dir, 'models', f'best_model_with_{n_runs - 1}_graphs_{epoch}.pt'):
+                          {'model_state_dict': model.state_dict(), 'optimizer_state_dict': optimizer.state_dict()}},
+                         step=epoch, loss=list_loss[-1])
+        if has_siren:
+            checkpoints.save({os.path.join(log_dir, 'models', f'best_model_f_with_{n_runs - 1}_graphs_{epoch}.pt'):
+                              {'model_state_dict': model_f.state_dict(), 'optimizer_state_dict': optimizer_f.state_dict()}},
+                             step=epoch, loss=list_loss[-1], group='field')
 
         if has_ghost:
-            torch.save({'model_state_dict': ghosts_particles.state_dict(),
-                        'optimizer_state_dict': optimizer_ghost_particles.state_dict()}, os.path.join(log_dir, 'models', f'best_ghost_particles_with_{n_runs - 1}_graphs_{epoch}.pt'))
+            checkpoints.save({os.path.join(log_dir, 'models', f'best_ghost_particles_with_{n_runs - 1}_graphs_{epoch}.pt'):
+                              {'model_state_dict': ghosts_particles.state_dict(), 'optimizer_state_dict': optimizer_ghost_particles.state_dict()}},
+                             step=epoch, loss=list_loss[-1], group='ghost')
+        timer.lap('checkpoint')
 
         # matplotlib.use("Qt5Agg")
         fig = plt.figure(figsize=(22, 4))
@@ -2197,6 +2417,12 @@ def data_train_particle_field(config, config_file, device):
         plt.savefig(f"./{log_dir}/tmp_training/Fig_{dataset_name}_{epoch}.tif")
         plt.close()
 
+        timer.lap('plot')
+        timer.epoch_end(epoch)
+
+    checkpoints.close()
+    timer.close()
+
 
 def data_train_signal(config, config_file, device):
 
@@ -2238,8 +2464,8 @@ def data_train_signal(config, config_file, device):
     x_list = []
     y_list = []
     for run in trange(n_runs):
-        x = torch.load(f'graphs_data/graphs_{dataset_name}/x_list_{run}.pt', map_location=device)
-        y = torch.load(f'graphs_data/graphs_{dataset_name}/y_list_{run}.pt', map_location=device)
+        x = load_trajectory(f'graphs_data/graphs_{dataset_name}/x_list_{run}', device)
+        y = load_trajectory(f'graphs_data/graphs_{dataset_name}/y_list_{run}', device)
         x_list.append(x)
         y_list.append(y)
     vnorm = torch.tensor(1.0, device=device)
@@ -2314,6 +2540,10 @@ def data_train_signal(config, config_file, device):
 
     list_loss = []
     time.sleep(1)
+    checkpoints = Checkpoint_Manager(train_config.checkpoint_keep_last, train_config.checkpoint_keep_every,
+                                     train_config.checkpoint_keep_best)
+    timer = StageTimer(log_dir, 'training', train_config.profile, train_config.profiler_iterations,
+                       train_config.profiler_start, device, logger)
     for epoch in range(n_epochs + 1):
 
         old_batch_size = batch_size
@@ -2335,12 +2565,15 @@ def data_train_signal(config, config_file, device):
         Niter = n_frames * data_augmentation_loop // batch_size
         if (has_mesh) & (batch_size == 1):
             Niter = Niter // 4
+        if train_config.max_iterations > 0:
+            Niter = min(Niter, train_config.max_iterations)
 
         for N in range(Niter):
 
             run = 1 + np.random.randint(n_runs - 1)
             k = np.random.randint(n_frames - 6)
 
+            timer.lap('sample')
             optimizer.zero_grad()
 
             match recursive_loop:
@@ -2422,22 +2655,29 @@ def data_train_signal(config, config_file, device):
 
                     loss = (pred1 - y1).norm(2) + (pred2 - y2).norm(2) + (pred3 - y3).norm(2)+ (pred4 - y4).norm(2) + (pred5 - y5).norm(2)
 
+            timer.lap('forward')
             loss.backward()
+            timer.lap('backward')
             optimizer.step()
 
             total_loss += loss.item()
+            timer.lap('optimizer')
 
             visualize_embedding = True
             if visualize_embedding & (((epoch == 0) & (N < 10000) & (N % 1000 == 0)) | (N==0)):
                 plot_training_signal(config, dataset, model, adjacency, log_dir, epoch, N, index_particles, n_particles, n_particle_types, device)
+                timer.lap('plot')
+
+            timer.step(dataset.num_nodes, dataset.num_edges)
 
         print("Epoch {}. Loss: {:.6f}".format(epoch, total_loss / (N + 1) / n_particles / batch_size))
         logger.info("Epoch {}. Loss: {:.6f}".format(epoch, total_loss / (N + 1) / n_particles / batch_size))
-        torch.save({'model_state_dict': model.state_dict(),
-                    'optimizer_state_dict': optimizer.state_dict()},
-                   os.path.join(log_dir, 'models', f'best_model_with_{n_runs - 1}_graphs_{epoch}.pt'))
         list_loss.append(total_loss / (N + 1) / n_particles / batch_size)
         torch.save(list_loss, os.path.join(log_dir, 'loss.pt'))
+        checkpoints.save({os.path.join(log_dir, 'models', f'best_model_with_{n_runs - 1}_graphs_{epoch}.pt'):
+                          {'model_state_dict': model.state_dict(), 'optimizer_state_dict': optimizer.state_dict()}},
+                         step=epoch, loss=list_loss[-1])
+        timer.lap('checkpoint')
 
         # matplotlib.use("Qt5Agg")
         fig = plt.figure(figsize=(22, 4))
@@ -2460,7 +2700,7 @@ def data_train_signal(config, config_file, device):
 
         ax = fig.add_subplot(1, 6, 3)
         gt_weight = to_numpy(adjacency[adj_t])
-        pred_weight = to_numpy(model.weight_ij[adj_t])
+        pred_weight = to_numpy(model.edge_weights(adj_t.nonzero().t()))
         plt.scatter(gt_weight, pred_weight, s=0.1,c='k')
         plt.xlabel('gt weight', fontsize=12)
         plt.ylabel('predicted weight', fontsize=12)
@@ -2469,6 +2709,12 @@ def data_train_signal(config, config_file, device):
         plt.savefig(f"./{log_dir}/tmp_training/Fig_{dataset_name}_{epoch}.tif")
         plt.close()
 
+        timer.lap('plot')
+        timer.epoch_end(epoch)
+
+    checkpoints.close()
+    timer.close()
+
 
 def data_test(config=None, config_file=None, visualize=False, style='color frame', verbose=True, best_model=20, step=15, ratio=1, run=1, test_simulation=False, sample_embedding = False, device=[]):
     print('')
@@ -2497,6 +2743,7 @@ def data_test(config=None, config_file=None, visualize=False, style='color frame
     has_siren = 'siren' in model_config.field_type
     has_siren_time = 'siren_with_time' in model_config.field_type
     has_field = ('PDE_ParticleField' in config.graph_model.particle_model_name)
+    has_division = simulation_config.has_cell_division
 
     print(f'Test data ... {model_config.particle_model_name} {model_config.mesh_model_name}')
 
@@ -2596,9 +2843,9 @@ def data_test(config=None, config_file=None, visualize=False, style='color frame
         y_mesh_list = []
         time.sleep(0.5)
         for run in trange(n_runs):
-            x_mesh = torch.load(f'graphs_data/graphs_{dataset_name}/x_mesh_list_{run}.pt', map_location=device)
+            x_mesh = load_trajectory(f'graphs_data/graphs_{dataset_name}/x_mesh_list_{run}', device)
             x_mesh_list.append(x_mesh)
-            h = torch.load(f'graphs_data/graphs_{dataset_name}/y_mesh_list_{run}.pt', map_location=device)
+            h = load_trajectory(f'graphs_data/graphs_{dataset_name}/y_mesh_list_{run}', device)
             y_mesh_list.append(h)
         h = y_mesh_list[0][0].clone().detach()
         x_list = x_mesh_list
@@ -2608,11 +2855,11 @@ def data_test(config=None, config_file=None, visualize=False, style='color frame
         x_list = []
         y_list = []
         x_mesh_list = []
-        x_mesh = torch.load(f'graphs_data/graphs_{dataset_name}/x_mesh_list_{run}.pt', map_location=device)
+        x_mesh = load_trajectory(f'graphs_data/graphs_{dataset_name}/x_mesh_list_{run}', device)
         x_mesh_list.append(x_mesh)
         hnorm = torch.load(f'./log/try_{config_file}/hnorm.pt', map_location=device).to(device)
-        x_list.append(torch.load(f'graphs_data/graphs_{dataset_name}/x_list_{run}.pt', map_location=device))
-        y_list.append(torch.load(f'graphs_data/graphs_{dataset_name}/y_list_{run}.pt', map_location=device))
+        x_list.append(load_trajectory(f'graphs_data/graphs_{dataset_name}/x_list_{run}', device))
+        y_list.append(load_trajectory(f'graphs_data/graphs_{dataset_name}/y_list_{run}', device))
         ynorm = torch.load(f'./log/try_{config_file}/ynorm.pt', map_location=device).to(device)
         vnorm = torch.load(f'./log/try_{config_file}/vnorm.pt', map_location=device).to(device)
         x = x_list[0][0].clone().detach()
@@ -2627,8 +2874,8 @@ def data_test(config=None, config_file=None, visualize=False, style='color frame
     else:
         x_list = []
         y_list = []
-        x_list.append(torch.load(f'graphs_data/graphs_{dataset_name}/x_list_{run}.pt', map_location=device))
-        y_list.append(torch.load(f'graphs_data/graphs_{dataset_name}/y_list_{run}.pt', map_location=device))
+        x_list.append(load_trajectory(f'graphs_data/graphs_{dataset_name}/x_list_{run}', device))
+        y_list.append(load_trajectory(f'graphs_data/graphs_{dataset_name}/y_list_{run}', device))
         ynorm = torch.load(f'./log/try_{config_file}/ynorm.pt', map_location=device).to(device)
         vnorm = torch.load(f'./log/try_{config_file}/vnorm.pt', map_location=device).to(device)
         x = x_list[0][0].clone().detach()
@@ -2675,6 +2922,8 @@ def data_test(config=None, config_file=None, visualize=False, style='color frame
         mask_mesh = mesh_data['mask']
         edge_index_mesh = mesh_data['edge_index']
         edge_weight_mesh = mesh_data['edge_weight']
+        if simulation_config.sparse_laplacian:
+            laplacian_mesh = mesh_laplacian(edge_index_mesh, edge_weight_mesh, len(mesh_data['mesh_pos']))
 
         xy = to_numpy(mesh_data['mesh_pos'])
         x_ = xy[:, 0]
@@ -2693,6 +2942,13 @@ def data_test(config=None, config_file=None, visualize=False, style='color frame
         edge_attr_adjacency = adjacency[adj_t]
 
     rmserr_list= []
+    if simulation_config.neighbor_skin > 0:
+        verlet_list = VerletList(min_radius, max_radius, simulation_config.neighbor_skin, simulation_config.boundary, simulation_config.neighbor_method)
+
+    renderer = AsyncRenderer(config.plotting.n_render_workers)
+    timer = StageTimer(log_dir, 'rollout', training_config.profile, training_config.profiler_iterations,
+                       training_config.profiler_start, device)
+
     time.sleep(1)
     for it in trange(n_frames+1):
 
@@ -2708,10 +2964,13 @@ def data_test(config=None, config_file=None, visualize=False, style='color frame
         else:
             rmserr = torch.sqrt(torch.mean(torch.sum(bc_dpos(x[:, 1:3] - x0[:, 1:3]) ** 2, axis=1)))
         rmserr_list.append(rmserr.item())
+        timer.lap('rmse')
 
         if has_mesh:
             x[:, 1:5] = x0[:, 1:5].clone().detach()
             dataset_mesh = data.Data(x=x, edge_index=edge_index_mesh, edge_attr=edge_weight_mesh, device=device)
+            if simulation_config.sparse_laplacian:
+                dataset_mesh.laplacian = laplacian_mesh
 
         if model_config.mesh_model_name == 'DiffMesh':
             with torch.no_grad():
@@ -2753,14 +3012,13 @@ def data_test(config=None, config_file=None, visualize=False, style='color frame
                     x_mesh[:, 6:7] = model_f(time=it / n_frames) ** 2
             x_particle_field = torch.concatenate((x_mesh, x), dim=0)
 
-            distance = torch.sum(bc_dpos(x[:, None, 1:dimension+1] - x[None, :, 1:dimension+1]) ** 2, dim=2)
-            adj_t = ((distance < max_radius ** 2) & (distance > min_radius ** 2)).float() * 1
-            edge_index = adj_t.nonzero().t().contiguous()
+            if simulation_config.neighbor_skin > 0:
+                edge_index = verlet_list(x[:, 1:dimension + 1])
+            else:
+                edge_index = radius_graph(x[:, 1:dimension + 1], min_radius, max_radius, simulation_config.boundary, simulation_config.neighbor_method)
             dataset_p_p = data.Data(x=x, pos=x[:, 1:3], edge_index=edge_index, field=[])
 
-            distance = torch.sum(bc_dpos(x_particle_field[:, None, 1:dimension+1] - x_particle_field[None, :, 1:dimension+1]) ** 2, dim=2)
-            adj_t = ((distance < (max_radius/2) ** 2) & (distance > min_radius ** 2)).float() * 1
-            edge_index = adj_t.nonzero().t().contiguous()
+            edge_index = radius_graph(x_particle_field[:, 1:dimension + 1], min_radius, max_radius/2, simulation_config.boundary, simulation_config.neighbor_method)
             pos = torch.argwhere((edge_index[1,:]>=n_nodes) & (edge_index[0,:]<n_nodes))
             pos = to_numpy(pos[:,0])
             edge_index = edge_index[:,pos]
@@ -2794,9 +3052,10 @@ def data_test(config=None, config_file=None, visualize=False, style='color frame
                     with torch.no_grad():
                         y = model(dataset, data_id=1)
             else:
-                distance = torch.sum(bc_dpos(x[:, None, 1:dimension + 1] - x[None, :, 1:dimension + 1]) ** 2, dim=2)
-                adj_t = ((distance < max_radius ** 2) & (distance > min_radius ** 2)).float() * 1
-                edge_index = adj_t.nonzero().t().contiguous()
+                if simulation_config.neighbor_skin > 0:
+                    edge_index = verlet_list(x[:, 1:dimension + 1])
+                else:
+                    edge_index = radius_graph(x[:, 1:dimension + 1], min_radius, max_radius, simulation_config.boundary, simulation_config.neighbor_method)
                 dataset = data.Data(x=x, pos=x[:, 1:3], edge_index=edge_index)
                 if test_simulation:
                     y = y0 / ynorm
@@ -2825,124 +3084,23 @@ def data_test(config=None, config_file=None, visualize=False, style='color frame
 
             x[:, 1:3] = bc_pos(x[:, 1:3] + x[:, 3:5] * delta_t)  # position update
 
-
-        A1 = A1 + delta_t
+        timer.lap('model')
 
         if (it % step == 0) & (it >= 0) & visualize:
-            # print(f'RMSE = {np.round(rmserr.item(), 4)}')
-
-            # plt.style.use('dark_background')
-
-            # matplotlib.use("Qt5Agg")
-            matplotlib.rcParams['savefig.pad_inches'] = 0
 
+            # the final figures below are drawn in this process with the same style
             if 'latex' in style:
                 plt.rcParams['text.usetex'] = True
                 rc('font', **{'family': 'serif', 'serif': ['Palatino']})
 
-            fig = plt.figure(figsize=(12, 12))
-            ax = fig.add_subplot(1, 1, 1)
-            ax.xaxis.set_major_locator(plt.MaxNLocator(3))
-            ax.yaxis.set_major_locator(plt.MaxNLocator(3))
-            ax.xaxis.set_major_formatter(FormatStrFormatter('%.1f'))
-            ax.yaxis.set_major_formatter(FormatStrFormatter('%.1f'))
-            if has_mesh:
-                pts = x[:, 1:3].detach().cpu().numpy()
-                tri = Delaunay(pts)
-                colors = torch.sum(x[tri.simplices, 6], dim=1) / 3.0
-                if model_config.mesh_model_name == 'DiffMesh':
-                    plt.tripcolor(pts[:, 0], pts[:, 1], tri.simplices.copy(),
-                                  facecolors=colors.detach().cpu().numpy(), vmin=0, vmax=1000)
-                if model_config.mesh_model_name == 'WaveMesh':
-                    plt.tripcolor(pts[:, 0], pts[:, 1], tri.simplices.copy(),
-                                  facecolors=colors.detach().cpu().numpy(), vmin=-1000, vmax=1000)
-                    fmt = lambda x, pos: '{:.1f}'.format((x) / 100, pos)
-                    ax.yaxis.set_major_formatter(mpl.ticker.FuncFormatter(fmt))
-                    ax.xaxis.set_major_formatter(mpl.ticker.FuncFormatter(fmt))
-                if model_config.mesh_model_name == 'RD_Gray_Scott_Mesh':
-                    fig = plt.figure(figsize=(12, 6))
-                    ax = fig.add_subplot(1, 2, 1)
-                    colors = torch.sum(x[tri.simplices, 6], dim=1) / 3.0
-                    plt.tripcolor(pts[:, 0], pts[:, 1], tri.simplices.copy(),
-                                  facecolors=colors.detach().cpu().numpy(), vmin=0, vmax=1)
-                    plt.xticks([])
-                    plt.yticks([])
-                    plt.axis('off')
-                    ax = fig.add_subplot(1, 2, 2)
-                    colors = torch.sum(x[tri.simplices, 7], dim=1) / 3.0
-                    plt.tripcolor(pts[:, 0], pts[:, 1], tri.simplices.copy(),
-                                  facecolors=colors.detach().cpu().numpy(), vmin=0, vmax=1)
-                    plt.xticks([])
-                    plt.yticks([])
-                    plt.axis('off')
-                if (model_config.mesh_model_name == 'RD_RPS_Mesh') | (model_config.mesh_model_name=='RD_RPS_Mesh_bis'):
-                    H1_IM = torch.reshape(x[:, 6:9], (100, 100, 3))
-                    plt.imshow(H1_IM.detach().cpu().numpy(), vmin=0, vmax=1)
-                    fmt = lambda x, pos: '{:.1f}'.format((x) / 100, pos)
-                    ax.yaxis.set_major_formatter(mpl.ticker.FuncFormatter(fmt))
-                    ax.xaxis.set_major_formatter(mpl.ticker.FuncFormatter(fmt))
-                    # plt.xticks([])
-                    # plt.yticks([])
-                    # plt.axis('off')
-            elif model_config.signal_model_name == 'PDE_N':
-
-                matplotlib.rcParams['savefig.pad_inches'] = 0
-                fig = plt.figure(figsize=(12, 12))
-                ax = fig.add_subplot(1, 1, 1)
-                ax.xaxis.set_major_locator(plt.MaxNLocator(3))
-                ax.yaxis.set_major_locator(plt.MaxNLocator(3))
-                ax.xaxis.set_major_formatter(FormatStrFormatter('%.1f'))
-                ax.yaxis.set_major_formatter(FormatStrFormatter('%.1f'))
-                plt.scatter(to_numpy(x[:, 1]), to_numpy(x[:, 2]), s=200, c=to_numpy(x[:, 6]), cmap='cool', vmin=0,
-                            vmax=3)
-                plt.xlim([-1.5, 1.5])
-                plt.ylim([-1.5, 1.5])
-                # plt.xlabel('x', fontsize=32)
-                # plt.ylabel('y', fontsize=32)
-                plt.xticks(fontsize=32.0)
-                plt.yticks(fontsize=32.0)
-                ax.tick_params(axis='both', which='major', pad=15)
-                plt.text(0, 1.1, f'   ', ha='left', va='top', transform=ax.transAxes, fontsize=32)
-                plt.tight_layout()
-            else:
-                s_p = 100
-                if simulation_config.has_cell_division:
-                    s_p = 25
-                for n in range(n_particle_types):
-                    if has_field:
-                        plt.scatter(x[index_particles[n], 1].detach().cpu().numpy(),
-                                    1-x[index_particles[n], 2].detach().cpu().numpy(), s=s_p, color=cmap.color(n))
-                    else:
-                        plt.scatter(x[index_particles[n], 1].detach().cpu().numpy(),
-                                    x[index_particles[n], 2].detach().cpu().numpy(), s=s_p, color=cmap.color(n))
-            if 'latex' in style:
-                plt.xlabel(r'$x$', fontsize=64)
-                plt.ylabel(r'$y$', fontsize=64)
-                plt.xticks(fontsize=32.0)
-                plt.yticks(fontsize=32.0)
-            elif 'frame' in style:
-                plt.xlabel('x', fontsize=32)
-                plt.ylabel('y', fontsize=32)
-                plt.xticks(fontsize=32.0)
-                plt.yticks(fontsize=32.0)
-                plt.text(0, 1.1, f'   ', ha='left', va='top', transform=ax.transAxes, fontsize=32)
-                ax.tick_params(axis='both', which='major', pad=15)
-                # cbar = plt.colorbar(shrink=0.5)
-                # cbar.ax.tick_params(labelsize=32)
-            else:
-                plt.xticks([])
-                plt.yticks([])
-            if not(('RD_RPS_Mesh' in model_config.mesh_model_name)|(model_config.signal_model_name == 'PDE_N')):
-                plt.xlim([0, 1])
-                plt.ylim([0, 1])
-            if 'PDE_G' in model_config.particle_model_name:
-                plt.xlim([-2, 2])
-                plt.ylim([-2, 2])
-
-            plt.tight_layout()
-            plt.savefig(f"./{log_dir}/tmp_recons/Fig_{config_file}_{it}.tif", dpi=170.7)
-            # plt.savefig(f"./{log_dir}/tmp_recons/Fig_{config_file}_{10000+it}.tif", dpi=42.675)
-            plt.close()
+            s_p = 100
+            if simulation_config.has_cell_division:
+                s_p = 25
+            renderer.submit(plot_test_frame, f"./{log_dir}/tmp_recons/Fig_{config_file}_{it}.tif", style,
+                            model_config.particle_model_name, model_config.mesh_model_name,
+                            model_config.signal_model_name, to_numpy(x), index_particles,
+                            [cmap.color(n) for n in range(n_particle_types)], s_p=s_p, has_mesh=has_mesh,
+                            has_field=has_field)
 
             if has_ghost:
 
@@ -3020,6 +3178,12 @@ def data_test(config=None, config_file=None, visualize=False, style='color frame
                 plt.savefig(f"./{log_dir}/tmp_recons/Ghost3_{config_file}_{it}.tif", dpi=170.7)
                 plt.close()
 
+        timer.lap('plot')
+        timer.step(x.shape[0], edge_index_mesh.shape[1] if has_mesh else edge_index.shape[1])
+
+    timer.close()
+    renderer.close()
+
     print(f'RMSE = {np.round(np.mean(rmserr_list), 6)} +/- {np.round(np.std(rmserr_list), 6)}')
 
     # plt.rcParams['text.usetex'] = True
@@ -3105,4 +3269,6 @@ def data_test(config=None, config_file=None, visualize=False, style='color frame
         plt.xlabel(r'$x$', fontsize=64)
         plt.ylabel(r'$y$', fontsize=64)
         plt.tight_layout()
-        plt.savefig(f"./{log_dir}/GT_{config_file}_{it+2}.tif", dpi=170.7)
\ No newline at end of file
+        plt.savefig(f"./{log_dir}/GT_{config_file}_{it+2}.tif", dpi=170.7)
+
+    return rmserr_list
@@ -32,7 +32,7 @@ def plot_training_signal(config, dataset, model, adjacency, log_dir, epoch, N, i
     x = dataset.x
     adj_t = adjacency > 0
     edge_index = adj_t.nonzero().t().contiguous()
-    edge_attr_adjacency = model.A[adj_t]
+    edge_attr_adjacency = model.edge_weights(edge_index)
     dataset = data.Data(x=x, pos=x[:, 1:3], edge_index=edge_index, edge_attr=edge_attr_adjacency)
     vis = to_networkx(dataset, remove_self_loops=True, to_undirected=True)
     pos = nx.spring_layout(vis, weight='weight', seed=42, k=1)
@@ -564,6 +564,58 @@ def plot_training_cell(config, dataset_name, log_dir, epoch, N, model, index_par
             plt.savefig(f"./{log_dir}/tmp_training/function/{dataset_name}_{epoch}_{N}.tif", dpi=87)
             plt.close()
 
+def edge_function_features(model_name, rr, embedding_, max_radius, embedding_j=None):
+    # inputs of lin_edge for the distances rr and the embeddings embedding_, same number of rows
+    # embedding_j is the embedding of the other end of the edge for the two-embedding models, embedding_ if None
+    if embedding_j is None:
+        embedding_j = embedding_
+    r = torch.abs(rr[:, None]) / max_radius
+    match model_name:
+        case 'PDE_A' | 'PDE_ParticleField_A':
+            in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None], r, embedding_), dim=1)
+        case 'PDE_A_bis' | 'PDE_E':
+            in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None], r, embedding_, embedding_j), dim=1)
+        case 'PDE_B' | 'PDE_B_bis' | 'PDE_ParticleField_B' | 'PDE_G':
+            in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None], r, 0 * rr[:, None], 0 * rr[:, None],
+                                     0 * rr[:, None], 0 * rr[:, None], embedding_), dim=1)
+        case 'PDE_GS':
+            in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None], r, 10**embedding_), dim=1)
+        case 'PDE_N':
+            in_features = torch.cat((rr[:, None], embedding_), dim=1)
+        case _:
+            raise ValueError(f'Unknown particle model {model_name}')
+    return in_features
+
+def edge_pair_function_features(model_name, rr, embedding_pair, max_radius):
+    # same as edge_function_features with the embeddings of both ends of each edge side by side in embedding_pair
+    embedding_, embedding_j = torch.chunk(embedding_pair, 2, dim=1)
+    return edge_function_features(model_name, rr, embedding_, max_radius, embedding_j=embedding_j)
+
+def evaluate_edge_function(model_lin_edge, in_features_fn, rr, embedding, max_rows=2**20):
+    """
+    Evaluate the learned interaction function of every particle on the distances rr, in batched calls of
+    model_lin_edge of at most max_rows rows.
+
+    Args:
+        in_features_fn (callable): (rr, embedding_) -> inputs of model_lin_edge, rr and embedding_ with the same number of rows.
+        rr (tensor): (n_points,) distances.
+        embedding (tensor): (n_particles, ...) one row per curve.
+
+    Returns:
+        tensor: (n_particles, n_points) first output of model_lin_edge.
+    """
+    n_points = rr.shape[0]
+    chunk_size = max(max_rows // n_points, 1)
+    func_list = []
+    with torch.no_grad():
+        for k in range(0, embedding.shape[0], chunk_size):
+            embedding_ = embedding[k:k + chunk_size]
+            rr_ = rr.repeat(embedding_.shape[0])
+            embedding_ = embedding_.repeat_interleave(n_points, dim=0)
+            func = model_lin_edge(in_features_fn(rr_, embedding_).float())
+            func_list.append(func[:, 0].reshape(-1, n_points))
+    return torch.cat(func_list)
+
 def analyze_edge_function_tracking(rr=[], vizualize=False, config=None, model_lin_edge=[], model_a=None, n_particles=None, ynorm=None, indexes=None, type_list=None, cmap=None, dimension=2, embedding_type=0, device=None):
 
 
@@ -581,60 +633,25 @@ def analyze_edge_function_tracking(rr=[], vizualize=False, config=None, model_li
         else:
             rr = torch.tensor(np.linspace(0, max_radius, 1000)).to(device)
 
+    if config.graph_model.particle_model_name != '':
+        config_model = config.graph_model.particle_model_name
+    elif config.graph_model.signal_model_name != '':
+        config_model = config.graph_model.signal_model_name
+    elif config.graph_model.mesh_model_name != '':
+        config_model = config.graph_model.mesh_model_name
+
     if embedding_type == 1:
         n_list = indexes
     else:
         n_list = range(n_particles)
-
-    func_list = []
-    for n, k  in enumerate(n_list):
-        embedding_ = model_a[int(k), :] * torch.ones((1000, config.graph_model.embedding_dim), device=device)
-        if config.graph_model.particle_model_name != '':
-            config_model = config.graph_model.particle_model_name
-        elif config.graph_model.signal_model_name != '':
-            config_model = config.graph_model.signal_model_name
-        elif config.graph_model.mesh_model_name != '':
-            config_model = config.graph_model.mesh_model_name
-
-        match config_model:
-            case 'PDE_A':
-                in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None],
-                                         rr[:, None] / max_radius, embedding_), dim=1)
-            case 'PDE_ParticleField_A':
-                in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None],
-                                         rr[:, None] / max_radius, embedding_), dim=1)
-            case 'PDE_A_bis':
-                in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None],
-                                         rr[:, None] / max_radius, embedding_, embedding_), dim=1)
-            case 'PDE_B':
-                in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None],
-                                         rr[:, None] / max_radius, 0 * rr[:, None], 0 * rr[:, None],
-                                         0 * rr[:, None], 0 * rr[:, None], embedding_), dim=1)
-            case 'PDE_ParticleField_B':
-                in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None],
-                                         rr[:, None] / max_radius, 0 * rr[:, None], 0 * rr[:, None],
-                                         0 * rr[:, None], 0 * rr[:, None], embedding_), dim=1)
-            case 'PDE_GS':
-                in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None], rr[:, None] / max_radius, 10**embedding_), dim=1)
-            case 'PDE_G':
-                in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None],
-                                         rr[:, None] / max_radius, 0 * rr[:, None],
-                                         0 * rr[:, None],
-                                         0 * rr[:, None], 0 * rr[:, None], embedding_), dim=1)
-            case 'PDE_E':
-                in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None],
-                                         rr[:, None] / max_radius, embedding_, embedding_), dim=1)
-            case 'PDE_N':
-                in_features = torch.cat((rr[:, None], embedding_), dim=1)
-        with torch.no_grad():
-            func = model_lin_edge(in_features.float())
-        func = func[:, 0]
-        func_list.append(func)
-        if ((n % 5 == 0) | (config.graph_model.particle_model_name=='PDE_GS')) & vizualize:
-            plt.plot(to_numpy(rr),
-                     to_numpy(func) * to_numpy(ynorm),
-                     color=cmap.color(int(type_list[int(n)])), linewidth=2, alpha=0.25)
-    func_list = torch.stack(func_list)
+    embedding = model_a[[int(k) for k in n_list]]
+    func_list = evaluate_edge_function(model_lin_edge, lambda rr_, embedding_: edge_function_features(config_model, rr_, embedding_, max_radius), rr, embedding)
+    if vizualize:
+        for n in range(func_list.shape[0]):
+            if (n % 5 == 0) | (config.graph_model.particle_model_name=='PDE_GS'):
+                plt.plot(to_numpy(rr),
+                         to_numpy(func_list[n]) * to_numpy(ynorm),
+                         color=cmap.color(int(type_list[int(n)])), linewidth=2, alpha=0.25)
     coeff_norm = to_numpy(func_list)
 
     with warnings.catch_warnings():
@@ -679,58 +696,24 @@ def analyze_edge_function(rr=[], vizualize=False, config=None, model_lin_edge=[]
         else:
             rr = torch.tensor(np.linspace(0, max_radius, 1000)).to(device)
 
-    func_list = []
-    for n in range(n_particles):
-        if config.training.has_no_tracking:
-            embedding_ = model_a[n, :] * torch.ones((1000, config.graph_model.embedding_dim), device=device)
-        else:
-            embedding_ = model_a[dataset_number, n_nodes+n, :] * torch.ones((1000, config.graph_model.embedding_dim), device=device)
-        if config.graph_model.particle_model_name != '':
-            config_model = config.graph_model.particle_model_name
-        elif config.graph_model.signal_model_name != '':
-            config_model = config.graph_model.signal_model_name
-        elif config.graph_model.mesh_model_name != '':
-            config_model = config.graph_model.mesh_model_name
-
-        match config_model:
-            case 'PDE_A':
-                in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None],
-                                         rr[:, None] / max_radius, embedding_), dim=1)
-            case 'PDE_ParticleField_A':
-                in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None],
-                                         rr[:, None] / max_radius, embedding_), dim=1)
-            case 'PDE_A_bis':
-                in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None],
-                                         rr[:, None] / max_radius, embedding_, embedding_), dim=1)
-            case 'PDE_B':
-                in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None],
-                                         rr[:, None] / max_radius, 0 * rr[:, None], 0 * rr[:, None],
-                                         0 * rr[:, None], 0 * rr[:, None], embedding_), dim=1)
-            case 'PDE_ParticleField_B':
-                in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None],
-                                         rr[:, None] / max_radius, 0 * rr[:, None], 0 * rr[:, None],
-                                         0 * rr[:, None], 0 * rr[:, None], embedding_), dim=1)
-            case 'PDE_GS':
-                in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None], rr[:, None] / max_radius, 10**embedding_), dim=1)
-            case 'PDE_G':
-                in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None],
-                                         rr[:, None] / max_radius, 0 * rr[:, None],
-                                         0 * rr[:, None],
-                                         0 * rr[:, None], 0 * rr[:, None], embedding_), dim=1)
-            case 'PDE_E':
-                in_features = torch.cat((rr[:, None] / max_radius, 0 * rr[:, None],
-                                         rr[:, None] / max_radius, embedding_, embedding_), dim=1)
-            case 'PDE_N':
-                in_features = torch.cat((rr[:, None], embedding_), dim=1)
-        with torch.no_grad():
-            func = model_lin_edge(in_features.float())
-        func = func[:, 0]
-        func_list.append(func)
-        if ((n % 5 == 0) | (config.graph_model.particle_model_name=='PDE_GS')) & vizualize:
-            plt.plot(to_numpy(rr),
-                     to_numpy(func) * to_numpy(ynorm),
-                     color=cmap.color(types[n].astype(int)), linewidth=2, alpha=0.25)
-    func_list = torch.stack(func_list)
+    if config.graph_model.particle_model_name != '':
+        config_model = config.graph_model.particle_model_name
+    elif config.graph_model.signal_model_name != '':
+        config_model = config.graph_model.signal_model_name
+    elif config.graph_model.mesh_model_name != '':
+        config_model = config.graph_model.mesh_model_name
+
+    if config.training.has_no_tracking:
+        embedding = model_a[0:n_particles]
+    else:
+        embedding = model_a[dataset_number, n_nodes:n_nodes + n_particles]
+    func_list = evaluate_edge_function(model_lin_edge, lambda rr_, embedding_: edge_function_features(config_model, rr_, embedding_, max_radius), rr, embedding)
+    if vizualize:
+        for n in range(func_list.shape[0]):
+            if (n % 5 == 0) | (config.graph_model.particle_model_name=='PDE_GS'):
+                plt.plot(to_numpy(rr),
+                         to_numpy(func_list[n]) * to_numpy(ynorm),
+                         color=cmap.color(types[n].astype(int)), linewidth=2, alpha=0.25)
     coeff_norm = to_numpy(func_list)
 
     with warnings.catch_warnings():
@@ -0,0 +1,236 @@
+"""
+Radius-graph construction for particle systems.
+
+All backends return the same `edge_index` as the historical dense construction
+`torch.sum(bc_dpos(x[:, None] - x[None, :]) ** 2, dim=2)` followed by `adj_t.nonzero()`:
+pairs (i, j) with min_radius**2 < |bc_dpos(x_i - x_j)|**2 < max_radius**2, sorted by i then j.
+The cell-list and KD-tree backends only evaluate candidate pairs from neighbouring cells,
+so memory and time scale with the number of edges instead of N**2.
+
+nearest_neighbor matches every particle to the closest point of another set (the tracking loss),
+with the same backends.
+"""
+import itertools
+
+import numpy as np
+import torch
+from scipy.spatial import cKDTree
+
+from ParticleGraph.utils import choose_boundary_values
+
+# relative slack on the search radius, candidates are filtered with the exact distance afterwards
+RADIUS_SLACK = 1E-4
+
+
+def radius_graph(pos, min_radius, max_radius, boundary='periodic', method='dense'):
+    """
+    Build the edge_index of all pairs whose distance lies in (min_radius, max_radius). With min_radius < 0 all the
+    pairs of distinct particles closer than max_radius are kept, including the coincident ones.
+
+    Args:
+        pos (torch.Tensor): particle positions, shape (n_particles, dimension).
+        min_radius (float): pairs closer than min_radius are discarded.
+        max_radius (float): pairs further than max_radius are discarded.
+        boundary (str): 'periodic', 'periodic_special' or 'no', see choose_boundary_values.
+        method (str): 'dense', 'cell_list' or 'kd_tree'.
+
+    Returns:
+        torch.Tensor: edge_index of shape (2, n_edges) on the device of pos.
+    """
+    match method:
+        case 'dense':
+            return radius_graph_dense(pos, min_radius, max_radius, boundary)
+        case 'cell_list':
+            return radius_graph_cell_list(pos, min_radius, max_radius, boundary)
+        case 'kd_tree':
+            return radius_graph_kd_tree(pos, min_radius, max_radius, boundary)
+        case _:
+            raise ValueError(f'Unknown neighbor search method {method}')
+
+
+def radius_graph_dense(pos, min_radius, max_radius, boundary='periodic'):
+    _, bc_dpos = choose_boundary_values(boundary)
+    distance = torch.sum(bc_dpos(pos[:, None, :] - pos[None, :, :]) ** 2, dim=2)
+    if min_radius < 0:
+        adj_t = (distance < max_radius ** 2) & ~torch.eye(len(pos), dtype=torch.bool, device=pos.device)
+    else:
+        adj_t = (distance < max_radius ** 2) & (distance > min_radius ** 2)
+    return adj_t.float().nonzero().t().contiguous()
+
+
+def radius_graph_cell_list(pos, min_radius, max_radius, boundary='periodic'):
+    _, bc_dpos = choose_boundary_values(boundary)
+    n_particles, dimension = pos.shape
+    device = pos.device
+    cell_size = max_radius * (1 + RADIUS_SLACK)
+
+    with torch.no_grad():
+        if boundary == 'no':
+            origin = torch.min(pos, dim=0).values
+            extent = torch.max(pos, dim=0).values - origin
+            n_cells = [int(e) + 1 for e in (extent / cell_size).floor().tolist()]
+            cell = torch.floor((pos - origin) / cell_size).long()
+        else:
+            n = int(1 / cell_size)
+            if n < 3:
+                # neighbouring cells would wrap onto each other, the box holds only a few cells anyway
+                return radius_graph_dense(pos, min_radius, max_radius, boundary)
+            n_cells = [n] * dimension
+            cell = torch.floor(torch.remainder(pos, 1.0) * n).long()
+        n_cells_ = torch.tensor(n_cells, device=device)
+        cell = torch.minimum(torch.clamp(cell, min=0), n_cells_ - 1)
+
+        strides = np.cumprod([1] + n_cells[:-1]).tolist()
+        if strides[-1] * n_cells[-1] > 2 ** 62:
+            return radius_graph_kd_tree(pos, min_radius, max_radius, boundary)
+        strides = torch.tensor(strides, device=device)
+
+        cell_id = torch.sum(cell * strides, dim=1)
+        cell_id_sorted, order = torch.sort(cell_id)
+        particle_index = torch.arange(n_particles, device=device)
+
+        sources = []
+        targets = []
+        for offset in itertools.product((-1, 0, 1), repeat=dimension):
+            neighbor_cell = cell + torch.tensor(offset, device=device)
+            if boundary == 'no':
+                valid = torch.all((neighbor_cell >= 0) & (neighbor_cell < n_cells_), dim=1)
+            else:
+                neighbor_cell = torch.remainder(neighbor_cell, n_cells_)
+                valid = torch.ones(n_particles, dtype=torch.bool, device=device)
+            neighbor_id = torch.sum(neighbor_cell * strides, dim=1)
+            start = torch.searchsorted(cell_id_sorted, neighbor_id, right=False)
+            end = torch.searchsorted(cell_id_sorted, neighbor_id, right=True)
+            count = (end - start) * valid
+            n_candidates = int(torch.sum(count))
+            if n_candidates == 0:
+                continue
+            first = torch.cumsum(count, dim=0) - count
+            rank = torch.arange(n_candidates, device=device) - torch.repeat_interleave(first, count)
+            sources.append(torch.repeat_interleave(particle_index, count))
+            targets.append(order[torch.repeat_interleave(start, count) + rank])
+
+    if len(sources) == 0:
+        return torch.zeros((2, 0), dtype=torch.long, device=device)
+
+    return _filter_pairs(pos, torch.cat(sources), torch.cat(targets), min_radius, max_radius, bc_dpos)
+
+
+def radius_graph_kd_tree(pos, min_radius, max_radius, boundary='periodic'):
+    _, bc_dpos = choose_boundary_values(boundary)
+    device = pos.device
+
+    points = pos.detach().cpu().numpy().astype(np.float64)
+    if boundary == 'no':
+        tree = cKDTree(points)
+    else:
+        points = np.mod(points, 1.0)
+        points[points >= 1.0] = 0.0
+        tree = cKDTree(points, boxsize=1.0)
+    pairs = tree.query_pairs(r=max_radius * (1 + RADIUS_SLACK), output_type='ndarray')
+    pairs = torch.as_tensor(pairs, dtype=torch.long, device=device)
+
+    sources = torch.cat((pairs[:, 0], pairs[:, 1]))
+    targets = torch.cat((pairs[:, 1], pairs[:, 0]))
+
+    return _filter_pairs(pos, sources, targets, min_radius, max_radius, bc_dpos)
+
+
+def nearest_neighbor(pos, targets, boundary='periodic', method='dense'):
+    """
+    Closest point of targets for every particle of pos.
+
+    The index is searched without gradient, the distance is then recomputed from pos so that it stays
+    differentiable with respect to pos, as with the dense `distance.min(dim=1)`.
+
+    Args:
+        pos (torch.Tensor): positions, shape (n_particles, dimension).
+        targets (torch.Tensor): positions searched, shape (n_targets, dimension).
+        boundary (str): 'periodic', 'periodic_special' or 'no', see choose_boundary_values.
+        method (str): 'dense', or 'cell_list' / 'kd_tree' for a KD-tree query.
+
+    Returns:
+        tuple: (squared distance, index), each of shape (n_particles,).
+    """
+    _, bc_dpos = choose_boundary_values(boundary)
+    match method:
+        case 'dense':
+            distance = torch.sum(bc_dpos(pos[:, None, :] - targets[None, :, :]) ** 2, dim=2)
+            result = distance.min(dim=1)
+            return result.values, result.indices
+        case 'cell_list' | 'kd_tree':
+            # the search radius is not bounded, a KD-tree handles it better than fixed cells
+            points = pos.detach().cpu().numpy().astype(np.float64)
+            target_points = targets.detach().cpu().numpy().astype(np.float64)
+            if boundary == 'no':
+                tree = cKDTree(target_points)
+            else:
+                points = np.mod(points, 1.0)
+                points[points >= 1.0] = 0.0
+                target_points = np.mod(target_points, 1.0)
+                target_points[target_points >= 1.0] = 0.0
+                tree = cKDTree(target_points, boxsize=1.0)
+            _, index = tree.query(points, k=1)
+            index = torch.as_tensor(index, dtype=torch.long, device=pos.device)
+            distance = torch.sum(bc_dpos(pos - targets[index]) ** 2, dim=1)
+            return distance, index
+        case _:
+            raise ValueError(f'Unknown neighbor search method {method}')
+
+
+class VerletList:
+    """
+    Radius graph with a skin, reused across simulation steps.
+
+    The candidate pairs are searched once within max_radius + skin and are filtered to the exact
+    radius at every call. The candidates are rebuilt when a particle has moved by more than skin / 2
+    since the last build, or when the number of particles changes.
+    """
+
+    def __init__(self, min_radius, max_radius, skin, boundary='periodic', method='cell_list'):
+        self.min_radius = min_radius
+        self.max_radius = max_radius
+        self.skin = skin
+        self.boundary = boundary
+        self.method = method
+        _, self.bc_dpos = choose_boundary_values(boundary)
+        self.pos_ref = None
+        self.candidates = None
+        self.n_builds = 0
+
+    def reset(self):
+        self.pos_ref = None
+        self.candidates = None
+
+    def needs_rebuild(self, pos):
+        if (self.candidates is None) or (pos.shape != self.pos_ref.shape):
+            return True
+        displacement = torch.sum(self.bc_dpos(pos - self.pos_ref) ** 2, dim=1)
+        return bool(torch.max(displacement) > (self.skin / 2) ** 2)
+
+    def __call__(self, pos):
+        with torch.no_grad():
+            if self.needs_rebuild(pos):
+                # no lower bound, coincident particles can separate before the next build
+                self.candidates = radius_graph(pos, -1, self.max_radius + self.skin, self.boundary, self.method)
+                self.pos_ref = pos.detach().clone()
+                self.n_builds += 1
+        # candidates are sorted by (i, j), masking keeps that order
+        return _filter_pairs(pos, self.candidates[0], self.candidates[1], self.min_radius, self.max_radius,
+                             self.bc_dpos, sort=False)
+
+
+def _filter_pairs(pos, sources, targets, min_radius, max_radius, bc_dpos, sort=True):
+    # same distance expression as the dense path, so that the boundary cases are decided identically
+    distance = torch.sum(bc_dpos(pos[sources] - pos[targets]) ** 2, dim=1)
+    if min_radius < 0:
+        keep = (distance < max_radius ** 2) & (sources != targets)
+    else:
+        keep = (distance < max_radius ** 2) & (distance > min_radius ** 2)
+    sources = sources[keep]
+    targets = targets[keep]
+    if sort:
+        order = torch.argsort(sources * len(pos) + targets)
+        sources = sources[order]
+        targets = targets[order]
+    return torch.stack((sources, targets)).contiguous()
@@ -0,0 +1,235 @@
+"""
+Normalization statistics of generated datasets, accumulated while the frames are produced.
+
+The generator feeds every saved frame to NormStats, which keeps the count, mean and sum of squared deviations
+of the particle velocities and of the targets (batched Welford update) and a log-binned quantile sketch of each
+column for the 1 / 99 percentiles. Memory does not depend on the number of frames. The statistics of a run are
+stored next to its trajectory as `norm_stats_{run}.npz`, and the statistics of several runs are merged exactly
+for the moments and by adding the bin counts for the sketches.
+"""
+import os
+
+import numpy as np
+import torch
+
+from ParticleGraph.utils import to_numpy
+
+
+class _Bins:
+    # dense histogram over consecutive integer keys, grown on demand
+
+    def __init__(self, offset=0, counts=None):
+        self.offset = offset
+        self.counts = np.zeros(0, dtype=np.int64) if counts is None else counts
+
+    def _extend(self, lo, hi):
+        if len(self.counts) == 0:
+            self.offset = lo
+            self.counts = np.zeros(hi - lo + 1, dtype=np.int64)
+            return
+        lo = min(lo, self.offset)
+        hi = max(hi, self.offset + len(self.counts) - 1)
+        counts = np.zeros(hi - lo + 1, dtype=np.int64)
+        counts[self.offset - lo:self.offset - lo + len(self.counts)] = self.counts
+        self.offset = lo
+        self.counts = counts
+
+    def add(self, keys):
+        if len(keys) == 0:
+            return
+        self._extend(int(keys.min()), int(keys.max()))
+        self.counts += np.bincount(keys - self.offset, minlength=len(self.counts))
+
+    def merge(self, other):
+        if len(other.counts) == 0:
+            return
+        self._extend(other.offset, other.offset + len(other.counts) - 1)
+        self.counts[other.offset - self.offset:other.offset - self.offset + len(other.counts)] += other.counts
+
+    def keys(self):
+        return self.offset + np.arange(len(self.counts))
+
+
+class QuantileSketch:
+    """
+    Streaming quantile estimate with a relative accuracy on the returned value (DDSketch).
+
+    A value v is counted in the bin ceil(log(|v|) / log(gamma)) of its sign, gamma = (1 + a) / (1 - a),
+    values smaller than min_value in magnitude are counted as zeros.
+    """
+
+    def __init__(self, relative_accuracy=0.01, min_value=1E-12):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = np.log(self.gamma)
+        self.positive = _Bins()
+        self.negative = _Bins()
+        self.zero_count = 0
+
+    @property
+    def count(self):
+        return int(self.positive.counts.sum() + self.negative.counts.sum() + self.zero_count)
+
+    def _key(self, values):
+        return np.ceil(np.log(values) / self.log_gamma).astype(np.int64)
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[np.isfinite(values)]
+        self.positive.add(self._key(values[values > self.min_value]))
+        self.negative.add(self._key(-values[values < -self.min_value]))
+        self.zero_count += int(np.sum(np.abs(values) <= self.min_value))
+
+    def merge(self, other):
+        self.positive.merge(other.positive)
+        self.negative.merge(other.negative)
+        self.zero_count += other.zero_count
+
+    def quantile(self, q):
+        if self.count == 0:
+            return np.nan
+        # bins in increasing order of value: large negatives first, zeros, then positives
+        negative_values = -2 * self.gamma ** self.negative.keys()[::-1] / (self.gamma + 1)
+        positive_values = 2 * self.gamma ** self.positive.keys() / (self.gamma + 1)
+        values = np.concatenate((negative_values, [0.], positive_values))
+        counts = np.concatenate((self.negative.counts[::-1], [self.zero_count], self.positive.counts))
+        rank = q * (self.count - 1)
+        return float(values[np.searchsorted(np.cumsum(counts), rank, side='right')])
+
+    def state_dict(self, prefix):
+        return {f'{prefix}positive_offset': self.positive.offset, f'{prefix}positive_counts': self.positive.counts,
+                f'{prefix}negative_offset': self.negative.offset, f'{prefix}negative_counts': self.negative.counts,
+                f'{prefix}zero_count': self.zero_count, f'{prefix}relative_accuracy': self.relative_accuracy,
+                f'{prefix}min_value': self.min_value}
+
+    @classmethod
+    def from_state_dict(cls, state, prefix):
+        sketch = cls(float(state[f'{prefix}relative_accuracy']), float(state[f'{prefix}min_value']))
+        sketch.positive = _Bins(int(state[f'{prefix}positive_offset']), np.array(state[f'{prefix}positive_counts']))
+        sketch.negative = _Bins(int(state[f'{prefix}negative_offset']), np.array(state[f'{prefix}negative_counts']))
+        sketch.zero_count = int(state[f'{prefix}zero_count'])
+        return sketch
+
+
+class RunningStats:
+    """
+    Per-column mean, standard deviation and quantiles of a stream of (n_rows, n_columns) arrays.
+    """
+
+    def __init__(self, n_columns, relative_accuracy=0.01):
+        self.n_columns = n_columns
+        self.count = 0
+        self.mean = np.zeros(n_columns)
+        self.m2 = np.zeros(n_columns)
+        self.sketches = [QuantileSketch(relative_accuracy) for _ in range(n_columns)]
+
+    def _merge_moments(self, count, mean, m2):
+        # Chan et al. update, Welford's update when count == 1
+        total = self.count + count
+        if total == 0:
+            return
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / total
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+    def update(self, values):
+        if torch.is_tensor(values):
+            values = to_numpy(values)
+        values = np.asarray(values, dtype=np.float64).reshape(-1, self.n_columns)
+        if len(values) == 0:
+            return
+        mean = values.mean(axis=0)
+        self._merge_moments(len(values), mean, np.sum((values - mean) ** 2, axis=0))
+        for column, sketch in enumerate(self.sketches):
+            sketch.add(values[:, column])
+
+    def merge(self, other):
+        self._merge_moments(other.count, other.mean, other.m2)
+        for sketch, other_sketch in zip(self.sketches, other.sketches):
+            sketch.merge(other_sketch)
+
+    @property
+    def std(self):
+        # unbiased, as torch.std
+        return np.sqrt(self.m2 / max(self.count - 1, 1))
+
+    def percentile(self, q):
+        return np.array([sketch.quantile(q / 100) for sketch in self.sketches])
+
+    def state_dict(self, prefix):
+        state = {f'{prefix}count': self.count, f'{prefix}mean': self.mean, f'{prefix}m2': self.m2}
+        for column, sketch in enumerate(self.sketches):
+            state.update(sketch.state_dict(f'{prefix}{column}_'))
+        return state
+
+    @classmethod
+    def from_state_dict(cls, state, prefix):
+        stats = cls(len(state[f'{prefix}mean']))
+        stats.count = int(state[f'{prefix}count'])
+        stats.mean = np.array(state[f'{prefix}mean'])
+        stats.m2 = np.array(state[f'{prefix}m2'])
+        stats.sketches = [QuantileSketch.from_state_dict(state, f'{prefix}{column}_') for column in range(stats.n_columns)]
+        return stats
+
+
+class NormStats:
+    """
+    Velocity and target statistics of a particle dataset, x columns 1 + dimension : 1 + 2 * dimension and
+    y columns 0 : dimension.
+    """
+
+    def __init__(self, dimension):
+        self.dimension = dimension
+        self.velocity = RunningStats(dimension)
+        self.acceleration = RunningStats(dimension)
+
+    def update(self, x, y):
+        y = y[:, 0:self.dimension]
+        if (self.acceleration.count == 0) & (y.shape[1] != self.acceleration.n_columns):
+            # signal datasets have a single target column
+            self.acceleration = RunningStats(y.shape[1])
+        self.velocity.update(x[:, 1 + self.dimension:1 + 2 * self.dimension])
+        self.acceleration.update(y)
+
+    def merge(self, other):
+        self.velocity.merge(other.velocity)
+        self.acceleration.merge(other.acceleration)
+
+    def norms(self, device):
+        # same values as norm_velocity and norm_acceleration
+        vnorm = torch.tensor([self.velocity.std[0]], dtype=torch.float32, device=device)
+        ynorm = torch.tensor([self.acceleration.std[0]], dtype=torch.float32, device=device)
+        return vnorm, ynorm
+
+    def save(self, path):
+        np.savez(path, dimension=self.dimension, **self.velocity.state_dict('velocity_'),
+                 **self.acceleration.state_dict('acceleration_'),
+                 velocity_std=self.velocity.std, velocity_p01=self.velocity.percentile(1),
+                 velocity_p99=self.velocity.percentile(99), acceleration_std=self.acceleration.std,
+                 acceleration_p01=self.acceleration.percentile(1), acceleration_p99=self.acceleration.percentile(99))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as state:
+            stats = cls(int(state['dimension']))
+            stats.velocity = RunningStats.from_state_dict(state, 'velocity_')
+            stats.acceleration = RunningStats.from_state_dict(state, 'acceleration_')
+        return stats
+
+
+def load_norms(path, runs, device):
+    """
+    Merge the stored statistics of the given runs of a dataset.
+
+    Returns:
+        tuple: (vnorm, ynorm), or None if a run was generated without statistics.
+    """
+    files = [f'{path}/norm_stats_{run}.npz' for run in runs]
+    if (len(files) == 0) | (not all(os.path.exists(f) for f in files)):
+        return None
+    stats = NormStats.load(files[0])
+    for f in files[1:]:
+        stats.merge(NormStats.load(f))
+    return stats.norms(device)
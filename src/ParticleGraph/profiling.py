@@ -0,0 +1,117 @@
+"""
+Opt-in timing of the stages of the training and generation loops.
+
+A loop creates a StageTimer and calls lap(stage) after each stage and step(n_particles, n_edges) at the end of
+each iteration. With training.profile = False (default) every call returns immediately.
+"""
+import csv
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import torch
+
+
+class StageTimer:
+    """
+    Per-iteration timings of the stages of a loop.
+
+    lap(stage) adds the time elapsed since the previous lap to the stage of the current iteration, step() closes the
+    iteration and computes the particles / edges per second. Laps after the last step of an epoch (epoch plots,
+    checkpoints) are recorded in a separate row by epoch_end(), which also logs the mean time of each stage.
+    Only the laps of the thread that created the timer are recorded, so with prefetching the batch construction
+    appears as the time waiting for the batch. On CUDA the device is synchronized before reading the clock.
+
+    The rows are written to {log_dir}/{name}_trace.csv and .json. With profiler_iterations > 0, torch.profiler
+    records the iterations profiler_start to profiler_start + profiler_iterations - 1 into the chrome trace
+    {log_dir}/{name}_profiler.json.
+    """
+
+    def __init__(self, log_dir, name='training', enabled=False, profiler_iterations=0, profiler_start=10,
+                 device=None, logger=None):
+        self.log_dir = log_dir
+        self.name = name
+        self.enabled = enabled
+        self.logger = logger
+        self.synchronize = enabled and str(device).startswith('cuda')
+        self.thread = threading.get_ident()
+        self.rows = []
+        self.stages = []
+        self.current = {}
+        self.epoch = 0
+        self.iteration = 0
+        self.epoch_start = 0
+        self.profiler = None
+        if enabled & (profiler_iterations > 0):
+            self.profiler = torch.profiler.profile(
+                schedule=torch.profiler.schedule(wait=profiler_start, warmup=0, active=profiler_iterations, repeat=1),
+                on_trace_ready=lambda p: p.export_chrome_trace(os.path.join(log_dir, f'{name}_profiler.json')),
+                record_shapes=True, profile_memory=True)
+            self.profiler.start()
+        self.t = self._clock()
+
+    def _clock(self):
+        if self.synchronize:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def lap(self, stage):
+        if (not self.enabled) or (threading.get_ident() != self.thread):
+            return
+        t = self._clock()
+        if stage not in self.stages:
+            self.stages.append(stage)
+        self.current[stage] = self.current.get(stage, 0) + t - self.t
+        self.t = t
+
+    def _row(self, iteration, n_particles, n_edges):
+        total = sum(self.current.values())
+        row = {'epoch': self.epoch, 'iteration': iteration, **self.current, 'total': total,
+               'n_particles': n_particles, 'n_edges': n_edges,
+               'particles_per_s': n_particles / total if total > 0 else 0,
+               'edges_per_s': n_edges / total if total > 0 else 0}
+        self.rows.append(row)
+        self.current = {}
+
+    def step(self, n_particles=0, n_edges=0):
+        if not self.enabled:
+            return
+        self._row(self.iteration, int(n_particles), int(n_edges))
+        self.iteration += 1
+        if self.profiler is not None:
+            self.profiler.step()
+
+    def epoch_end(self, epoch):
+        """
+        Record the laps since the last step as the row 'epoch' of the epoch and log the mean of each stage.
+        """
+        if not self.enabled:
+            return
+        if self.current:
+            self._row('epoch', 0, 0)
+        rows = [row for row in self.rows[self.epoch_start:] if row['iteration'] != 'epoch']
+        if (self.logger is not None) & (len(rows) > 0):
+            means = ', '.join(f'{stage} {np.mean([row.get(stage, 0) for row in rows]) * 1000:.2f} ms'
+                              for stage in self.stages)
+            self.logger.info(f'{self.name} timing epoch {epoch}, {len(rows)} iterations: {means}, '
+                             f'{np.mean([row["particles_per_s"] for row in rows]):.3e} particles/s, '
+                             f'{np.mean([row["edges_per_s"] for row in rows]):.3e} edges/s')
+        self.epoch = epoch + 1
+        self.epoch_start = len(self.rows)
+        self.t = self._clock()
+
+    def close(self):
+        if not self.enabled:
+            return
+        if self.profiler is not None:
+            self.profiler.stop()
+            self.profiler = None
+        columns = ['epoch', 'iteration'] + self.stages + ['total', 'n_particles', 'n_edges', 'particles_per_s', 'edges_per_s']
+        with open(os.path.join(self.log_dir, f'{self.name}_trace.csv'), 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=columns, restval=0)
+            writer.writeheader()
+            writer.writerows(self.rows)
+        with open(os.path.join(self.log_dir, f'{self.name}_trace.json'), 'w') as f:
+            json.dump({'stages': self.stages, 'rows': self.rows}, f)
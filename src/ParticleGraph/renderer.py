@@ -0,0 +1,373 @@
+"""
+Background rendering of the frames written by the generators and data_test.
+
+The simulation loops hand a numpy snapshot of the frame to AsyncRenderer.submit, the figure is built and saved
+by a pool of worker processes so that the loop does not wait for matplotlib. The plot functions below only take
+numpy arrays and plain values so that they can be sent to the workers.
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+import matplotlib as mpl
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib import rc
+from matplotlib.ticker import FormatStrFormatter
+from scipy.spatial import Delaunay
+
+
+class AsyncRenderer:
+    """
+    Runs plot functions in a pool of worker processes, or inline when n_workers is 0.
+    """
+
+    def __init__(self, n_workers=0):
+        self.n_workers = n_workers
+        self.futures = []
+        self.executor = None
+        if n_workers > 0:
+            # spawn: the workers do not inherit the CUDA context of the simulation
+            self.executor = ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def submit(self, fn, *args, **kwargs):
+        if self.executor is None:
+            fn(*args, **kwargs)
+            return
+        self.collect()
+        self.futures.append(self.executor.submit(fn, *args, **kwargs))
+
+    def collect(self):
+        # re-raise the errors of finished jobs without waiting for the others
+        pending = []
+        for future in self.futures:
+            if future.done():
+                future.result()
+            else:
+                pending.append(future)
+        self.futures = pending
+
+    def close(self):
+        if self.executor is not None:
+            for future in self.futures:
+                future.result()
+            self.futures = []
+            self.executor.shutdown()
+            self.executor = None
+
+
+def set_style(style):
+    if 'latex' in style:
+        plt.rcParams['text.usetex'] = True
+        rc('font', **{'family': 'serif', 'serif': ['Palatino']})
+
+
+def plot_generated_particles(dataset_name, run, it, style, particle_model_name, signal_model_name, dimension,
+                             x, X1, H1, index_particles, colors, x_dropout=None):
+    # x is the frame before the position update, X1 and H1 the states after the update
+
+    set_style(style)
+    n_particle_types = len(index_particles)
+
+    if 'bw' in style:
+
+        matplotlib.rcParams['savefig.pad_inches'] = 0
+        fig = plt.figure(figsize=(12, 12))
+        ax = fig.add_subplot(1, 1, 1)
+        s_p = 100
+        for n in range(n_particle_types):
+            plt.scatter(x[index_particles[n], 1], x[index_particles[n], 2], s=s_p, color='k')
+        if x_dropout is not None:
+            plt.scatter(x_dropout[:, 1], x_dropout[:, 2], s=25, color='k', alpha=0.75)
+            plt.plot(x_dropout[:, 1], x_dropout[:, 2], '+', color='w')
+        plt.xlim([0, 1])
+        plt.ylim([0, 1])
+        if 'PDE_G' in particle_model_name:
+            plt.xlim([-2, 2])
+            plt.ylim([-2, 2])
+        if 'latex' in style:
+            plt.xlabel(r'$x$', fontsize=64)
+            plt.ylabel(r'$y$', fontsize=64)
+            plt.xticks(fontsize=32.0)
+        elif 'frame' in style:
+            plt.xlabel(r'$x$', fontsize=64)
+            plt.ylabel(r'$y$', fontsize=64)
+            plt.xticks(fontsize=32.0)
+            plt.yticks(fontsize=32.0)
+        else:
+            plt.xticks([])
+            plt.yticks([])
+        plt.tight_layout()
+        plt.savefig(f"graphs_data/graphs_{dataset_name}/generated_data/Fig_{run}_{it}.jpg", dpi=170.7)
+        plt.close()
+
+    if 'color' in style:
+
+        if particle_model_name == 'PDE_O':
+            fig = plt.figure(figsize=(12, 12))
+            plt.scatter(H1[:, 0], H1[:, 1], s=100, c=np.sin(H1[:, 2]), vmin=-1, vmax=1, cmap='viridis')
+            plt.xlim([0, 1])
+            plt.ylim([0, 1])
+            plt.xticks([])
+            plt.yticks([])
+            plt.tight_layout()
+            plt.savefig(f"graphs_data/graphs_{dataset_name}/generated_data/Lut_Fig_{run}_{it}.jpg", dpi=170.7)
+            plt.close()
+
+            fig = plt.figure(figsize=(12, 12))
+            plt.scatter(X1[:, 0], X1[:, 1], s=10, c='lawngreen', alpha=0.75)
+            plt.xlim([0, 1])
+            plt.ylim([0, 1])
+            plt.xticks([])
+            plt.yticks([])
+            plt.tight_layout()
+            plt.savefig(f"graphs_data/graphs_{dataset_name}/generated_data/Rot_{run}_Fig{it}.jpg", dpi=170.7)
+            plt.close()
+
+        elif signal_model_name == 'PDE_N':
+
+            matplotlib.rcParams['savefig.pad_inches'] = 0
+            fig = plt.figure(figsize=(12, 12))
+            ax = fig.add_subplot(1, 1, 1)
+            ax.xaxis.set_major_locator(plt.MaxNLocator(3))
+            ax.yaxis.set_major_locator(plt.MaxNLocator(3))
+            ax.xaxis.set_major_formatter(FormatStrFormatter('%.1f'))
+            ax.yaxis.set_major_formatter(FormatStrFormatter('%.1f'))
+            plt.scatter(X1[:, 0], X1[:, 1], s=200, c=H1[:, 0], cmap='cool', vmin=0, vmax=3)
+            plt.xlim([-1.5, 1.5])
+            plt.ylim([-1.5, 1.5])
+            plt.text(0, 1.1, f'frame {it}', ha='left', va='top', transform=ax.transAxes, fontsize=24)
+            plt.xticks([])
+            plt.yticks([])
+            plt.tight_layout()
+            plt.savefig(f"graphs_data/graphs_{dataset_name}/generated_data/Fig_{run}_{10000 + it}.tif", dpi=42.675)
+            plt.close()
+
+        elif (particle_model_name == 'PDE_A') & (dimension == 3):
+
+            fig = plt.figure(figsize=(12, 12))
+            ax = fig.add_subplot(111, projection='3d')
+            for n in range(n_particle_types):
+                ax.scatter(x[index_particles[n], 1], x[index_particles[n], 2], x[index_particles[n], 3], s=50,
+                           color=colors[n])
+            ax.set_xlim([0, 1])
+            ax.set_ylim([0, 1])
+            ax.set_zlim([0, 1])
+            plt.savefig(f"graphs_data/graphs_{dataset_name}/generated_data/Fig_{run}_{it}.jpg", dpi=170.7)
+            plt.close()
+
+        else:
+
+            matplotlib.rcParams['savefig.pad_inches'] = 0
+            fig = plt.figure(figsize=(12, 12))
+            ax = fig.add_subplot(1, 1, 1)
+            ax.xaxis.get_major_formatter()._usetex = False
+            ax.yaxis.get_major_formatter()._usetex = False
+            ax.xaxis.set_major_locator(plt.MaxNLocator(3))
+            ax.yaxis.set_major_locator(plt.MaxNLocator(3))
+            ax.xaxis.set_major_formatter(FormatStrFormatter('%.1f'))
+            ax.yaxis.set_major_formatter(FormatStrFormatter('%.1f'))
+            s_p = 100
+            for n in range(n_particle_types):
+                plt.scatter(x[index_particles[n], 1], x[index_particles[n], 2], s=s_p, color=colors[n])
+            if x_dropout is not None:
+                plt.scatter(x_dropout[:, 1], x_dropout[:, 2], s=25, color='k', alpha=0.75)
+                plt.plot(x_dropout[:, 1], x_dropout[:, 2], '+', color='w')
+            plt.xlim([0, 1])
+            plt.ylim([0, 1])
+            if 'PDE_G' in particle_model_name:
+                plt.xlim([-2, 2])
+                plt.ylim([-2, 2])
+            if 'latex' in style:
+                plt.xlabel(r'$x$', fontsize=64)
+                plt.ylabel(r'$y$', fontsize=64)
+                plt.xticks(fontsize=32.0)
+                plt.yticks(fontsize=32.0)
+            elif 'frame' in style:
+                plt.xlabel('x', fontsize=32)
+                plt.ylabel('y', fontsize=32)
+                plt.xticks(fontsize=32.0)
+                plt.yticks(fontsize=32.0)
+                ax.tick_params(axis='both', which='major', pad=15)
+                plt.text(0, 1.1, f'frame {it}', ha='left', va='top', transform=ax.transAxes, fontsize=32)
+            else:
+                plt.xticks([])
+                plt.yticks([])
+            plt.tight_layout()
+            plt.savefig(f"graphs_data/graphs_{dataset_name}/generated_data/Fig_{run}_{it}.tif", dpi=170.7)
+            plt.close()
+
+
+def plot_generated_mesh(dataset_name, run, it, style, mesh_model_name, x_mesh, H1):
+
+    set_style(style)
+
+    if 'graph' in style:
+
+        fig = plt.figure(figsize=(12, 12))
+        match mesh_model_name:
+            case 'RD_RPS_Mesh':
+                H1_IM = np.reshape(x_mesh[:, 6:9], (100, 100, 3))
+                plt.imshow(H1_IM, vmin=0, vmax=1)
+            case 'Wave_Mesh' | 'DiffMesh':
+                pts = x_mesh[:, 1:3]
+                tri = Delaunay(pts)
+                colors = np.sum(x_mesh[tri.simplices, 6], axis=1) / 3.0
+                plt.tripcolor(pts[:, 0], pts[:, 1], tri.simplices.copy(), facecolors=colors, edgecolors='k',
+                              vmin=-2500, vmax=2500)
+                plt.xlim([0, 1])
+                plt.ylim([0, 1])
+        plt.xticks([])
+        plt.yticks([])
+        plt.tight_layout()
+        plt.savefig(f"graphs_data/graphs_{dataset_name}/generated_data/Fig_g_color_{it}.tif", dpi=300)
+        plt.close()
+
+    if 'color' in style:
+
+        matplotlib.rcParams['savefig.pad_inches'] = 0
+        fig = plt.figure(figsize=(12, 12))
+        ax = fig.add_subplot(1, 1, 1)
+        ax.xaxis.get_major_formatter()._usetex = False
+        ax.yaxis.get_major_formatter()._usetex = False
+        ax.xaxis.set_major_locator(plt.MaxNLocator(3))
+        ax.yaxis.set_major_locator(plt.MaxNLocator(3))
+        ax.xaxis.set_major_formatter(FormatStrFormatter('%.1f'))
+        ax.yaxis.set_major_formatter(FormatStrFormatter('%.1f'))
+
+        pts = x_mesh[:, 1:3]
+        tri = Delaunay(pts)
+        colors = np.sum(x_mesh[tri.simplices, 6], axis=1) / 3.0
+        match mesh_model_name:
+            case 'DiffMesh':
+                plt.tripcolor(pts[:, 0], pts[:, 1], tri.simplices.copy(), facecolors=colors, vmin=0, vmax=1000)
+            case 'WaveMesh':
+                plt.tripcolor(pts[:, 0], pts[:, 1], tri.simplices.copy(), facecolors=colors, vmin=-1000, vmax=1000)
+                fmt = lambda x, pos: '{:.1f}'.format((x) / 100, pos)
+                ax.yaxis.set_major_formatter(mpl.ticker.FuncFormatter(fmt))
+                ax.xaxis.set_major_formatter(mpl.ticker.FuncFormatter(fmt))
+                plt.xlim([0, 1])
+                plt.ylim([0, 1])
+            case 'RD_Gray_Scott_Mesh':
+                fig = plt.figure(figsize=(12, 6))
+                ax = fig.add_subplot(1, 2, 1)
+                plt.tripcolor(pts[:, 0], pts[:, 1], tri.simplices.copy(), facecolors=colors, vmin=0, vmax=1)
+                plt.xticks([])
+                plt.yticks([])
+                plt.axis('off')
+            case 'RD_RPS_Mesh' | 'RD_RPS_Mesh_bis':
+                H1_IM = np.reshape(H1, (100, 100, 3))
+                plt.imshow(H1_IM, vmin=0, vmax=1)
+                fmt = lambda x, pos: '{:.1f}'.format((x) / 100, pos)
+                ax.yaxis.set_major_formatter(mpl.ticker.FuncFormatter(fmt))
+                ax.xaxis.set_major_formatter(mpl.ticker.FuncFormatter(fmt))
+        if 'latex' in style:
+            plt.xlabel(r'$x$', fontsize=64)
+            plt.ylabel(r'$y$', fontsize=64)
+            plt.xticks(fontsize=32.0)
+            plt.yticks(fontsize=32.0)
+        elif 'frame' in style:
+            plt.xlabel('x', fontsize=32)
+            plt.ylabel('y', fontsize=32)
+            plt.xticks(fontsize=32.0)
+            plt.yticks(fontsize=32.0)
+            ax.tick_params(axis='both', which='major', pad=15)
+            plt.text(0, 1.1, f'frame {it}', ha='left', va='top', transform=ax.transAxes, fontsize=32)
+        else:
+            plt.xticks([])
+            plt.yticks([])
+
+        plt.tight_layout()
+        plt.savefig(f"graphs_data/graphs_{dataset_name}/generated_data/Fig_{run}_{it}.tif", dpi=170.7)
+        plt.close()
+
+
+def plot_test_frame(file_name, style, particle_model_name, mesh_model_name, signal_model_name, x,
+                    index_particles, colors, s_p=100, has_mesh=False, has_field=False):
+
+    matplotlib.rcParams['savefig.pad_inches'] = 0
+    set_style(style)
+
+    fig = plt.figure(figsize=(12, 12))
+    ax = fig.add_subplot(1, 1, 1)
+    ax.xaxis.set_major_locator(plt.MaxNLocator(3))
+    ax.yaxis.set_major_locator(plt.MaxNLocator(3))
+    ax.xaxis.set_major_formatter(FormatStrFormatter('%.1f'))
+    ax.yaxis.set_major_formatter(FormatStrFormatter('%.1f'))
+    if has_mesh:
+        pts = x[:, 1:3]
+        tri = Delaunay(pts)
+        colors_mesh = np.sum(x[tri.simplices, 6], axis=1) / 3.0
+        if mesh_model_name == 'DiffMesh':
+            plt.tripcolor(pts[:, 0], pts[:, 1], tri.simplices.copy(), facecolors=colors_mesh, vmin=0, vmax=1000)
+        if mesh_model_name == 'WaveMesh':
+            plt.tripcolor(pts[:, 0], pts[:, 1], tri.simplices.copy(), facecolors=colors_mesh, vmin=-1000, vmax=1000)
+            fmt = lambda x, pos: '{:.1f}'.format((x) / 100, pos)
+            ax.yaxis.set_major_formatter(mpl.ticker.FuncFormatter(fmt))
+            ax.xaxis.set_major_formatter(mpl.ticker.FuncFormatter(fmt))
+        if mesh_model_name == 'RD_Gray_Scott_Mesh':
+            fig = plt.figure(figsize=(12, 6))
+            ax = fig.add_subplot(1, 2, 1)
+            plt.tripcolor(pts[:, 0], pts[:, 1], tri.simplices.copy(), facecolors=colors_mesh, vmin=0, vmax=1)
+            plt.xticks([])
+            plt.yticks([])
+            plt.axis('off')
+            ax = fig.add_subplot(1, 2, 2)
+            colors_mesh = np.sum(x[tri.simplices, 7], axis=1) / 3.0
+            plt.tripcolor(pts[:, 0], pts[:, 1], tri.simplices.copy(), facecolors=colors_mesh, vmin=0, vmax=1)
+            plt.xticks([])
+            plt.yticks([])
+            plt.axis('off')
+        if (mesh_model_name == 'RD_RPS_Mesh') | (mesh_model_name == 'RD_RPS_Mesh_bis'):
+            H1_IM = np.reshape(x[:, 6:9], (100, 100, 3))
+            plt.imshow(H1_IM, vmin=0, vmax=1)
+            fmt = lambda x, pos: '{:.1f}'.format((x) / 100, pos)
+            ax.yaxis.set_major_formatter(mpl.ticker.FuncFormatter(fmt))
+            ax.xaxis.set_major_formatter(mpl.ticker.FuncFormatter(fmt))
+    elif signal_model_name == 'PDE_N':
+
+        fig = plt.figure(figsize=(12, 12))
+        ax = fig.add_subplot(1, 1, 1)
+        ax.xaxis.set_major_locator(plt.MaxNLocator(3))
+        ax.yaxis.set_major_locator(plt.MaxNLocator(3))
+        ax.xaxis.set_major_formatter(FormatStrFormatter('%.1f'))
+        ax.yaxis.set_major_formatter(FormatStrFormatter('%.1f'))
+        plt.scatter(x[:, 1], x[:, 2], s=200, c=x[:, 6], cmap='cool', vmin=0, vmax=3)
+        plt.xlim([-1.5, 1.5])
+        plt.ylim([-1.5, 1.5])
+        plt.xticks(fontsize=32.0)
+        plt.yticks(fontsize=32.0)
+        ax.tick_params(axis='both', which='major', pad=15)
+        plt.text(0, 1.1, f'   ', ha='left', va='top', transform=ax.transAxes, fontsize=32)
+        plt.tight_layout()
+    else:
+        for n in range(len(index_particles)):
+            if has_field:
+                plt.scatter(x[index_particles[n], 1], 1 - x[index_particles[n], 2], s=s_p, color=colors[n])
+            else:
+                plt.scatter(x[index_particles[n], 1], x[index_particles[n], 2], s=s_p, color=colors[n])
+    if 'latex' in style:
+        plt.xlabel(r'$x$', fontsize=64)
+        plt.ylabel(r'$y$', fontsize=64)
+        plt.xticks(fontsize=32.0)
+        plt.yticks(fontsize=32.0)
+    elif 'frame' in style:
+        plt.xlabel('x', fontsize=32)
+        plt.ylabel('y', fontsize=32)
+        plt.xticks(fontsize=32.0)
+        plt.yticks(fontsize=32.0)
+        plt.text(0, 1.1, f'   ', ha='left', va='top', transform=ax.transAxes, fontsize=32)
+        ax.tick_params(axis='both', which='major', pad=15)
+    else:
+        plt.xticks([])
+        plt.yticks([])
+    if not (('RD_RPS_Mesh' in mesh_model_name) | (signal_model_name == 'PDE_N')):
+        plt.xlim([0, 1])
+        plt.ylim([0, 1])
+    if 'PDE_G' in particle_model_name:
+        plt.xlim([-2, 2])
+        plt.ylim([-2, 2])
+
+    plt.tight_layout()
+    plt.savefig(file_name, dpi=170.7)
+    plt.close()
@@ -0,0 +1,133 @@
+"""
+On-disk storage of simulated trajectories.
+
+A run is a list of per-frame tensors (x_list, y_list). Besides the pickled `{path}.pt` list, a run can be
+stored as one contiguous float32 array `{path}.dat` with a row offset per frame `{path}_index.npy`. The
+memmap file is opened lazily and frame k is a zero-copy slice of it, so runs larger than memory can be
+used for training and loading does not unpickle thousands of small tensors.
+"""
+import os
+
+import numpy as np
+import torch
+
+from ParticleGraph.utils import to_numpy
+
+
+class Trajectory:
+    """
+    List-like view of a memmap trajectory, `trajectory[k]` returns frame k as a tensor.
+
+    Frames read on a non-CPU device are copies, a modified frame is written back with `trajectory[k] = frame`, as for
+    a list of tensors. Changes are kept in the copy-on-write memory of the Trajectory, the file itself is never written.
+    """
+
+    def __init__(self, path, device='cpu'):
+        self.path = path
+        self.device = device
+        index = np.load(f'{path}_index.npy')
+        self.offsets = index[:-2]
+        self.n_columns = int(index[-2])
+        self.ndim = int(index[-1])
+        self.n_frames = len(self.offsets) - 1
+        self._data = None
+
+    @property
+    def data(self):
+        # opened on first access so that a Trajectory can be pickled to worker processes
+        if self._data is None:
+            n_rows = int(self.offsets[-1])
+            if n_rows == 0:
+                self._data = np.zeros((0, self.n_columns), dtype=np.float32)
+            else:
+                # copy-on-write: frames can be modified in memory without touching the file
+                self._data = np.memmap(f'{self.path}.dat', dtype=np.float32, mode='c', shape=(n_rows, self.n_columns))
+        return self._data
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_data'] = None
+        return state
+
+    def __len__(self):
+        return self.n_frames
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return [self[i] for i in range(*k.indices(self.n_frames))]
+        if k < 0:
+            k += self.n_frames
+        if (k < 0) | (k >= self.n_frames):
+            raise IndexError(f'frame {k} out of range for trajectory with {self.n_frames} frames')
+        frame = torch.from_numpy(self.data[self.offsets[k]:self.offsets[k + 1]])
+        if self.ndim == 1:
+            frame = frame[:, 0]
+        if torch.device(self.device).type != 'cpu':
+            frame = frame.to(self.device)
+        return frame
+
+    def __setitem__(self, k, frame):
+        self.update(k, frame)
+
+    def update(self, k, frame):
+        """
+        Write frame k back to the copy-on-write memmap, the frame must keep its number of rows.
+        """
+        if k < 0:
+            k += self.n_frames
+        if (k < 0) | (k >= self.n_frames):
+            raise IndexError(f'frame {k} out of range for trajectory with {self.n_frames} frames')
+        n_rows = int(self.offsets[k + 1] - self.offsets[k])
+        if len(frame) != n_rows:
+            raise ValueError(f'frame {k} has {n_rows} rows, got {len(frame)}')
+        self.data[self.offsets[k]:self.offsets[k + 1]] = to_numpy(frame).reshape(n_rows, self.n_columns)
+
+    def __iter__(self):
+        for k in range(self.n_frames):
+            yield self[k]
+
+
+def save_trajectory(frames, path, format='pt'):
+    """
+    Save a list of per-frame tensors with the same number of columns.
+
+    Args:
+        frames (list): per-frame tensors of shape (n_rows, n_columns), n_rows may vary across frames.
+        path (str): file name without extension.
+        format (str): 'pt' for a pickled list of tensors, 'memmap' for a contiguous array and frame index.
+    """
+    match format:
+        case 'pt':
+            torch.save(frames, f'{path}.pt')
+            for f in (f'{path}.dat', f'{path}_index.npy'):
+                if os.path.exists(f):
+                    os.remove(f)
+        case 'memmap':
+            offsets = np.zeros(len(frames) + 1, dtype=np.int64)
+            n_columns = 0
+            ndim = 2
+            with open(f'{path}.dat', 'wb') as f:
+                for k, frame in enumerate(frames):
+                    ndim = frame.dim()
+                    frame = to_numpy(frame).astype(np.float32).reshape(len(frame), -1)
+                    n_columns = frame.shape[1]
+                    f.write(np.ascontiguousarray(frame).tobytes())
+                    offsets[k + 1] = offsets[k] + len(frame)
+            # the number of columns and the frame dimension are appended after the frame offsets
+            np.save(f'{path}_index.npy', np.append(offsets, [n_columns, ndim]))
+            if os.path.exists(f'{path}.pt'):
+                os.remove(f'{path}.pt')
+        case _:
+            raise ValueError(f'Unknown trajectory format {format}')
+
+
+def load_trajectory(path, device='cpu'):
+    """
+    Load a run saved by save_trajectory, the memmap format is used when present.
+
+    Returns:
+        Trajectory or list: frames indexable as trajectory[k].
+    """
+    if os.path.exists(f'{path}_index.npy'):
+        return Trajectory(path, device=device)
+    return torch.load(f'{path}.pt', map_location=device)
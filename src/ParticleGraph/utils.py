@@ -125,6 +125,20 @@ def choose_boundary_values(bc_name):
             raise ValueError(f'Unknown boundary condition {bc_name}')
 
 
+def mesh_laplacian(edge_index, edge_weight, n_nodes, n_graphs=1):
+    """
+    Sparse CSR matrix L of a mesh Laplacian, L @ u is the sum of edge_weight * u_j over the edges j -> i, as
+    computed by MessagePassing.propagate with aggr='add'. With n_graphs > 1, L is block diagonal over n_graphs
+    copies of the mesh, matching a DataLoader batch of n_graphs frames.
+    """
+    offsets = torch.arange(n_graphs, device=edge_index.device) * n_nodes
+    rows = (edge_index[1][None, :] + offsets[:, None]).flatten()
+    cols = (edge_index[0][None, :] + offsets[:, None]).flatten()
+    L = torch.sparse_coo_tensor(torch.stack((rows, cols)), edge_weight.repeat(n_graphs),
+                                (n_nodes * n_graphs, n_nodes * n_graphs))
+    return L.coalesce().to_sparse_csr()
+
+
 def grads2D(params):
     params_sx = torch.roll(params, -1, 0)
     params_sy = torch.roll(params, -1, 1)